@@ -0,0 +1,77 @@
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+from dicomplan.cache import BuildCache, model_digest
+from dicomplan.config_parser import get_model_from_args
+from dicomplan.dicom import Dicom
+from dicomplan.export import EXPORT_FORMATS, export_spots
+from dicomplan.geometry import geometry_for_model
+from dicomplan.machine import machine_for_model
+from dicomplan.montecarlo import export_mc, mc_format
+from dicomplan.stats import write_statistics
+from dicomplan.validate import has_errors
+
+logger = logging.getLogger(__name__)
+
+
+def build_plan(args) -> Optional[int]:
+    """
+    Build and write the plan described by parsed command line arguments.
+    Returns None on success or 1 if the plan was not written, like main().
+    """
+    # Populate the model from the parsed arguments
+    m = get_model_from_args(args)
+
+    if m.export_spots_path is not None and Path(m.export_spots_path).suffix.lower() not in EXPORT_FORMATS:
+        logger.error(f"Unknown spot export format {m.export_spots_path}, use one of {', '.join(EXPORT_FORMATS)}")
+        return 1
+    if m.export_mc_path is not None:
+        try:
+            mc_format(m.export_mc_path)
+        except ValueError as e:
+            logger.error(str(e))
+            return 1
+
+    # skip plans whose inputs did not change since the last build, or copy them from the cache.
+    # The spot exports and statistics need the layers of a build, so plans with them are always built.
+    cache = None
+    if args.cache is not None and m.output_path is not None:
+        cache = BuildCache(args.cache)
+        digest = model_digest(m, plot=m.plot_dose)
+        plot = m.plot_dose_filepath if m.plot_dose else None
+        if m.export_spots_path is None and m.stats_path is None and m.export_mc_path is None:
+            if cache.is_current(m.output_path, digest) and (plot is None or os.path.isfile(plot)):
+                logger.info(f"{m.output_path} is up to date")
+                return None
+            if cache.restore(digest, m.output_path, plot):
+                logger.info(f"Plan copied from cache to {m.output_path}")
+                return None
+
+    d = Dicom()
+    try:
+        d.apply_model(m)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+
+    if has_errors(d.issues) and not args.force:
+        logger.error("Plan failed validation, not written. Use --force to write it anyway.")
+        return 1
+
+    if m.output_path is None:
+        logger.error("Output path is not set. Cannot write DICOM file.")
+        return 1
+    d.write(m.output_path)
+    if cache is not None:
+        cache.store(digest, m.output_path, plot)
+    if m.export_spots_path is not None:
+        export_spots(m.export_spots_path, d.layers, geometry_for_model(m), m.export_frame)
+    if m.export_mc_path is not None:
+        export_mc(m.export_mc_path, d.layers, machine_for_model(m))
+    if m.stats_path is not None:
+        write_statistics(m.stats_path, d.stats)
+
+    logger.info(f"Plan written to {m.output_path}")
+    return None
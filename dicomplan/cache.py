@@ -0,0 +1,137 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+from dicomplan.__version__ import __version__
+from dicomplan.machine import is_profile_file
+from dicomplan.model import PlanInputModel
+
+logger = logging.getLogger(__name__)
+
+# fixed timestamp of reproducible builds, same as the static InstanceCreationDate/Time
+REPRODUCIBLE_TIMESTAMP = datetime.datetime(2025, 1, 1, 12, 0, 0)
+
+# one small record file per output, so concurrent builds never overwrite each other's records
+RECORD_DIR = "outputs"
+
+
+def file_digest(path: str) -> str:
+    """
+    Return the SHA-256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_digest(model: PlanInputModel, plot: bool = False) -> str:
+    """
+    Return the content hash of a plan: the canonical model, the content of its input files
+    (image, spot map, machine profile) and the dicomplan version. With plot=True the dose plot options
+    are included, for caching the plan together with its dose plot.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"dicomplan {__version__}\n".encode())
+    digest.update(model.canonical(plot).encode())
+    if model.spot_image_path is not None:
+        digest.update(b"\nimage ")
+        digest.update(file_digest(model.spot_image_path).encode())
+    if model.spot_custom_path is not None:
+        digest.update(b"\nspots ")
+        digest.update(file_digest(model.spot_custom_path).encode())
+    if model.field_machine_profile is not None and is_profile_file(model.field_machine_profile):
+        digest.update(b"\nmachine ")
+        digest.update(file_digest(model.field_machine_profile).encode())
+    return digest.hexdigest()
+
+
+def build_timestamp(reproducible: bool = False) -> datetime.datetime:
+    """
+    Return the timestamp stamped into a plan. Reproducible builds use SOURCE_DATE_EPOCH if set,
+    otherwise REPRODUCIBLE_TIMESTAMP.
+    """
+    if not reproducible:
+        return datetime.datetime.now()
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        return datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc).replace(tzinfo=None)
+    return REPRODUCIBLE_TIMESTAMP
+
+
+class BuildCache:
+    """
+    Content addressed store of built plans. Objects are stored as <digest>.dcm (and <digest>.png for
+    the dose plot), and a record per output file holds the digest it was last built from, so
+    unchanged outputs are skipped without reading them.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.records = self.directory / RECORD_DIR
+        self.records.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest: str, suffix: str = ".dcm") -> Path:
+        return self.directory / f"{digest}{suffix}"
+
+    def record_path(self, output: str) -> Path:
+        """
+        Return the record file of an output, named by the hash of its resolved path.
+        """
+        key = hashlib.sha256(str(Path(output).resolve()).encode()).hexdigest()
+        return self.records / f"{key}.json"
+
+    def is_current(self, output: str, digest: str) -> bool:
+        """
+        Return True if output exists, was built from digest and has not been modified since.
+        """
+        try:
+            entry = json.loads(self.record_path(output).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        if entry.get('digest') != digest:
+            return False
+        try:
+            st = os.stat(output)
+        except FileNotFoundError:
+            return False
+        return st.st_size == entry.get('size') and st.st_mtime_ns == entry.get('mtime_ns')
+
+    def restore(self, digest: str, output: str, plot: Optional[str] = None) -> bool:
+        """
+        Copy a cached plan (and dose plot) to the output paths. Returns False if it is not cached.
+        """
+        dcm = self.object_path(digest)
+        png = self.object_path(digest, ".png")
+        if not dcm.is_file() or (plot is not None and not png.is_file()):
+            return False
+        shutil.copyfile(dcm, output)
+        if plot is not None:
+            shutil.copyfile(png, plot)
+        self.record(output, digest)
+        return True
+
+    def store(self, digest: str, output: str, plot: Optional[str] = None):
+        """
+        Add a freshly built plan (and dose plot) to the cache and record the output.
+        """
+        shutil.copyfile(output, self.object_path(digest))
+        if plot is not None and Path(plot).is_file():
+            shutil.copyfile(plot, self.object_path(digest, ".png"))
+        self.record(output, digest)
+
+    def record(self, output: str, digest: str):
+        st = os.stat(output)
+        entry = {'output': str(Path(output).resolve()), 'digest': digest, 'size': st.st_size,
+                 'mtime_ns': st.st_mtime_ns}
+        # write to a temporary file first, so concurrent or interrupted runs never leave a broken record
+        path = self.record_path(output)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(entry, indent=1, sort_keys=True))
+        os.replace(tmp, path)
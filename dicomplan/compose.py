@@ -0,0 +1,221 @@
+import ast
+import logging
+from typing import Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EDGE_TOLERANCE = 1e-6  # cm, spots this close outside a shape edge are still inside
+SHAPE_PARAMETERS = {
+    'square': ('dx', 'dy', 'x', 'y'),  # width, height and centre [cm], dy defaults to dx
+    'circle': ('diameter', 'x', 'y'),  # diameter and centre [cm]
+}
+OPERATORS = {ast.BitOr: 'union', ast.Add: 'union', ast.Sub: 'difference', ast.BitAnd: 'intersection'}
+
+Lattice = tuple[float, bool]  # spacing [cm], hexagonal
+BBox = tuple[float, float, float, float]  # xmin, ymin, xmax, ymax [cm]
+
+
+class ShapeTerm:
+    """
+    A square or circle of a shape expression, with the lattice its spots are placed on.
+    """
+
+    def __init__(self, kind: str, parameters: dict[str, float], lattice: Lattice):
+        self.kind = kind
+        self.parameters = parameters
+        self.lattice = lattice
+
+    def bbox(self) -> BBox:
+        p = self.parameters
+        if self.kind == 'square':
+            half_x, half_y = p['dx'] / 2, p.get('dy', p['dx']) / 2
+        else:
+            half_x = half_y = p['diameter'] / 2
+        x, y = p.get('x', 0.0), p.get('y', 0.0)
+        return x - half_x, y - half_y, x + half_x, y + half_y
+
+    def contains(self, xy: np.ndarray) -> np.ndarray:
+        p = self.parameters
+        dx, dy = xy[:, 0] - p.get('x', 0.0), xy[:, 1] - p.get('y', 0.0)
+        if self.kind == 'square':
+            return (np.abs(dx) <= p['dx'] / 2 + EDGE_TOLERANCE) & \
+                (np.abs(dy) <= p.get('dy', p['dx']) / 2 + EDGE_TOLERANCE)
+        return dx**2 + dy**2 <= (p['diameter'] / 2 + EDGE_TOLERANCE)**2
+
+    def lattices(self) -> set[Lattice]:
+        return {self.lattice}
+
+
+class ShapeOperation:
+    """
+    Union, difference or intersection of two shape expressions.
+    """
+
+    def __init__(self, operation: str, left: 'Shape', right: 'Shape'):
+        self.operation = operation
+        self.left = left
+        self.right = right
+
+    def bbox(self) -> BBox:
+        a, b = self.left.bbox(), self.right.bbox()
+        if self.operation == 'union':
+            return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+        if self.operation == 'difference':
+            return a
+        return max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+
+    def contains(self, xy: np.ndarray) -> np.ndarray:
+        inside = self.left.contains(xy)
+        if self.operation == 'union':
+            return inside | self.right.contains(xy)
+        if self.operation == 'difference':
+            return inside & ~self.right.contains(xy)
+        return inside & self.right.contains(xy)
+
+    def lattices(self) -> set[Lattice]:
+        return self.left.lattices() | self.right.lattices()
+
+
+Shape = Union[ShapeTerm, ShapeOperation]
+
+
+def parse_shape_expression(text: str, spacing: float, hexagonal: bool = False) -> Shape:
+    """
+    Parse a shape expression such as "square(10, 8) - circle(3, x=1)" or "circle(4, -2) | circle(4, 2)".
+
+    Terms are square(dx, dy=dx, x=0, y=0) and circle(diameter, x=0, y=0) in cm, centred on (x, y),
+    combined with | or + (union), - (difference) and & (intersection) and grouped with parentheses.
+    Every term is placed on the lattice of spacing [cm] and hexagonal, unless it sets its own with the
+    spacing= and hex= keywords.
+    """
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid shape expression '{text}': {e.msg}") from None
+    return _parse_node(tree.body, (spacing, hexagonal))
+
+
+def _parse_node(node: ast.AST, lattice: Lattice) -> Shape:
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        return ShapeOperation(OPERATORS[type(node.op)], _parse_node(node.left, lattice),
+                              _parse_node(node.right, lattice))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in SHAPE_PARAMETERS:
+        names = SHAPE_PARAMETERS[node.func.id]
+        if len(node.args) > len(names):
+            raise ValueError(f"{node.func.id}() takes at most {len(names)} positional arguments")
+        parameters = {name: _number(arg) for name, arg in zip(names, node.args)}
+        spacing, hexagonal = lattice
+        for keyword in node.keywords:
+            if keyword.arg == 'spacing':
+                spacing = _number(keyword.value)
+            elif keyword.arg == 'hex':
+                hexagonal = bool(_number(keyword.value))
+            elif keyword.arg in names and keyword.arg not in parameters:
+                parameters[keyword.arg] = _number(keyword.value)
+            else:
+                raise ValueError(f"Unexpected or repeated argument '{keyword.arg}' of {node.func.id}()")
+        if names[0] not in parameters:
+            raise ValueError(f"{node.func.id}() needs its {names[0]}")
+        if spacing is None or spacing <= 0:
+            raise ValueError(f"The spot spacing of {ast.unparse(node)} must be positive")
+        return ShapeTerm(node.func.id, parameters, (float(spacing), hexagonal))
+    raise ValueError(f"Unsupported shape expression element '{ast.unparse(node)}', "
+                     f"use {', '.join(SHAPE_PARAMETERS)} and the operators | + - &")
+
+
+def _number(node: ast.AST) -> float:
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _number(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return float(node.value)
+    raise ValueError(f"Expected a number, got '{ast.unparse(node)}'")
+
+
+def lattice_points(bbox: BBox, lattice: Lattice) -> np.ndarray:
+    """
+    Return the (N, 2) points of a lattice anchored at the origin within bbox, x-major like the square
+    pattern. Hexagonal lattices have rows spacing * sqrt(3) / 2 apart, odd rows shifted by half a spacing.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    spacing, hexagonal = lattice
+    if xmin > xmax or ymin > ymax:
+        return np.empty((0, 2))
+    row_spacing = spacing * np.sqrt(3) / 2 if hexagonal else spacing
+    eps = spacing * 1e-6
+    rows = np.arange(np.ceil((ymin - eps) / row_spacing), np.floor((ymax + eps) / row_spacing) + 1)
+    shift = 0.5 if hexagonal else 0.0
+    columns = np.arange(np.ceil((xmin - eps) / spacing - shift), np.floor((xmax + eps) / spacing) + 1)
+    k, j = np.meshgrid(columns, rows, indexing='ij')
+    x = (k + shift * (j % 2)) * spacing
+    xy = np.column_stack((x.ravel(), (j * row_spacing).ravel()))
+    return xy[(xy[:, 0] >= xmin - eps) & (xy[:, 0] <= xmax + eps)]
+
+
+def compose_spots(shape: Shape, min_distance: Optional[float] = None) -> np.ndarray:
+    """
+    Return the (N, 2) spot positions [cm] of a shape expression.
+
+    Expressions on a single lattice are evaluated as one boolean mask of the lattice points within the
+    expression's bounding box. Otherwise the operands are evaluated separately: a difference or
+    intersection keeps the left operand's spots outside or inside the right operand's area, and a union
+    adds the right operand's spots which are at least min_distance (default half the smallest spacing of
+    the two operands) from every spot of the left operand, found with a spatial hash grid.
+    """
+    lattices = shape.lattices()
+    if len(lattices) == 1:
+        xy = lattice_points(shape.bbox(), next(iter(lattices)))
+        return xy[shape.contains(xy)]
+
+    left = compose_spots(shape.left, min_distance)
+    if shape.operation == 'difference':
+        return left[~shape.right.contains(left)]
+    if shape.operation == 'intersection':
+        return left[shape.right.contains(left)]
+    right = compose_spots(shape.right, min_distance)
+    distance = min_distance if min_distance is not None else min(s for s, _ in lattices) / 2
+    duplicate = within_distance(right, left, distance)
+    logger.debug(f"Union of {len(left)} and {len(right)} spots, {np.count_nonzero(duplicate)} closer than "
+                 f"{distance} cm dropped")
+    return np.concatenate((left, right[~duplicate]))
+
+
+def within_distance(points: np.ndarray, reference: np.ndarray, distance: float) -> np.ndarray:
+    """
+    Return a mask of the (N, 2) points closer than distance to any of the (M, 2) reference points.
+
+    The reference points are hashed into a dense table of square cells no smaller than distance, and about
+    one point per cell on average, so every point only compares against the reference points in the 3 x 3
+    cells around its own cell: linear in N + M.
+    """
+    near = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(reference) == 0:
+        return near
+    lo = np.minimum(points.min(axis=0), reference.min(axis=0))
+    extent = np.maximum(np.maximum(points.max(axis=0), reference.max(axis=0)) - lo, 1e-12)
+    cell = max(distance, float(np.sqrt(extent[0] * extent[1] / len(reference))),
+               float(extent.max()) / len(reference), 1e-9)
+    shape = (extent // cell).astype(np.int64) + 1
+
+    ij = ((reference - lo) // cell).astype(np.int64)
+    key = ij[:, 0] * shape[1] + ij[:, 1]
+    order = np.argsort(key, kind='stable')
+    counts = np.bincount(key, minlength=int(shape[0] * shape[1]))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    pi, pj = (((points - lo) // cell).astype(np.int64)).T
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            ni, nj = pi + di, pj + dj
+            inside = (ni >= 0) & (ni < shape[0]) & (nj >= 0) & (nj < shape[1])
+            candidates = np.flatnonzero(inside)
+            neighbour = ni[inside] * shape[1] + nj[inside]
+            count = counts[neighbour]
+            for slot in range(int(count.max()) if len(count) else 0):
+                has = count > slot
+                p, other = candidates[has], order[starts[neighbour[has]] + slot]
+                d2 = (points[p, 0] - reference[other, 0])**2 + (points[p, 1] - reference[other, 1])**2
+                near[p[d2 < distance**2]] = True
+    return near
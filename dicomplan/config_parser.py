@@ -2,7 +2,13 @@ import argparse
 import subprocess
 from dicomplan.__version__ import __version__, __commit_id__
 
+from dicomplan.geometry import FRAMES
+from dicomplan.gamma import DEFAULT_SEARCH_RADIUS, DEFAULT_SUBSAMPLES
+from dicomplan.halftone import HALFTONE_MODES
+from dicomplan.index import DEFAULT_INDEX, ENERGY_TOLERANCE
 from dicomplan.model import PlanInputModel
+from dicomplan.montecarlo import DEFAULT_HISTORIES, MC_FORMATS
+from dicomplan.machine import DEFAULT_MACHINE, is_profile_file, load_machine
 
 
 def _version_string() -> str:
@@ -23,7 +29,8 @@ DEFAULT_ENERGY = 120.0  # MeV
 DEFAULT_FIELD_WIDTH = 10.0  # cm
 DEFAULT_FIELD_HEIGHT = 10.0  # cm
 DEFAULT_FIELD_DIAMETER = 10.0  # cm
-DEFAULT_FWHMS = "1.000,1.000"  # cm, default FWHM for dose plot Gaussian kernel, as two values for x and y (e.g. "0.893,0.615")
+DEFAULT_SCENARIOS = 100  # robustness error scenarios
+DEFAULT_FWHMS = "1.000,1.000"  # cm, example FWHM for dose plot Gaussian kernel, as two values for x and y (e.g. "0.893,0.615")
 
 
 def parse_arguments(args=None):
@@ -36,12 +43,16 @@ def parse_arguments(args=None):
                         help='Path to output DICOM file')
     parser.add_argument('-g', '--gantry_angle', type=str, default=90.0,
                         help='Gantry angle [degrees]. ')
+    parser.add_argument('-ca', '--couch_angle', type=float, default=0.0,
+                        help='Patient support (couch) angle [degrees]')
     parser.add_argument('-tp', '--table_position', type=str, default="0.0,0.0,0.0",
                         help='New table position vertical,longitudinal,lateral [cm].')
     parser.add_argument('-sp', '--snout_position', type=float, default="42.1",
                         help='Set new snout position [cm]')
-    parser.add_argument('-tm', '--treatment_machine', type=str, default="tr4",
-                        help='Treatment Machine Name')
+    parser.add_argument('-tm', '--treatment_machine', type=str, default=None,
+                        help='Treatment Machine Name, or path to a machine profile (.toml/.json). \
+                            Selects the beam model and enforces the machine MU limits. Default: tr4, \
+                            without MU limits')
     parser.add_argument('-pl', '--plan_label', type=str, default="DefaultLabel",
                         help='Set plan label')
     parser.add_argument('-pn', '--patient_name', type=str, default="DefaultName",
@@ -52,6 +63,42 @@ def parse_arguments(args=None):
                         help='Set reviewer name')
     parser.add_argument('-on', '--operator_name', type=str, default="DefaultOperator",
                         help='Set operator name')
+    parser.add_argument('--repaint', type=int, default=1,
+                        help='Number of paintings per spot, for interplay studies')
+    parser.add_argument('--repaint_mode', type=str, default='layered', choices=['layered', 'volumetric'],
+                        help='Repaint each energy layer in turn (layered), or the full layer stack (volumetric)')
+    parser.add_argument('--min_mu_per_spot', type=float, default=None,
+                        help='Machine minimum MU per spot and painting. Limits the number of paintings of low-MU spots')
+    parser.add_argument('--max_mu_per_spot', type=float, default=None,
+                        help='Machine maximum MU per spot and painting. High-MU spots get extra paintings')
+    parser.add_argument('--mu_resolution', type=float, default=None,
+                        help='Machine MU resolution. Spot MU are rounded to multiples of this, conserving total MU')
+    parser.add_argument('--low_mu_policy', type=str, default='drop', choices=['drop', 'merge', 'round'],
+                        help='Spots below --min_mu_per_spot are dropped, merged into the nearest spot, \
+                            or rounded to the minimum')
+    parser.add_argument('--max_spots_per_cp', type=int, default=None,
+                        help='Maximum spots per control point pair, larger layers are split into several pairs \
+                            at the same energy. Default is the machine limit')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Write the plan even if it fails validation against the machine limits')
+    parser.add_argument('--reproducible', action='store_true', default=False,
+                        help='Reproducible output: fixed timestamp (SOURCE_DATE_EPOCH if set) and UIDs derived '
+                             'from the plan content, so identical inputs give identical files')
+    parser.add_argument('--cache', type=str, default=None, metavar='DIR',
+                        help='Build cache directory. Plans whose inputs did not change are skipped or copied '
+                             'from the cache. Implies --reproducible')
+    parser.add_argument('--export_spots', '--export-spots', type=str, default=None, metavar='FILE',
+                        help='Export the spot list (layer, energy, x, y [mm], MU) to FILE: .npz, .csv, or .npy '
+                             '(structured array, readable with np.load(FILE, mmap_mode="r"))')
+    parser.add_argument('--export_frame', type=str, default='beam', choices=list(FRAMES),
+                        help='Coordinate frame of the exported spot positions (IEC 61217): beam (x, y in the '
+                             'isocentre plane), or x, y, z [mm] in the gantry, room, support or table frame')
+    parser.add_argument('--stats', type=str, default=None, metavar='FILE',
+                        help='Write plan statistics to FILE as JSON: MU per spot, spot spacing and density, '
+                             'bounding box and rim spots per layer')
+    parser.add_argument('--export_mc', '--export-mc', type=str, default=None, metavar='FILE',
+                        help='Export the plan as Monte Carlo beam source: SHIELD-HIT12A sobp.dat spot list (.dat) '
+                             'or TOPAS parameter file (.txt)')
     parser.add_argument('-v', '--verbosity', action='count', default=0,
                         help='Give more output. Option is additive, can be used up to 3 times')
     parser.add_argument('-V', '--version', action='version',
@@ -60,9 +107,15 @@ def parse_arguments(args=None):
                         help='Generate a dose plot of the plan')
     parser.add_argument('--dose_plot_filepath', type=str, default="plot_dose.png",
                         help='Filepath for dose plot image')
-    parser.add_argument('--dose_plot_fwhm', type=str, default=DEFAULT_FWHMS,
+    parser.add_argument('--dose_plot_fwhm', type=str, default=None,
                         help=f'FWHM (cm) for dose plot Gaussian kernel, as two values for x and y \
-                            (e.g. --dose_plot_fwhm={DEFAULT_FWHMS})')
+                            (e.g. --dose_plot_fwhm={DEFAULT_FWHMS}). Default is the machine spot size at the beam energy')
+    parser.add_argument('--dose_plot_resolution', type=float, default=None,
+                        help='Dose plot grid resolution [cm]. Default is a tenth of the smaller FWHM')
+    parser.add_argument('--dose_plot_renderer', type=str, default="pillow", choices=['pillow', 'matplotlib'],
+                        help='Dose plot renderer: fast Pillow output, or matplotlib with axes and colour bar')
+    parser.add_argument('--dose_plot_grid', action=argparse.BooleanOptionalAction, default=True,
+                        help='Draw 1 cm / 0.5 cm grid lines in the dose plot')
 
     # Subparsers for pattern types
     subparsers = parser.add_subparsers(dest="pattern_type", required=True,
@@ -74,10 +127,13 @@ def parse_arguments(args=None):
     square.add_argument('dy', type=float, help='Field height y [cm]')
     square.add_argument('--spacing', type=float, default=DEFAULT_SPOT_SPACING,
                         help='Spot spacing [cm]')
+    square.add_argument('--spacing_sigma', type=float, default=None, metavar='FRACTION',
+                        help='Spot spacing per layer as a fraction of the beam model spot sigma at the layer energy. '
+                             'Overrides --spacing')
     square.add_argument('--mu-per-spot', type=float, default=DEFAULT_MU_PER_SPOT,
                         help='MU per spot')
-    square.add_argument('--energy', type=float, default=DEFAULT_ENERGY,
-                        help='Beam energy [MeV]')
+    square.add_argument('--energy', type=float, nargs='+', default=[DEFAULT_ENERGY],
+                        help='Beam energy [MeV]. Several energies give one layer each')
     square.add_argument('--hex', action='store_true', default=False,
                         help='Use hexagonal pattern instead of square')
     # add x y offsets
@@ -95,10 +151,13 @@ def parse_arguments(args=None):
     circle.add_argument('diameter', type=float, help='Field diameter [cm]')
     circle.add_argument('--spacing', type=float, default=DEFAULT_SPOT_SPACING,
                         help='Spot spacing [cm]')
+    circle.add_argument('--spacing_sigma', type=float, default=None, metavar='FRACTION',
+                        help='Spot spacing per layer as a fraction of the beam model spot sigma at the layer energy. '
+                             'Overrides --spacing')
     circle.add_argument('--mu-per-spot', type=float, default=DEFAULT_MU_PER_SPOT,
                         help='MU per spot')
-    circle.add_argument('--energy', type=float, default=DEFAULT_ENERGY,
-                        help='Beam energy [MeV]')
+    circle.add_argument('--energy', type=float, nargs='+', default=[DEFAULT_ENERGY],
+                        help='Beam energy [MeV]. Several energies give one layer each')
     circle.add_argument('--xoffset', type=float, default=0.0,
                         help='X offset [cm]')
     circle.add_argument('--yoffset', type=float, default=0.0,
@@ -114,10 +173,20 @@ def parse_arguments(args=None):
     image.add_argument('--mu-per-spot', type=float, default=DEFAULT_MU_PER_SPOT,
                        help='Average amount of MU per spot')
 
-    image.add_argument('--energy', type=float, default=DEFAULT_ENERGY,
-                       help='Beam energy [MeV]')
+    image.add_argument('--energy', type=float, nargs='+', default=[DEFAULT_ENERGY],
+                       help='Beam energy [MeV]. Several energies give one layer each, or one per frame of a '
+                            'multi-frame GIF or TIFF')
+    image.add_argument('--halftone', type=str, default=None, choices=list(HALFTONE_MODES),
+                       help='Constant MU per spot with the grey level as spot density, by ordered (bayer) '
+                            'or error diffusion dithering, instead of weighting the spots by grey level')
+    image.add_argument('--energy_range', type=float, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                       help='Energies [MeV] of the first and last frame of a multi-frame image, the frames '
+                            'in between get evenly spaced energies')
     image.add_argument('--spacing', type=float, default=DEFAULT_SPOT_SPACING,
                        help='Spot spacing [cm]')
+    image.add_argument('--spacing_sigma', type=float, default=None, metavar='FRACTION',
+                       help='Spot spacing per layer as a fraction of the beam model spot sigma at the layer energy. '
+                            'Overrides --spacing')
     image.add_argument('--threshold', type=float, default=0.5,
                        metavar='THRESHOLD', choices=[0.0, 1.0],
                        help='Threshold (0–1) for spot activation from image')
@@ -127,6 +196,182 @@ def parse_arguments(args=None):
     image.add_argument('--yoffset', type=float, default=0.0,
                        help='Y offset [cm]')
 
+    # Composed shapes
+    compose = subparsers.add_parser('compose', help='Generate a spot pattern from a union, difference or '
+                                                    'intersection of squares and circles')
+    compose.add_argument('expression', type=str,
+                         help='Shape expression, e.g. "square(10, 8) - circle(3, x=1)": square(dx, dy, x, y) and '
+                              'circle(diameter, x, y) [cm] combined with | or + (union), - (difference) and & '
+                              '(intersection). Terms may set their own lattice with spacing= and hex=')
+    compose.add_argument('--spacing', type=float, default=DEFAULT_SPOT_SPACING,
+                         help='Spot spacing [cm]')
+    compose.add_argument('--spacing_sigma', type=float, default=None, metavar='FRACTION',
+                         help='Spot spacing per layer as a fraction of the beam model spot sigma at the layer energy. '
+                              'Overrides --spacing')
+    compose.add_argument('--mu-per-spot', type=float, default=DEFAULT_MU_PER_SPOT,
+                         help='MU per spot')
+    compose.add_argument('--energy', type=float, nargs='+', default=[DEFAULT_ENERGY],
+                         help='Beam energy [MeV]. Several energies give one layer each')
+    compose.add_argument('--hex', action='store_true', default=False,
+                         help='Use hexagonal pattern instead of square')
+    compose.add_argument('--min_distance', type=float, default=None,
+                         help='Minimum distance [cm] between spots of different lattices in a union, closer spots '
+                              'of the right operand are dropped. Default is half the smaller spacing')
+    compose.add_argument('--xoffset', type=float, default=0.0,
+                         help='X offset [cm]')
+    compose.add_argument('--yoffset', type=float, default=0.0,
+                         help='Y offset [cm]')
+    compose.add_argument('--boost_rim', type=float, default=1.0,
+                         help='Boost rim spots by multiplying their MU by this factor.')
+
+    # Precomputed spot map
+    custom = subparsers.add_parser('custom', help='Use a precomputed spot map from a .npy or .csv file')
+    custom.add_argument('spots_path', type=str,
+                        help='Spot map with columns x, y [cm], weight and optional energy [MeV]: a .csv file '
+                             '(optional header line) or a .npy file (N x 3/4 array or structured array)')
+    custom.add_argument('--mu-per-spot', type=float, default=1.0,
+                        help='MU per unit weight')
+    custom.add_argument('--energy', type=float, nargs='+', default=[DEFAULT_ENERGY],
+                        help='Beam energy [MeV] if the map has no energy column. Several energies repeat the map')
+    custom.add_argument('--xoffset', type=float, default=0.0,
+                        help='X offset [cm]')
+    custom.add_argument('--yoffset', type=float, default=0.0,
+                        help='Y offset [cm]')
+    custom.add_argument('--boost_rim', type=float, default=1.0,
+                        help='Boost rim spots by multiplying their MU by this factor.')
+
+    # Monte Carlo beam source of existing plans
+    export_mc = subparsers.add_parser('export-mc', help='Export a DICOM plan as SHIELD-HIT12A or TOPAS beam source')
+    export_mc.add_argument('plan', type=str, help='DICOM plan file')
+    export_mc.add_argument('source', type=str, help='Beam source file to write')
+    export_mc.add_argument('--format', type=str, choices=MC_FORMATS, default=None,
+                           help='shieldhit: sobp.dat spot list, topas: parameter file with one time step per spot. '
+                                'Default from the output suffix, .dat or .txt')
+    export_mc.add_argument('--beam', type=int, default=None, metavar='NUMBER',
+                           help='Export only this beam number. Default is all beams')
+    export_mc.add_argument('--machine', type=str, default=None,
+                           help='Machine name or profile file for the beam model. Default is the '
+                                'TreatmentMachineName of the first exported beam')
+    export_mc.add_argument('--histories', type=int, default=DEFAULT_HISTORIES,
+                           help='TOPAS histories of the plan, shared by the spots in proportion to their particles')
+
+    # Robustness analysis
+    robust = subparsers.add_parser('robust', help='Spread of the field metrics under spot position, spot size '
+                                                  'and MU errors')
+    robust.add_argument('--base', type=str, required=True,
+                        help='Plan as a dicomplan command line, e.g. "square 10 10 --energy 150"')
+    robust.add_argument('--scenarios', type=int, default=DEFAULT_SCENARIOS,
+                        help='Number of error scenarios, the first is the nominal plan')
+    robust.add_argument('--systematic', type=float, default=0.0, metavar='CM',
+                        help='Standard deviation of the shift of the whole field per scenario [cm]')
+    robust.add_argument('--random', type=float, default=0.0, metavar='CM',
+                        help='Standard deviation of the position error of every spot [cm]')
+    robust.add_argument('--spot_size', type=float, default=0.0, metavar='PERCENT',
+                        help='Standard deviation of the spot size per scenario and axis [%%]')
+    robust.add_argument('--mu', type=float, default=0.0, metavar='PERCENT',
+                        help='Standard deviation of the MU of every spot [%%]')
+    robust.add_argument('--resolution', type=float, default=None,
+                        help='Dose grid resolution [cm]. Default follows the smallest spot FWHM')
+    robust.add_argument('--seed', type=int, default=None,
+                        help='Random seed, for reproducible scenarios')
+    robust.add_argument('--output', type=str, default=None, metavar='FILE',
+                        help='Write the scenarios and their metrics to FILE, .csv or .json with the spread')
+
+    # Validate existing plans
+    validate = subparsers.add_parser('validate', help='Validate DICOM plans against the machine limits')
+    validate.add_argument('files', type=str, nargs='+', help='DICOM plan files')
+    validate.add_argument('--machine', type=str, default=None,
+                          help='Machine name or profile file. Default is the TreatmentMachineName of each beam')
+
+    # Summarise existing plans
+    info = subparsers.add_parser('info', help='Print a compact summary of DICOM plans')
+    info.add_argument('files', type=str, nargs='+', help='DICOM plan files or directories with .dcm files')
+    info.add_argument('--tag', type=str, action='append', default=[], dest='tags', metavar='KEYWORD',
+                      help='Extra top level element to read and print, e.g. StudyInstanceUID. Can be given several times')
+    info.add_argument('--layers', action='store_true', default=False,
+                      help='Print one line per energy layer')
+    info.add_argument('--no_bbox', action='store_true', default=False,
+                      help='Do not read the spot positions for the bounding boxes')
+    info.add_argument('--dump', action='store_true', default=False,
+                      help='Print the elements read instead of the summary, large values are abbreviated')
+    info.add_argument('-j', '--jobs', type=int, default=1,
+                      help='Number of parallel processes, 0 uses all CPUs')
+
+    # Gamma analysis of dose planes
+    gamma = subparsers.add_parser('gamma', help='Gamma index comparison of two 2-D dose planes')
+    gamma.add_argument('reference', type=str,
+                       help='Reference dose plane: a plan (.dcm), .npz with x, y [cm] and dose, or a 2-D .npy/.csv array')
+    gamma.add_argument('evaluated', type=str, help='Evaluated dose plane, e.g. a film or detector array measurement')
+    gamma.add_argument('--dd', type=float, default=3.0, help='Dose difference criterion [%%]')
+    gamma.add_argument('--dta', type=float, default=3.0, help='Distance to agreement criterion [mm]')
+    gamma.add_argument('--local', action='store_true', default=False,
+                       help='Dose difference relative to the local reference dose instead of its maximum')
+    gamma.add_argument('--cutoff', type=float, default=10.0,
+                       help='Reference points below this dose [%% of the maximum] are not evaluated')
+    gamma.add_argument('--search_radius', type=float, default=None,
+                       help=f'Search radius [mm], default {DEFAULT_SEARCH_RADIUS:g} x DTA')
+    gamma.add_argument('--subsamples', type=int, default=DEFAULT_SUBSAMPLES,
+                       help='Search steps per DTA for sub-voxel interpolation of the evaluated plane')
+    gamma.add_argument('--resolution', type=float, default=None,
+                       help='Pixel size [cm] of .npy/.csv planes, or the dose grid resolution of plans')
+    gamma.add_argument('--absolute', action='store_true', default=False,
+                       help='Compare absolute doses, by default both planes are normalised to their maximum')
+    gamma.add_argument('--gamma_map', type=str, default=None, metavar='FILE',
+                       help='Write the gamma map to FILE: .png, .npz (x, y, gamma) or .npy')
+    gamma.add_argument('--min_pass_rate', type=float, default=None,
+                       help='Exit with status 1 if the pass rate [%%] is below this')
+
+    # Index plan directories and query the index
+    index = subparsers.add_parser('index', help='Index DICOM plans into a SQLite file for fast queries')
+    index.add_argument('paths', type=str, nargs='+', help='DICOM plan files or directories with .dcm files')
+    index.add_argument('--db', type=str, default=DEFAULT_INDEX,
+                       help='Index file. Only new and modified plans are read when it exists')
+    index.add_argument('-j', '--jobs', type=int, default=1,
+                       help='Number of parallel processes, 0 uses all CPUs')
+
+    query = subparsers.add_parser('query', help='Find indexed plans')
+    query.add_argument('--db', type=str, default=DEFAULT_INDEX, help='Index file')
+    query.add_argument('--energy', type=float, default=None,
+                       help='Plans with a layer at this energy [MeV]')
+    query.add_argument('--energy_tolerance', type=float, default=ENERGY_TOLERANCE,
+                       help='Tolerance on the layer energy [MeV]')
+    query.add_argument('--min_spots', type=int, default=None, help='Minimum number of spots of the plan')
+    query.add_argument('--max_spots', type=int, default=None, help='Maximum number of spots of the plan')
+    query.add_argument('--machine', type=str, default=None, help='Plans with a beam on this treatment machine')
+    query.add_argument('--gantry_angle', type=float, default=None, help='Plans with a beam at this gantry angle')
+    query.add_argument('--patient_id', type=str, default=None, help='Patient ID')
+    query.add_argument('--where', type=str, default=None,
+                       help='Extra SQL condition on the plans table (path, sop_instance_uid, patient_id, label, '
+                            'beams, layers, spots, mu), e.g. "mu > 1000"')
+    query.add_argument('--count', action='store_true', default=False, help='Only print the number of plans')
+
+    # Keep the plans of a manifest up to date
+    watch = subparsers.add_parser('watch', help='Rebuild the plans of a manifest whenever it or their input images change')
+    watch.add_argument('manifest', type=str,
+                       help='Text file with one dicomplan command line per plan, e.g. "-o a.dcm image 10 10 a.png"')
+    watch.add_argument('--poll', action='store_true', default=False,
+                       help='Poll for changes instead of using inotify')
+    watch.add_argument('--poll_interval', type=float, default=0.5,
+                       help='Polling interval [s]')
+    watch.add_argument('--debounce', type=float, default=0.3,
+                       help='Wait until the inputs have not changed for this long before rebuilding [s]')
+
+    # Parameter sweeps over plan model attributes
+    sweep = subparsers.add_parser('sweep', help='Generate the cartesian product of plan parameters')
+    sweep.add_argument('output_dir', type=str, help='Output directory for the plans and the summary table')
+    sweep.add_argument('--base', type=str, required=True,
+                       help='Base plan as a dicomplan command line, e.g. "-tm tr4 square 10 10 --mu-per-spot 20"')
+    sweep.add_argument('--vary', type=str, action='append', required=True, metavar='NAME=VALUES',
+                       help='Plan model attribute and its values, as a list "0.3,0.4" or an inclusive range '
+                            '"70:230:20". NAME is e.g. spot_energy, spot_spacing, boost_rim, spot_mu or '
+                            'field_size. Can be given several times')
+    sweep.add_argument('-j', '--jobs', type=int, default=1,
+                       help='Number of parallel processes, 0 uses all CPUs')
+    sweep.add_argument('--metrics', action='store_true', default=False,
+                       help='Add dose metrics (field size, flatness, uniformity) to the summary')
+    sweep.add_argument('--summary', type=str, default=None,
+                       help='Summary table, .csv or .json. Default is OUTPUT_DIR/summary.csv')
+
     return parser.parse_args(args)
 
 
@@ -143,12 +388,20 @@ def get_model_from_args(args) -> PlanInputModel:
     # Set the output path
     model.output_path = args.output
 
-    # Set the treatment machine
-    model.field_treatment_machine = args.treatment_machine
+    # Set the treatment machine, a profile file also provides the machine name. The machine MU limits
+    # are only enforced for an explicitly selected machine, see Dicom.apply_model().
+    model.field_machine_profile = args.treatment_machine
+    if args.treatment_machine is None:
+        model.field_treatment_machine = DEFAULT_MACHINE
+    elif is_profile_file(args.treatment_machine):
+        model.field_treatment_machine = load_machine(args.treatment_machine).name
+    else:
+        model.field_treatment_machine = args.treatment_machine
 
     # Set the gantry angles
     if args.gantry_angle is not None:
         model.field_gantry_angle = args.gantry_angle
+    model.field_couch_angle = args.couch_angle
 
     if args.table_position is not None:
         parts = [float(pos) for pos in args.table_position.split(',')]
@@ -168,18 +421,41 @@ def get_model_from_args(args) -> PlanInputModel:
     model.plan_reviewer_name = args.reviewer_name
     model.plan_operator_name = args.operator_name
 
+    # a cached plan must be identical to a rebuild, so caching implies reproducible output
+    model.plan_reproducible = args.reproducible or args.cache is not None
+
     # Set the spot spacing and MU per spot
-    model.spot_spacing = args.spacing
+    model.spot_spacing = getattr(args, 'spacing', None)
     model.spot_mu = args.mu_per_spot
 
+    # Set repainting and MU limits
+    model.repaint_count = args.repaint
+    model.repaint_mode = args.repaint_mode
+    model.spot_mu_min = args.min_mu_per_spot
+    model.spot_mu_max = args.max_mu_per_spot
+    model.spot_mu_resolution = args.mu_resolution
+    model.spot_mu_low_policy = args.low_mu_policy
+    model.spot_max_per_cp = args.max_spots_per_cp
+
     # set plotting options
     model.plot_dose = args.dose_plot
     model.plot_dose_filepath = args.dose_plot_filepath
-    model.plot_dose_fwhm = [float(fwhm) for fwhm in args.dose_plot_fwhm.split(',')]
-
-    # Set the energy
+    model.export_spots_path = args.export_spots
+    model.export_frame = args.export_frame
+    model.stats_path = args.stats
+    model.export_mc_path = args.export_mc
+    if args.dose_plot_fwhm is not None:
+        model.plot_dose_fwhm = [float(fwhm) for fwhm in args.dose_plot_fwhm.split(',')]
+    model.plot_dose_resolution = args.dose_plot_resolution
+    model.plot_dose_renderer = args.dose_plot_renderer
+    model.plot_dose_grid = args.dose_plot_grid
+
+    # Set the energy, several energies give one layer each
     if args.energy is not None:
-        model.spot_energy = args.energy
+        model.spot_energy = args.energy[0]
+        if len(args.energy) > 1:
+            model.spot_energies = list(args.energy)
+    model.spot_spacing_sigma = getattr(args, 'spacing_sigma', None)
 
     if getattr(args, 'boost_rim', 1.0) > 1.0:
         model.boost_rim = args.boost_rim
@@ -203,9 +479,21 @@ def get_model_from_args(args) -> PlanInputModel:
     elif args.pattern_type == 'image':
         model.spot_shape = 'image'
         model.spot_image_path = args.image_path
+        model.spot_halftone = args.halftone
+        model.spot_energy_range = tuple(args.energy_range) if args.energy_range is not None else None
         model.spot_xymin = [-args.width / 2, -args.height / 2]
         model.spot_xymax = [args.width / 2, args.height / 2]
 
+    elif args.pattern_type == 'compose':
+        model.spot_shape = 'compose'
+        model.spot_expression = args.expression
+        model.spot_min_distance = args.min_distance
+        model.spot_pattern_type = 'hexagonal' if args.hex else 'square'
+
+    elif args.pattern_type == 'custom':
+        model.spot_shape = 'custom'
+        model.spot_custom_path = args.spots_path
+
     _apply_offset(model, args.xoffset, args.yoffset)
 
     return model
@@ -216,7 +504,7 @@ def _apply_offset(model: PlanInputModel, xoffset: float, yoffset: float) -> None
     Apply the offset to the model.
     """
 
-    if model.spot_shape == 'circle':
+    if model.spot_shape in ('circle', 'compose', 'custom'):
         model.spot_center[0] += xoffset
         model.spot_center[1] += yoffset
     else:   # square or image
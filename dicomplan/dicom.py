@@ -1,8 +1,8 @@
 import pydicom
 from pydicom.uid import ImplicitVRLittleEndian, PYDICOM_IMPLEMENTATION_UID
 
-import datetime
 import logging
+import struct
 import xml.etree.ElementTree as ET
 import numpy as np
 
@@ -11,7 +11,15 @@ from dicomplan.sequences.fraction_group import fraction_group
 from dicomplan.sequences.patient_setup import patient_setup
 from dicomplan.sequences.ion_tolerance_table import ion_tolerance_table
 from dicomplan.sequences.ion_beam import ion_beam
-from dicomplan.spots import generate_spot_pattern
+from dicomplan.sequences.ion_control_point import ion_control_points
+from dicomplan.repaint import paint_layers, split_layers
+from dicomplan.mu_limits import apply_mu_limits
+from dicomplan.model import SpotTable
+from dicomplan.spots import generate_layers
+from dicomplan.machine import MachineProfile, dose_fwhm, machine_for_model
+from dicomplan.cache import build_timestamp, model_digest
+from dicomplan.stats import plan_statistics
+from dicomplan.validate import ValidationIssue, log_issues, validate_dataset
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +28,10 @@ logger = logging.getLogger(__name__)
 class Dicom:
     def __init__(self):
         self.ds = pydicom.Dataset()
+        self.mu_limits_report: dict = {}
+        self.layers: SpotTable = SpotTable.from_layers([])  # (energy, coords [cm], MU) per CP pair
+        self.issues: list[ValidationIssue] = []
+        self.stats: dict = {}  # plan statistics, if model.stats_path is set
         self._set_static_tags()
 
     def apply_model(self, model):
@@ -29,53 +41,96 @@ class Dicom:
 
         logger.debug("apply_model()")
 
+        # beam model and limits of the treatment machine, command line limits take precedence. The machine
+        # MU limits change the delivered dose, so they only apply to an explicitly selected machine profile.
+        machine = machine_for_model(model)
+        enforce_mu = model.field_machine_profile is not None
+        mu_limits = machine.limits if enforce_mu else {}
+        mu_min = model.spot_mu_min if model.spot_mu_min is not None else mu_limits.get('mu_min')
+        mu_max = model.spot_mu_max if model.spot_mu_max is not None else mu_limits.get('mu_max')
+        mu_resolution = model.spot_mu_resolution if model.spot_mu_resolution is not None else mu_limits.get('mu_resolution')
+        max_spots = model.spot_max_per_cp if model.spot_max_per_cp is not None else machine.limit('max_spots_per_layer')
+
         self.ds.PatientName = model.plan_patient_name
         self.ds.PatientID = model.plan_patient_id
         self.ds.OperatorsName = model.plan_operator_name
         self.ds.ReviewerName = model.plan_reviewer_name
         self.ds.RTPlanLabel = model.plan_label
 
-        # set current date and time
-        now = datetime.datetime.now()
+        # set current date and time, or a fixed one and a SOP instance UID derived from the
+        # model content for reproducible builds, so identical inputs give identical files
+        now = build_timestamp(model.plan_reproducible)
         self.ds.StudyDate = now.strftime('%Y%m%d')
         self.ds.StudyTime = now.strftime('%H%M%S.%f')[:-3]
-
-        # get the spot pattern: coords are (x,y) pairs, weights are per-spot relative intensities.
-        # For a plain pattern, weights are all 1.0. If --boost_rim is set, rim spot weights are
-        # multiplied by the boost factor inside generate_spot_pattern before returning here.
-        coords, weights = generate_spot_pattern(model)
-        nspots = len(coords) // 2  # total number of spots
-        zero_weights = np.zeros(nspots)
-        logger.info(f"number of spots: {nspots}")
-
-        # check if coords length is exactly 2*nspots
-        if len(coords) != 2 * nspots:
-            raise ValueError(f"coords length {len(coords)} is not equal to 2*nspots {2 * nspots}")
+        if model.plan_reproducible:
+            self.ds.SOPInstanceUID = pydicom.uid.generate_uid(entropy_srcs=[model_digest(model)])
+
+        # get the spot pattern of each energy layer: coords are (x,y) pairs, weights are per-spot
+        # relative intensities. For a plain pattern, weights are all 1.0. If --boost_rim is set, rim spot
+        # weights are multiplied by the boost factor inside generate_spot_pattern before returning here.
+        generated = generate_layers(model)
+        for energy, coords, weights in generated:
+            # check if coords length is exactly 2 * number of weights
+            if len(coords) != 2 * len(weights):
+                raise ValueError(f"coords length {len(coords)} is not equal to 2*nspots {2 * len(weights)} "
+                                 f"at {energy} MeV")
+
+        # from here on every stage shares one table of the spots: (N, 2) positions, weights and the layer
+        # of every spot. Each stage returns a new table, with one layer per control point pair at the end.
+        layers = SpotTable.from_layers(generated)
+        del generated
+        logger.info(f"number of spots: {layers.nspots}")
 
         # Scale relative weights to absolute MU values. Center spots become spot_mu MU each;
         # rim spots are already boosted (weight > 1.0), so they get boost_rim * spot_mu MU each.
-        weights *= model.spot_mu
+        layers.weight *= model.spot_mu
+
+        # Split spots into repaintings, honouring the min/max MU per spot. Every layer of the table
+        # becomes one control point pair, in delivery order.
+        layers = paint_layers(layers, model.repaint_count, model.repaint_mode, mu_min, mu_max)
+
+        # Drop, merge or round spots below the machine minimum MU and quantise to the MU resolution;
+        # the MU moved to the other spots keeps them within the minimum and maximum MU.
+        layers, self.mu_limits_report = apply_mu_limits(layers, mu_min, mu_resolution, model.spot_mu_low_policy,
+                                                        [dose_fwhm(model, energy) for energy in layers.energy], mu_max)
+
+        # Layers with more spots than a control point can hold are delivered in several consecutive
+        # control point pairs at the same energy; the cumulative meterset runs on across them.
+        layers = split_layers(layers, None if max_spots is None else int(max_spots))
+        logger.info(f"number of control point pairs: {len(layers)}")
+        self.layers = layers
+        if model.stats_path is not None:
+            self.stats = plan_statistics(layers)
+
+        # spot size FWHM [mm] from the beam model, for all layers at once
+        spot_sizes = machine.spot_fwhm(layers.energy)
+
         # BeamMeterset must equal FinalCumulativeMetersetWeight, so derive it from the actual
         # sum rather than nspots * spot_mu, which would be wrong when rim is boosted.
-        total_mus = float(np.sum(weights))
+        cum_weights = np.concatenate(([0.0], np.cumsum(layers.weight, dtype=np.float64)))[layers.bounds]
+        total_mus = float(cum_weights[-1])
         self.ds.FractionGroupSequence[0].ReferencedBeamSequence[0].BeamMeterset = total_mus
         logger.info(f"total MU: {total_mus}")
 
-        cum_weight = 0.0
-
-        coords_mm = coords * 10.0  # convert to mm
-
         for _i, ib in enumerate(self.ds.IonBeamSequence):
             logger.debug(f"apply_model() - ion beam number {_i}")
             # set treatment machine
             ib.TreatmentMachineName = model.field_treatment_machine
+            self._apply_machine(ib, machine)
+
+            ib.IonControlPointSequence = ion_control_points(2 * len(layers))
+            ib.NumberOfControlPoints = len(ib.IonControlPointSequence)
 
             for cp_idx, icp in enumerate(ib.IonControlPointSequence):
+                layer_idx = cp_idx // 2
+                energy, layer_coords, layer_weights = layers[layer_idx]
+
                 icp.ControlPointIndex = cp_idx
-                icp.NominalBeamEnergy = model.spot_energy
+                icp.NominalBeamEnergy = energy
                 if cp_idx == 0:
                     # geometry tags only required on the first control point
                     icp.GantryAngle = model.field_gantry_angle
+                    icp.PatientSupportAngle = model.field_couch_angle
                     icp.SnoutPosition = model.field_snout_position * 10.0  # convert cm to mm
 
                 icp.TableTopVerticalPosition = model.field_table_position[0] * 10.0  # convert to mm
@@ -84,20 +139,49 @@ class Dicom:
 
                 icp.IsocenterPosition = [0.0, 0.0, 0.0]  # assuming iso at origin
 
-                icp.CumulativeMetersetWeight = cum_weight  # cumulative MU delivered before this CP
-
-                icp.NumberOfScanSpotPositions = nspots  # TODO: multiple layer handling.
-                icp.ScanSpotPositionMap = coords_mm.tolist()
+                icp.ScanSpotTuneID = machine.scan_spot_tune_id
+                icp.ScanningSpotSize = spot_sizes[layer_idx].tolist()
 
                 # DICOM RT Ion uses pairs of control points per energy layer: the even CP carries
                 # the actual spot weights; the odd CP is a zero-weight terminator.
-                if icp.ControlPointIndex % 2 == 0:
-                    icp.ScanSpotMetersetWeights = weights.tolist()
-                    cum_weight += sum(weights)
+                if cp_idx % 2 == 0:
+                    # cumulative MU delivered before this CP
+                    icp.CumulativeMetersetWeight = float(cum_weights[layer_idx])
+                    layer_map = (layer_coords * 10.0).tolist()  # convert to mm
+                    icp.ScanSpotMetersetWeights = layer_weights.tolist()
                 else:
-                    icp.ScanSpotMetersetWeights = zero_weights.tolist()
-            ib.FinalCumulativeMetersetWeight = cum_weight  # must equal BeamMeterset
-            logger.debug(f"apply_model() - FinalCumulativeMetersetWeight: {cum_weight}")
+                    icp.CumulativeMetersetWeight = float(cum_weights[layer_idx + 1])
+                    icp.ScanSpotMetersetWeights = [0.0] * len(layer_weights)
+                icp.NumberOfScanSpotPositions = len(layer_weights)
+                icp.ScanSpotPositionMap = layer_map
+
+            ib.FinalCumulativeMetersetWeight = total_mus  # must equal BeamMeterset
+            logger.debug(f"apply_model() - FinalCumulativeMetersetWeight: {total_mus}")
+
+        # check the plan against the machine limits before it is written
+        self.issues = validate_dataset(self.ds, machine, enforce_mu=enforce_mu)
+        log_issues(self.issues)
+
+    @staticmethod
+    def _apply_machine(ib: pydicom.Dataset, machine: MachineProfile):
+        """
+        Set the machine dependent tags of an ion beam from the machine profile.
+        """
+        ib.VirtualSourceAxisDistances = machine.virtual_source_axis_distances  # 300a,030a
+
+        # the lateral spreading devices (scanning magnets) sit at the virtual source positions
+        lsd_settings = ib.IonControlPointSequence[0].LateralSpreadingDeviceSettingsSequence
+        for lsd, distance in zip(lsd_settings, machine.virtual_source_axis_distances):
+            lsd.IsocenterToLateralSpreadingDeviceDistance = distance
+
+        # unknown IMPAC private floats
+        for element, key in ((0x1002, 'beam_300b1002'), (0x1004, 'beam_300b1004'), (0x100e, 'beam_300b100e')):
+            if key in machine.impac:
+                ib[0x300b, element].value = struct.pack('<f', machine.impac[key])
+        for cp_idx, icp in enumerate(ib.IonControlPointSequence):
+            key = 'control_point_300b1017' if cp_idx == 0 else 'control_point_next_300b1017'
+            if key in machine.impac:
+                icp[0x300b, 0x1017].value = struct.pack('<f', machine.impac[key])
 
     def write(self, filename: str):
         """
@@ -0,0 +1,138 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))  # sigma = fwhm / 2.355
+
+DOSE_GRID_FWHM_FRACTION = 0.1  # default grid resolution as fraction of the smaller FWHM
+DOSE_GRID_MARGIN_SIGMA = 3.0  # grid extends this many sigma beyond the outermost spots
+DOSE_GRID_CHUNK = 4096  # number of spots processed per matrix product
+
+
+def grid_resolution(fwhm: list[float], resolution: Optional[float] = None) -> float:
+    """
+    Return the dose grid resolution in cm: the given one, or DOSE_GRID_FWHM_FRACTION of the smaller FWHM.
+    """
+    if resolution is None:
+        resolution = DOSE_GRID_FWHM_FRACTION * min(float(fwhm[0]), float(fwhm[1]))
+    if resolution <= 0:
+        raise ValueError(f"Dose grid resolution must be positive, got {resolution}")
+    return resolution
+
+
+def grid_axes(xys: list[np.ndarray], fwhms: np.ndarray, resolution: Optional[float] = None,
+              margin: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the pixel centres x, y (float32) of the dose grid of the (N, 2) spot positions of all layers:
+    their bounding box plus DOSE_GRID_MARGIN_SIGMA sigma of the largest FWHM and margin [cm] on each side.
+    """
+    resolution = grid_resolution(fwhms.min(axis=0), resolution)
+    if sum(len(xy) for xy in xys) == 0:
+        raise ValueError("Cannot calculate dose for an empty spot pattern")
+
+    margin_x, margin_y = DOSE_GRID_MARGIN_SIGMA * fwhms.max(axis=0) * FWHM_TO_SIGMA + margin
+    xmin, ymin = np.min([xy.min(axis=0) for xy in xys if len(xy)], axis=0)
+    xmax, ymax = np.max([xy.max(axis=0) for xy in xys if len(xy)], axis=0)
+    x = np.arange(xmin - margin_x, xmax + margin_x + resolution / 2, resolution, dtype=np.float32)
+    y = np.arange(ymin - margin_y, ymax + margin_y + resolution / 2, resolution, dtype=np.float32)
+    logger.debug(f"Dose grid {len(x)} x {len(y)} at {resolution:.4f} cm resolution")
+    return x, y
+
+
+def dose_grid(coords: np.ndarray, weights: np.ndarray, fwhm: list[float],
+              resolution: Optional[float] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the 2-D dose as a sum of Gaussian spots with the given FWHM (x, y) in cm.
+
+    coords is the flat [x0, y0, x1, y1, ...] spot array and weights the per-spot weights.
+    If resolution is None, it defaults to DOSE_GRID_FWHM_FRACTION of the smaller FWHM.
+    The grid covers the spot coordinates plus DOSE_GRID_MARGIN_SIGMA sigma on each side.
+
+    Returns the pixel centres x, y and the (unnormalised) dose indexed [ix, iy], all float32.
+    """
+    return layered_dose_grid([(coords, weights)], [fwhm], resolution)
+
+
+def layered_dose_grid(layers: list[tuple[np.ndarray, np.ndarray]], fwhms: list[list[float]],
+                      resolution: Optional[float] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the summed 2-D dose of several (coords, weights) layers, each with its own FWHM (x, y) in cm,
+    on one common grid. If resolution is None, it follows the smallest FWHM. See dose_grid().
+    """
+    fwhms = np.asarray(fwhms, dtype=np.float64).reshape(-1, 2)
+    xys = [np.asarray(coords, dtype=np.float32).reshape(-1, 2) for coords, _ in layers]
+    x, y = grid_axes(xys, fwhms, resolution)
+
+    dose = np.zeros((len(x), len(y)), dtype=np.float32)
+    for xy, (_, weights), (fwhm_x, fwhm_y) in zip(xys, layers, fwhms):
+        sx2 = np.float32(fwhm_x**2 / (4 * np.log(2)))
+        sy2 = np.float32(fwhm_y**2 / (4 * np.log(2)))
+        w = np.asarray(weights, dtype=np.float32)
+
+        # The Gaussian kernel is separable, so the dose is Gx @ diag(w) @ Gy.T, which avoids
+        # evaluating every spot on the full 2-D grid.
+        for start in range(0, len(xy), DOSE_GRID_CHUNK):
+            chunk = xy[start:start + DOSE_GRID_CHUNK]
+            gx = np.exp(-(x[:, None] - chunk[None, :, 0])**2 / sx2)
+            gy = np.exp(-(y[:, None] - chunk[None, :, 1])**2 / sy2)
+            dose += (gx * w[start:start + DOSE_GRID_CHUNK]) @ gy.T
+
+    return x, y, dose
+
+
+FIELD_CORE_FRACTION = 0.8  # flatness and uniformity are evaluated on this fraction of the field size
+METRIC_FIELDS = ['field_size_x', 'field_size_y', 'flatness_x', 'flatness_y', 'uniformity']
+
+
+def field_metrics(x: np.ndarray, y: np.ndarray, dose: np.ndarray) -> dict:
+    """
+    Return field size and flatness metrics of a dose grid from dose_grid().
+
+    The field size is the width of the 50 % isodose along the x and y profiles through the dose maximum
+    closest to the field centre. Flatness is (Dmax - Dmin) / (Dmax + Dmin) in percent along each profile,
+    and uniformity is Dmin / Dmax over the 2-D core, both within FIELD_CORE_FRACTION of the field size.
+    """
+    dmax = float(dose.max())
+    if dmax <= 0:
+        raise ValueError("Cannot calculate field metrics for a zero dose")
+
+    # profiles through the grid point nearest to the centre of the high dose region
+    high = dose >= 0.5 * dmax
+    ix = int(np.round(np.mean(np.nonzero(high.any(axis=1))[0])))
+    iy = int(np.round(np.mean(np.nonzero(high.any(axis=0))[0])))
+    profile_x = dose[:, iy]
+    profile_y = dose[ix, :]
+
+    metrics = {}
+    core = []
+    for axis, coords, profile in (('x', x, profile_x), ('y', y, profile_y)):
+        left, right = _half_max_edges(coords, profile / dmax)
+        size = right - left
+        centre = (left + right) / 2
+        inner = np.abs(coords - centre) <= FIELD_CORE_FRACTION * size / 2
+        values = profile[inner] if inner.any() else profile
+        metrics[f'field_size_{axis}'] = float(size)
+        metrics[f'flatness_{axis}'] = float(100.0 * (values.max() - values.min()) / (values.max() + values.min()))
+        core.append(inner)
+
+    core_dose = dose[np.ix_(core[0], core[1])] if core[0].any() and core[1].any() else dose
+    metrics['uniformity'] = float(core_dose.min() / core_dose.max())
+    return metrics
+
+
+def _half_max_edges(coords: np.ndarray, profile: np.ndarray) -> tuple[float, float]:
+    """
+    Return the outermost positions where a normalised profile crosses 0.5, linearly interpolated.
+    """
+    above = np.flatnonzero(profile >= 0.5)
+    i, j = above[0], above[-1]
+    left = float(coords[i])
+    if i > 0:
+        left = float(np.interp(0.5, [profile[i - 1], profile[i]], [coords[i - 1], coords[i]]))
+    right = float(coords[j])
+    if j < len(profile) - 1:
+        right = float(np.interp(0.5, [profile[j + 1], profile[j]], [coords[j + 1], coords[j]]))
+    return left, right
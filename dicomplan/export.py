@@ -0,0 +1,127 @@
+import logging
+import zipfile
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from dicomplan.geometry import BeamGeometry, spot_points
+from dicomplan.model import SpotTable
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('.npz', '.csv', '.npy')
+EXPORT_CHUNK = 1 << 20  # spots written per chunk
+
+# one record per spot, positions in mm at isocentre like the ScanSpotPositionMap
+SPOT_DTYPE = np.dtype([('layer', '<i4'), ('energy', '<f4'), ('x', '<f4'), ('y', '<f4'), ('mu', '<f4')])
+CSV_FORMAT = ['%d', '%.3f', '%.4f', '%.4f', '%.6g']
+# spot positions in mm in another IEC 61217 frame than the beam, see geometry.py
+FRAME_SPOT_DTYPE = np.dtype([('layer', '<i4'), ('energy', '<f4'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                             ('mu', '<f4')])
+FRAME_CSV_FORMAT = ['%d', '%.3f', '%.4f', '%.4f', '%.4f', '%.6g']
+
+
+def export_spots(path: str, layers: list[tuple[float, np.ndarray, np.ndarray]],
+                 geometry: Optional[BeamGeometry] = None, frame: str = 'beam') -> int:
+    """
+    Write the spot list (layer, energy, x, y, mu) of the (energy, coords, mu) layers to path,
+    in the format given by its suffix:
+      .npy : structured array with SPOT_DTYPE, can be read with np.load(path, mmap_mode='r'),
+      .npz : one array per column,
+      .csv : text table with a header line.
+    coords are flat [x0, y0, x1, y1, ...] in cm and written in mm. With a geometry and another frame than
+    the beam, the spot positions in the isocentre plane are written as x, y, z in that frame, with
+    FRAME_SPOT_DTYPE. layers may also be a SpotTable; the spots are written in chunks straight from its
+    columns, so the full spot list is never assembled in memory. Returns the number of spots.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown spot export format '{suffix}', use one of {', '.join(EXPORT_FORMATS)}")
+    if frame != 'beam' and geometry is None:
+        geometry = BeamGeometry()
+    dtype = SPOT_DTYPE if frame == 'beam' else FRAME_SPOT_DTYPE
+
+    table = SpotTable.of(layers)
+
+    def blocks():
+        return spot_blocks(table, geometry, frame)
+
+    nspots = table.nspots
+    if suffix == '.npy':
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(nspots,))
+        for start, block in blocks():
+            out[start:start + len(block)] = block
+        out.flush()
+        del out
+    elif suffix == '.npz':
+        _write_npz(path, blocks, dtype, nspots)
+    else:
+        with open(path, 'w') as f:
+            f.write(','.join(dtype.names) + '\n')
+            for _, block in blocks():
+                np.savetxt(f, block, fmt=CSV_FORMAT if frame == 'beam' else FRAME_CSV_FORMAT, delimiter=',')
+
+    logger.info(f"Exported {nspots} spots in {len(layers)} layers to {path}" +
+                ("" if frame == 'beam' else f", positions in the {frame} frame"))
+    return nspots
+
+
+def load_spots(path: str) -> np.ndarray:
+    """
+    Read a spot list written by export_spots() as a SPOT_DTYPE or, with a z column, FRAME_SPOT_DTYPE
+    structured array. .npy files are memory mapped.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.npy':
+        return np.load(path, mmap_mode='r')
+    if suffix == '.npz':
+        with np.load(path) as data:
+            dtype = FRAME_SPOT_DTYPE if 'z' in data.files else SPOT_DTYPE
+            spots = np.empty(len(data['layer']), dtype=dtype)
+            for name in dtype.names:
+                spots[name] = data[name]
+        return spots
+    with open(path) as f:
+        dtype = FRAME_SPOT_DTYPE if 'z' in f.readline().strip().split(',') else SPOT_DTYPE
+    return np.loadtxt(path, delimiter=',', skiprows=1, dtype=dtype, ndmin=1)
+
+
+def spot_blocks(layers: list[tuple[float, np.ndarray, np.ndarray]], geometry: Optional[BeamGeometry] = None,
+                frame: str = 'beam'):
+    """
+    Yield (offset, SPOT_DTYPE block) for chunks of at most EXPORT_CHUNK spots, in layer order, or
+    FRAME_SPOT_DTYPE blocks with the positions transformed by the geometry to another frame than the beam.
+    layers may be a SpotTable; the blocks are sliced from its columns one chunk at a time, so the columns may
+    be memory mapped.
+    """
+    table = SpotTable.of(layers)
+    for start in range(0, table.nspots, EXPORT_CHUNK):
+        stop = min(start + EXPORT_CHUNK, table.nspots)
+        layer = table.layer[start:stop]
+        xy = table.xy[start:stop]
+        block = np.empty(stop - start, dtype=SPOT_DTYPE if frame == 'beam' else FRAME_SPOT_DTYPE)
+        block['layer'] = layer
+        block['energy'] = table.energy[layer]
+        if frame == 'beam':
+            block['x'] = xy[:, 0] * 10.0  # cm to mm
+            block['y'] = xy[:, 1] * 10.0  # cm to mm
+        else:
+            points = geometry.transform(spot_points(xy, 10.0), 'beam', frame)  # cm to mm
+            block['x'], block['y'], block['z'] = points.T
+        block['mu'] = table.weight[start:stop]
+        yield start, block
+
+
+def _write_npz(path: str, blocks: Callable, spot_dtype: np.dtype, nspots: int):
+    """
+    Write one .npy member per column into a zip archive like np.savez, streaming the blocks() chunks.
+    """
+    with zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name in spot_dtype.names:
+            dtype = spot_dtype[name]
+            with zf.open(f"{name}.npy", mode='w', force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(
+                    member, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (nspots,)})
+                for _, block in blocks():
+                    member.write(np.ascontiguousarray(block[name]).tobytes())
@@ -0,0 +1,218 @@
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pydicom
+
+from dicomplan.dose import grid_resolution, layered_dose_grid
+from dicomplan.machine import load_machine
+from dicomplan.reader import beam_arrays
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_RADIUS = 2.0  # in units of the DTA
+DEFAULT_SUBSAMPLES = 10  # search steps per DTA, for sub-voxel interpolation of the evaluated dose
+PLANE_FORMATS = ('.dcm', '.npz', '.npy', '.csv')
+
+DosePlane = tuple[np.ndarray, np.ndarray, np.ndarray]  # pixel centres x, y [cm] and dose indexed [ix, iy]
+
+
+def gamma_index(reference: DosePlane, evaluated: DosePlane, dose_criterion: float = 0.03, dta: float = 0.3,
+                local: bool = False, cutoff: float = 0.1, search_radius: Optional[float] = None,
+                subsamples: int = DEFAULT_SUBSAMPLES, normalisation: Optional[float] = None) -> np.ndarray:
+    """
+    Return the 2-D gamma index of an evaluated dose plane against a reference plane, on the reference grid.
+
+    dose_criterion is a fraction of the normalisation dose (global, default the reference maximum) or of
+    the local reference dose (local=True), dta is in the units of the coordinates. Reference points below
+    cutoff times the reference maximum are not evaluated and are NaN in the map.
+
+    The evaluated plane is bilinearly interpolated at offsets on a grid of dta / subsamples within
+    search_radius (default DEFAULT_SEARCH_RADIUS * dta) around each reference point, so the result does not
+    depend on the pixel size of the evaluated plane. Offsets are visited by increasing distance, and a point
+    is final as soon as the distance term alone exceeds its gamma, so only points which have not passed yet
+    are interpolated at the larger offsets. Gamma values above search_radius / dta may be overestimated,
+    since better matches further away are not searched. Points whose search area is outside the evaluated
+    plane are inf.
+    """
+    x_r, y_r, d_r = (np.asarray(a, dtype=np.float32) for a in reference)
+    x_e, y_e, d_e = (np.asarray(a, dtype=np.float32) for a in evaluated)
+    if d_r.shape != (len(x_r), len(y_r)) or d_e.shape != (len(x_e), len(y_e)):
+        raise ValueError("Dose planes must be indexed [ix, iy] with their pixel centres x and y")
+    if dose_criterion <= 0 or dta <= 0:
+        raise ValueError("Dose and distance criteria must be positive")
+    search_radius = DEFAULT_SEARCH_RADIUS * dta if search_radius is None else search_radius
+
+    dmax = float(d_r.max())
+    normalisation = dmax if normalisation is None else normalisation
+    ix, iy = np.nonzero(d_r >= cutoff * dmax)
+    px, py, dose = x_r[ix], y_r[iy], d_r[ix, iy]
+    # inverse squared dose criterion per point
+    inv_dd2 = 1.0 / (dose_criterion * (dose if local else np.float32(normalisation)))**2
+    inv_dd2 = np.broadcast_to(np.asarray(inv_dd2, dtype=np.float32), dose.shape)
+
+    gamma2 = np.full(len(ix), np.inf, dtype=np.float32)
+    final = np.empty(len(ix), dtype=np.float32)
+    active = np.arange(len(ix))
+
+    step = dta / subsamples
+    n = int(np.ceil(search_radius / step))
+    ox, oy = np.meshgrid(np.arange(-n, n + 1) * step, np.arange(-n, n + 1) * step, indexing='ij')
+    r2 = (ox**2 + oy**2).ravel()
+    order = np.argsort(r2, kind='stable')
+    order = order[r2[order] <= search_radius**2 * (1 + 1e-9)]
+    logger.debug(f"Gamma of {len(ix)} points with {len(order)} search offsets")
+
+    axes_e = (_regular_axis(x_e), _regular_axis(y_e))
+    last_r2 = -1.0
+    for k in order:
+        distance2 = float(r2[k]) / dta**2
+        if r2[k] > last_r2:
+            # points whose gamma is below the distance term of all remaining offsets are final
+            done = gamma2[active] <= distance2
+            if done.any():
+                final[active[done]] = gamma2[active[done]]
+                active = active[~done]
+                if len(active) == 0:
+                    break
+            last_r2 = r2[k]
+        d_e_at = _interpolate(d_e, axes_e, px[active] + ox.flat[k], py[active] + oy.flat[k])
+        g2 = distance2 + (d_e_at - dose[active])**2 * inv_dd2[active]
+        np.fmin(gamma2[active], g2, out=g2)
+        gamma2[active] = g2
+    final[active] = gamma2[active]
+
+    gamma = np.full(d_r.shape, np.nan, dtype=np.float32)
+    gamma[ix, iy] = np.sqrt(final)
+    return gamma
+
+
+def _regular_axis(coords: np.ndarray) -> tuple[float, float, int]:
+    """
+    Return (start, spacing, length) of a regularly spaced pixel centre axis.
+    """
+    if len(coords) < 2:
+        raise ValueError("Dose planes need at least 2 pixels along each axis")
+    spacing = float(coords[-1] - coords[0]) / (len(coords) - 1)
+    if spacing <= 0 or not np.allclose(np.diff(coords), spacing, rtol=1e-3, atol=1e-6):
+        raise ValueError("Dose plane pixel centres must be regularly spaced and increasing")
+    return float(coords[0]), spacing, len(coords)
+
+
+def _interpolate(dose: np.ndarray, axes: tuple, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Bilinear interpolation of dose at the points (x, y); NaN outside the plane.
+    """
+    idx = []
+    for coords, (start, spacing, n) in zip((x, y), axes):
+        f = (coords - start) / spacing
+        i0 = np.clip(np.floor(f).astype(np.intp), 0, n - 2)
+        t = f - i0
+        t[(f < -1e-6) | (f > n - 1 + 1e-6)] = np.nan
+        idx.append((i0, t))
+    (i, tx), (j, ty) = idx
+    d0 = dose[i, j] + (dose[i + 1, j] - dose[i, j]) * tx
+    d1 = dose[i, j + 1] + (dose[i + 1, j + 1] - dose[i, j + 1]) * tx
+    return d0 + (d1 - d0) * ty
+
+
+def pass_rate(gamma: np.ndarray, threshold: float = 1.0) -> float:
+    """
+    Return the percentage of evaluated points (not NaN) with gamma <= threshold.
+    """
+    evaluated = ~np.isnan(gamma)
+    if not evaluated.any():
+        raise ValueError("No points above the dose cutoff")
+    return float(100.0 * np.count_nonzero(gamma[evaluated] <= threshold) / np.count_nonzero(evaluated))
+
+
+def load_dose_plane(path: str, resolution: Optional[float] = None) -> DosePlane:
+    """
+    Load a dose plane from:
+      .dcm : a plan, the dose is the sum of Gaussian spots with the machine spot size, like the dose plot,
+      .npz : arrays x, y [cm] and dose indexed [ix, iy],
+      .npy / .csv : a 2-D dose array indexed [ix, iy] with pixel size resolution [cm], centred on the origin.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.dcm':
+        return plan_dose_plane(pydicom.dcmread(path), resolution)
+    if suffix == '.npz':
+        with np.load(path) as data:
+            return data['x'], data['y'], data['dose']
+    if suffix in ('.npy', '.csv'):
+        if resolution is None:
+            raise ValueError(f"The pixel size (resolution) of {path} must be given")
+        dose = np.load(path) if suffix == '.npy' else np.loadtxt(path, delimiter=',', ndmin=2)
+        x = (np.arange(dose.shape[0]) - (dose.shape[0] - 1) / 2) * resolution
+        y = (np.arange(dose.shape[1]) - (dose.shape[1] - 1) / 2) * resolution
+        return x, y, dose
+    raise ValueError(f"Unknown dose plane format '{suffix}', use one of {', '.join(PLANE_FORMATS)}")
+
+
+def plan_dose_plane(ds: pydicom.Dataset, resolution: Optional[float] = None) -> DosePlane:
+    """
+    Calculate the dose plane of all beams of a plan, one layer per control point with spots,
+    with the spot size of the beam's treatment machine at the control point energy.
+    """
+    layers = []
+    fwhms = []
+    for beam in beam_arrays(ds):
+        machine = load_machine(beam.machine) if beam.machine else load_machine()
+        for cp in np.flatnonzero(beam.weight_sums > 0):
+            start, stop = beam.cp_start[cp], beam.cp_start[cp + 1]
+            layers.append((beam.xy[start:stop].ravel() / 10.0, beam.weights[start:stop]))  # mm to cm
+            fwhms.append((machine.spot_fwhm(beam.energy[cp]) / 10.0).tolist())  # mm to cm
+    if not layers:
+        raise ValueError("The plan has no spots with meterset weight")
+    resolution = grid_resolution(np.min(fwhms, axis=0), resolution)
+    return layered_dose_grid(layers, fwhms, resolution)
+
+
+def save_gamma_map(path: str, x: np.ndarray, y: np.ndarray, gamma: np.ndarray, max_gamma: float = 2.0):
+    """
+    Save a gamma map as .npz (x, y, gamma), .npy or as a PNG with the dose plot colour scale spanning
+    0 to max_gamma; points which were not evaluated are shown as 0.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.npz':
+        np.savez(path, x=x, y=y, gamma=gamma)
+    elif suffix == '.npy':
+        np.save(path, gamma)
+    elif suffix == '.png':
+        from dicomplan.plot import render_dose_pillow
+        resolution = float(x[1] - x[0])
+        extent = (x[0] - resolution / 2, x[-1] + resolution / 2, y[0] - resolution / 2, y[-1] + resolution / 2)
+        render_dose_pillow(path, np.nan_to_num(gamma / max_gamma, nan=0.0, posinf=1.0), extent)
+    else:
+        raise ValueError(f"Unknown gamma map format '{suffix}', use .npz, .npy or .png")
+
+
+def gamma_from_args(args) -> Optional[int]:
+    """
+    Run the gamma subcommand: compare two dose planes and print the pass rate.
+    Returns 1 if the pass rate is below --min_pass_rate.
+    """
+    reference = load_dose_plane(args.reference, args.resolution)
+    evaluated = load_dose_plane(args.evaluated, args.resolution)
+    if not args.absolute:
+        # compare relative doses, e.g. a film plane against the plan dose
+        reference = (*reference[:2], reference[2] / np.max(reference[2]))
+        evaluated = (*evaluated[:2], evaluated[2] / np.max(evaluated[2]))
+
+    dta = args.dta / 10.0  # mm to cm
+    search_radius = args.search_radius / 10.0 if args.search_radius is not None else None  # mm to cm
+    gamma = gamma_index(reference, evaluated, args.dd / 100.0, dta, args.local, args.cutoff / 100.0,
+                        search_radius, args.subsamples)
+    rate = pass_rate(gamma)
+    values = gamma[~np.isnan(gamma)]
+    print(f"Gamma {args.dd:g} %/{args.dta:g} mm {'local' if args.local else 'global'}, cutoff {args.cutoff:g} %: "
+          f"{rate:.2f} % of {len(values)} points pass, mean {np.mean(values):.3f}, max {np.max(values):.3f}")
+
+    if args.gamma_map is not None:
+        max_gamma = (search_radius if search_radius is not None else DEFAULT_SEARCH_RADIUS * dta) / dta
+        save_gamma_map(args.gamma_map, reference[0], reference[1], gamma, max_gamma)
+        logger.info(f"Gamma map written to {args.gamma_map}")
+    if args.min_pass_rate is not None and rate < args.min_pass_rate:
+        return 1
+    return None
@@ -0,0 +1,117 @@
+import logging
+from typing import Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# IEC 61217 coordinate systems, from the beam limiting device to the table top:
+#   beam : beam limiting device, X and Y in the isocentre plane as the ScanSpotPositionMap, Z towards the source
+#   gantry : rotates with the gantry about Y of the room
+#   room : fixed system, origin at the isocentre, Y towards the gantry, Z up
+#   support : patient support, rotates with the couch about Z of the room
+#   table : table top, shifted by the table top lateral, longitudinal and vertical position
+FRAMES = ('beam', 'gantry', 'room', 'support', 'table')
+
+
+def rotation_y(angle: float) -> np.ndarray:
+    """
+    Return the 3 x 3 matrix of a rotation by angle [degrees] about the Y axis.
+    """
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([[c, 0.0, s], [0.0, 1.0, 0.0], [-s, 0.0, c]])
+
+
+def rotation_z(angle: float) -> np.ndarray:
+    """
+    Return the 3 x 3 matrix of a rotation by angle [degrees] about the Z axis.
+    """
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+def _affine(rotation: np.ndarray, translation: Sequence[float] = (0.0, 0.0, 0.0)) -> np.ndarray:
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = translation
+    return matrix
+
+
+class BeamGeometry:
+    """
+    Gantry, collimator and patient support angles [degrees] and table top position [mm] of a beam,
+    mapping points between the IEC 61217 FRAMES.
+
+    Rotations follow IEC 61217: gantry 90 puts the source on the +X side of the room, a positive couch
+    angle turns the table counter-clockwise seen from above. The table top position is given as in the
+    control points, vertical, longitudinal and lateral, and is the position of the table top origin
+    in the patient support system.
+    """
+
+    def __init__(self, gantry_angle: float = 0.0, collimator_angle: float = 0.0, couch_angle: float = 0.0,
+                 table_position: Sequence[float] = (0.0, 0.0, 0.0)):
+        self.gantry_angle = float(gantry_angle)
+        self.collimator_angle = float(collimator_angle)
+        self.couch_angle = float(couch_angle)
+        self.table_position = [float(p) for p in table_position]
+
+        vertical, longitudinal, lateral = self.table_position
+        gantry = _affine(rotation_y(self.gantry_angle))
+        support = _affine(rotation_z(self.couch_angle))
+        # homogeneous matrices from each frame to the room
+        self._to_room = {
+            'beam': gantry @ _affine(rotation_z(self.collimator_angle)),
+            'gantry': gantry,
+            'room': np.eye(4),
+            'support': support,
+            'table': support @ _affine(np.eye(3), (lateral, longitudinal, vertical)),
+        }
+
+    def matrix(self, source: str, target: str) -> np.ndarray:
+        """
+        Return the 4 x 4 homogeneous matrix mapping points in the source frame to the target frame.
+        """
+        for frame in (source, target):
+            if frame not in FRAMES:
+                raise ValueError(f"Unknown coordinate frame '{frame}', use one of {', '.join(FRAMES)}")
+        return np.linalg.inv(self._to_room[target]) @ self._to_room[source]
+
+    def transform(self, points: np.ndarray, source: str, target: str) -> np.ndarray:
+        """
+        Return the (N, 3) points [mm] of the source frame in the target frame, as one matrix product.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError(f"Points must have shape (N, 3), got {points.shape}")
+        if source == target:
+            return points.copy()
+        matrix = self.matrix(source, target)
+        out = points @ matrix[:3, :3].T
+        out += matrix[:3, 3]
+        return out
+
+    def source_position(self, distance: float, frame: str = 'room') -> np.ndarray:
+        """
+        Return the position of the (virtual) source at distance [mm] from the isocentre in frame.
+        """
+        return self.transform(np.array([[0.0, 0.0, distance]]), 'beam', frame)[0]
+
+
+def spot_points(coords: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """
+    Return flat [x0, y0, x1, y1, ...] spot coordinates as (N, 3) points in the isocentre plane (Z = 0)
+    of the beam frame, multiplied by scale, e.g. 10.0 for cm to mm.
+    """
+    xy = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    points = np.zeros((len(xy), 3))
+    np.multiply(xy, scale, out=points[:, :2])
+    return points
+
+
+def geometry_for_model(model) -> BeamGeometry:
+    """
+    Return the BeamGeometry of the model gantry and couch angles and table position [cm], in mm.
+    """
+    table = model.field_table_position if model.field_table_position is not None else [0.0, 0.0, 0.0]
+    return BeamGeometry(float(model.field_gantry_angle or 0.0), 0.0, float(model.field_couch_angle or 0.0),
+                        [10.0 * p for p in table])
@@ -0,0 +1,74 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HALFTONE_MODES = ('bayer', 'diffusion')
+BAYER_ORDER = 3  # the ordered dither matrix is 2**BAYER_ORDER pixels square
+FLOYD_STEINBERG = (  # row offset, column offset and share of the quantisation error
+    (0, 1, 7 / 16),
+    (1, -1, 3 / 16),
+    (1, 0, 5 / 16),
+    (1, 1, 1 / 16),
+)
+
+
+def bayer_matrix(order: int = BAYER_ORDER) -> np.ndarray:
+    """
+    Return the 2**order square Bayer index matrix, with the values 0 .. 4**order - 1.
+    """
+    m = np.zeros((1, 1), dtype=np.int64)
+    for _ in range(order):
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return m
+
+
+def ordered_dither(levels: np.ndarray, order: int = BAYER_ORDER) -> np.ndarray:
+    """
+    Return the pixels of the levels array (0..1) that are on after ordered dithering with the tiled
+    Bayer matrix, so a level of 0.25 turns on every fourth pixel of each tile.
+    """
+    m = bayer_matrix(order)
+    thresholds = (m + 0.5) / m.size
+    rows = np.arange(levels.shape[0]) % len(m)
+    cols = np.arange(levels.shape[1]) % len(m)
+    return levels > thresholds[rows[:, None], cols[None, :]]
+
+
+def error_diffusion(levels: np.ndarray) -> np.ndarray:
+    """
+    Return the pixels of the levels array (0..1) that are on after Floyd-Steinberg error diffusion
+    in raster order.
+
+    A pixel only receives error from its left neighbour and the three pixels above it, so all pixels
+    with the same 2 * row + column are independent. They are quantised together, one skewed row at a
+    time, which gives the raster order result in rows + 2 * columns vectorised steps.
+    """
+    ny, nx = levels.shape
+    # one padding row below and one padding column either side take the error diffused off the edges
+    work = np.zeros((ny + 1, nx + 2), dtype=np.float64)
+    work[:ny, 1:nx + 1] = levels
+    on = np.zeros((ny, nx), dtype=bool)
+
+    for step in range(nx + 2 * (ny - 1)):
+        rows = np.arange(max(0, (step - nx + 2) // 2), min(ny - 1, step // 2) + 1)
+        cols = step - 2 * rows + 1
+        value = work[rows, cols]
+        pixel = value >= 0.5
+        on[rows, cols - 1] = pixel
+        error = value - pixel
+        for drow, dcol, share in FLOYD_STEINBERG:
+            work[rows + drow, cols + dcol] += share * error
+    return on
+
+
+def halftone(levels: np.ndarray, mode: str) -> np.ndarray:
+    """
+    Return the boolean spot mask of the levels array (0..1) with the halftone mode, see HALFTONE_MODES.
+    """
+    if mode == 'bayer':
+        return ordered_dither(levels)
+    if mode == 'diffusion':
+        return error_diffusion(levels)
+    raise ValueError(f"Unknown halftone mode '{mode}', use one of {', '.join(HALFTONE_MODES)}")
@@ -0,0 +1,195 @@
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional
+
+from dicomplan.info import find_plans, plan_summary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX = "dicomplan_index.sqlite"
+ENERGY_TOLERANCE = 0.5  # MeV, for matching layer energies in queries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sop_instance_uid TEXT,
+    patient_id TEXT,
+    label TEXT,
+    beams INTEGER,
+    layers INTEGER,
+    spots INTEGER,
+    mu REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS beams (
+    path TEXT NOT NULL REFERENCES plans(path) ON DELETE CASCADE,
+    beam_number INTEGER,
+    name TEXT,
+    machine TEXT,
+    gantry_angle REAL,
+    layers INTEGER,
+    spots INTEGER,
+    mu REAL
+);
+CREATE TABLE IF NOT EXISTS layers (
+    path TEXT NOT NULL REFERENCES plans(path) ON DELETE CASCADE,
+    beam_number INTEGER,
+    layer INTEGER,
+    energy REAL,
+    spots INTEGER,
+    mu REAL
+);
+CREATE INDEX IF NOT EXISTS beams_path ON beams(path);
+CREATE INDEX IF NOT EXISTS layers_path ON layers(path);
+CREATE INDEX IF NOT EXISTS layers_energy ON layers(energy);
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open (and create) a plan index.
+    """
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(SCHEMA)
+    return db
+
+
+def _summaries(paths: list[str], jobs: int) -> Iterator[dict]:
+    """
+    Yield the plan summaries of files, read in jobs parallel processes. Spot positions are not read.
+    """
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+            yield from pool.map(plan_summary, paths, [None] * len(paths), [False] * len(paths),
+                                chunksize=max(1, min(64, len(paths) // (4 * jobs))))
+    else:
+        for path in paths:
+            yield plan_summary(path, bbox=False)
+
+
+def _insert(db: sqlite3.Connection, summary: dict, signature: tuple[int, int]):
+    path = summary['file']
+    db.execute("DELETE FROM plans WHERE path = ?", (path,))
+    beams = summary.get('beams', [])
+    db.execute("INSERT INTO plans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (path, *signature, summary.get('sop_instance_uid'), summary.get('patient_id'), summary.get('label'),
+                len(beams), sum(len(beam['layers']) for beam in beams), sum(beam['spots'] for beam in beams),
+                sum(beam['mu'] for beam in beams), summary.get('error')))
+    db.executemany("INSERT INTO beams VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   [(path, beam['number'], beam['name'], beam['machine'], beam['gantry_angle'],
+                     len(beam['layers']), beam['spots'], beam['mu']) for beam in beams])
+    db.executemany("INSERT INTO layers VALUES (?, ?, ?, ?, ?, ?)",
+                   [(path, beam['number'], i, layer['energy'], layer['spots'], layer['mu'])
+                    for beam in beams for i, layer in enumerate(beam['layers'], start=1)])
+
+
+def update_index(index: str, paths: list[str], jobs: int = 1) -> tuple[int, int]:
+    """
+    Add the DICOM plans in paths (files or directories) to the index, reading only files which are new
+    or whose mtime or size changed. Indexed plans below the given directories which no longer exist
+    are removed. Returns the number of plans (re)indexed and removed.
+    """
+    files = [os.path.abspath(path) for path in find_plans(paths)]
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+
+    db = connect(index)
+    try:
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in db.execute("SELECT path, mtime_ns, size FROM plans")}
+        signatures = {}
+        for path in files:
+            st = os.stat(path)
+            if known.get(path) != (st.st_mtime_ns, st.st_size):
+                signatures[path] = (st.st_mtime_ns, st.st_size)
+
+        roots = [os.path.join(os.path.abspath(path), '') for path in paths if os.path.isdir(path)]
+        present = set(files)
+        removed = [path for path in known if path not in present and any(path.startswith(root) for root in roots)]
+
+        with db:
+            db.executemany("DELETE FROM plans WHERE path = ?", [(path,) for path in removed])
+            for summary in _summaries(list(signatures), jobs):
+                if 'error' in summary:
+                    logger.warning(f"{summary['file']}: {summary['error']}")
+                _insert(db, summary, signatures[summary['file']])
+    finally:
+        db.close()
+
+    logger.info(f"Indexed {len(signatures)} plans, {len(files) - len(signatures)} unchanged, {len(removed)} removed")
+    return len(signatures), len(removed)
+
+
+def query_index(index: str, energy: Optional[float] = None, energy_tolerance: float = ENERGY_TOLERANCE,
+                min_spots: Optional[int] = None, max_spots: Optional[int] = None,
+                machine: Optional[str] = None, patient_id: Optional[str] = None,
+                gantry_angle: Optional[float] = None, where: Optional[str] = None) -> list[tuple]:
+    """
+    Return (path, patient_id, label, layers, spots, mu) of the indexed plans matching all given conditions:
+    a layer within energy_tolerance of energy [MeV], total spots in [min_spots, max_spots], a beam on machine
+    or at gantry_angle [deg], the patient ID, and an extra SQL condition on the plans table.
+    Unreadable files are never returned.
+    """
+    conditions = ["error IS NULL"]
+    parameters: list = []
+    if energy is not None:
+        conditions.append("path IN (SELECT path FROM layers WHERE energy BETWEEN ? AND ?)")
+        parameters += [energy - energy_tolerance, energy + energy_tolerance]
+    if min_spots is not None:
+        conditions.append("spots >= ?")
+        parameters.append(min_spots)
+    if max_spots is not None:
+        conditions.append("spots <= ?")
+        parameters.append(max_spots)
+    if machine is not None:
+        conditions.append("path IN (SELECT path FROM beams WHERE machine = ? COLLATE NOCASE)")
+        parameters.append(machine)
+    if gantry_angle is not None:
+        conditions.append("path IN (SELECT path FROM beams WHERE abs(gantry_angle - ?) < 1e-3)")
+        parameters.append(gantry_angle)
+    if patient_id is not None:
+        conditions.append("patient_id = ?")
+        parameters.append(patient_id)
+    if where:
+        conditions.append(f"({where})")
+
+    if not Path(index).is_file():
+        raise FileNotFoundError(f"Index {index} not found, create it with 'dicomplan index'")
+    db = connect(index)
+    try:
+        return db.execute("SELECT path, patient_id, label, layers, spots, mu FROM plans WHERE "
+                          + " AND ".join(conditions) + " ORDER BY path", parameters).fetchall()
+    finally:
+        db.close()
+
+
+def index_from_args(args) -> Optional[int]:
+    """
+    Run the index subcommand.
+    """
+    indexed, removed = update_index(args.db, args.paths, args.jobs)
+    print(f"{args.db}: {indexed} plans indexed, {removed} removed")
+    return None
+
+
+def query_from_args(args) -> Optional[int]:
+    """
+    Run the query subcommand: print the matching plans, or only their number with --count.
+    Returns 1 if no plan matches, like grep.
+    """
+    try:
+        rows = query_index(args.db, args.energy, args.energy_tolerance, args.min_spots, args.max_spots,
+                           args.machine, args.patient_id, args.gantry_angle, args.where)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        logger.error(f"Query failed: {e}")
+        return 1
+    if args.count:
+        print(len(rows))
+    else:
+        for path, patient_id, label, layers, spots, mu in rows:
+            print(f"{path}: '{label}', patient '{patient_id}', {layers} layers, {spots} spots, {mu:.2f} MU")
+    return None if rows else 1
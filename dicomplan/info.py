@@ -0,0 +1,184 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pydicom
+
+from dicomplan.reader import beam_meterset, float_array, is_big_endian
+
+logger = logging.getLogger(__name__)
+
+# top level elements read for the summary, everything else in the file is skipped
+SUMMARY_TAGS = ['PatientID', 'PatientName', 'RTPlanLabel', 'RTPlanDate', 'SOPInstanceUID',
+                'IonBeamSequence', 'FractionGroupSequence']
+DEFER_SIZE = '4 KB'  # top level values larger than this are only read from file when accessed
+DICOM_SUFFIXES = ('.dcm', '.dicom')
+
+
+def find_plans(paths: list[str]) -> list[str]:
+    """
+    Expand directories into the DICOM files (*.dcm, *.dicom) below them, in sorted order.
+    Files are passed through regardless of their suffix.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(str(p) for p in Path(path).rglob('*')
+                            if p.is_file() and p.suffix.lower() in DICOM_SUFFIXES)
+        else:
+            files.append(path)
+    return files
+
+
+def read_plan(path: str, tags: Optional[list[str]] = None) -> pydicom.Dataset:
+    """
+    Read only the summary elements and the extra top level tags of a plan.
+    Large top level values are deferred, spot arrays in the beam sequence stay raw bytes until used.
+    """
+    return pydicom.dcmread(path, defer_size=DEFER_SIZE, specific_tags=SUMMARY_TAGS + list(tags or []))
+
+
+def plan_summary(path: str, tags: Optional[list[str]] = None, bbox: bool = True) -> dict:
+    """
+    Return a summary of a plan file: plan and patient labels, the requested extra tags, and per beam
+    the energy layers with their spot counts, MU and spot bounding box [mm].
+
+    Layer MU are taken from the cumulative meterset weights and the spot counts from NumberOfScanSpotPositions,
+    so the spot weights are never read. Spot positions are only read for the bounding box.
+    Consecutive control points at the same energy are one layer. Errors are returned in 'error'.
+    """
+    summary = {'file': path}
+    try:
+        ds = read_plan(path, tags)
+    except Exception as e:
+        summary['error'] = f"cannot read plan: {e}"
+        return summary
+
+    summary['label'] = str(ds.get('RTPlanLabel', ''))
+    summary['patient_id'] = str(ds.get('PatientID', ''))
+    summary['sop_instance_uid'] = str(ds.get('SOPInstanceUID', ''))
+    summary['tags'] = {tag: str(ds.get(tag, '')) for tag in tags or []}
+    big_endian = is_big_endian(ds)
+    summary['beams'] = [_beam_summary(ds, beam, bbox, big_endian) for beam in ds.get('IonBeamSequence', [])]
+    return summary
+
+
+def _beam_summary(ds: pydicom.Dataset, beam: pydicom.Dataset, bbox: bool, big_endian: bool) -> dict:
+    cps = beam.get('IonControlPointSequence', [])
+    final = float(beam.get('FinalCumulativeMetersetWeight', 0.0))
+    meterset = beam_meterset(ds, beam.get('BeamNumber'))
+    # weights are relative to the final cumulative meterset weight, MU come from the fraction group
+    scale = meterset / final if final > 0 and np.isfinite(meterset) else 1.0
+
+    energies = np.empty(len(cps))
+    cumulative = np.empty(len(cps))
+    nspots = np.empty(len(cps), dtype=np.int64)
+    energy = 0.0
+    for i, cp in enumerate(cps):
+        energy = float(cp.get('NominalBeamEnergy', energy))
+        energies[i] = energy
+        cumulative[i] = float(cp.get('CumulativeMetersetWeight', 0.0))
+        nspots[i] = int(cp.get('NumberOfScanSpotPositions', 0))
+
+    # a control point delivers the weight up to the next one, the last one delivers nothing
+    delivered = np.diff(cumulative, append=cumulative[-1:]) if len(cps) else np.empty(0)
+    starts = np.flatnonzero(np.diff(energies, prepend=np.nan) != 0)
+
+    layers = []
+    xmin = ymin = np.inf
+    xmax = ymax = -np.inf
+    for start, stop in zip(starts, np.append(starts[1:], len(cps))):
+        active = np.arange(start, stop)[delivered[start:stop] > 0]
+        layer = {'energy': float(energies[start]), 'spots': int(nspots[active].sum()),
+                 'mu': float(delivered[active].sum() * scale)}
+        if bbox:
+            xy = [float_array(cps[i], 'ScanSpotPositionMap', big_endian).reshape(-1, 2) for i in active]
+            xy = np.concatenate(xy) if xy else np.empty((0, 2), dtype=np.float32)
+            if len(xy):
+                layer['bbox'] = [float(v) for v in (*xy.min(axis=0), *xy.max(axis=0))]
+                xmin, ymin = min(xmin, layer['bbox'][0]), min(ymin, layer['bbox'][1])
+                xmax, ymax = max(xmax, layer['bbox'][2]), max(ymax, layer['bbox'][3])
+        layers.append(layer)
+
+    summary = {'number': beam.get('BeamNumber'), 'name': str(beam.get('BeamName', '')),
+               'machine': str(beam.get('TreatmentMachineName', '')),
+               'gantry_angle': float(cps[0].get('GantryAngle', 0.0)) if len(cps) else 0.0,
+               'control_points': len(cps), 'layers': layers,
+               'spots': sum(layer['spots'] for layer in layers),
+               'mu': meterset if np.isfinite(meterset) else final}
+    if bbox and np.isfinite(xmin):
+        summary['bbox'] = [xmin, ymin, xmax, ymax]
+    return summary
+
+
+def format_summary(summary: dict, show_layers: bool = False) -> str:
+    """
+    Format a plan summary as a few lines of text, one per beam, and optionally one per layer.
+    """
+    if 'error' in summary:
+        return f"{summary['file']}: ERROR: {summary['error']}"
+    beams = summary['beams']
+    lines = [f"{summary['file']}: '{summary['label']}', patient '{summary['patient_id']}', "
+             f"{len(beams)} beam{'s' if len(beams) != 1 else ''}"]
+    lines += [f"  {tag}: {value}" for tag, value in summary['tags'].items()]
+    for beam in beams:
+        energies = [layer['energy'] for layer in beam['layers']]
+        energy = f"{max(energies):g}-{min(energies):g} MeV" if len(set(energies)) > 1 \
+            else f"{energies[0]:g} MeV" if energies else "no energy"
+        nlayers = len(beam['layers'])
+        line = (f"  beam {beam['number']} '{beam['name']}' {beam['machine']}, gantry {beam['gantry_angle']:g}, "
+                f"{nlayers} layer{'s' if nlayers != 1 else ''}, {energy}, {beam['spots']} spots, {beam['mu']:.2f} MU")
+        if 'bbox' in beam:
+            line += ", " + _format_bbox(beam['bbox'])
+        lines.append(line)
+        if show_layers:
+            for i, layer in enumerate(beam['layers'], start=1):
+                line = f"    layer {i}: {layer['energy']:g} MeV, {layer['spots']} spots, {layer['mu']:.2f} MU"
+                if 'bbox' in layer:
+                    line += ", " + _format_bbox(layer['bbox'])
+                lines.append(line)
+    return "\n".join(lines)
+
+
+def _format_bbox(bbox: list[float]) -> str:
+    return f"x {bbox[0]:.1f}..{bbox[2]:.1f} mm, y {bbox[1]:.1f}..{bbox[3]:.1f} mm"
+
+
+def info_files(paths: list[str], tags: Optional[list[str]] = None, show_layers: bool = False,
+               bbox: bool = True, jobs: int = 1, dump: bool = False) -> int:
+    """
+    Print a summary of DICOM plan files and the plans in directories, reading them in jobs parallel
+    processes. With dump, the elements that were read are printed instead. Returns 1 if any file
+    could not be read.
+    """
+    files = find_plans(paths)
+    if not files:
+        logger.error("No DICOM files found")
+        return 1
+    if dump:
+        status = 0
+        for path in files:
+            try:
+                print(f"{path}:\n{read_plan(path, tags)}")
+            except Exception as e:
+                print(f"{path}: ERROR: cannot read plan: {e}")
+                status = 1
+        return status
+
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    status = 0
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+            summaries = pool.map(plan_summary, files, [tags] * len(files), [bbox] * len(files))
+            for summary in summaries:
+                status |= 'error' in summary
+                print(format_summary(summary, show_layers))
+    else:
+        for path in files:
+            summary = plan_summary(path, tags, bbox)
+            status |= 'error' in summary
+            print(format_summary(summary, show_layers))
+    return int(status)
@@ -0,0 +1,140 @@
+import functools
+import json
+import logging
+import tomllib
+from importlib import resources
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from dicomplan.model import PlanInputModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MACHINE = "tr4"
+PROFILE_SUFFIXES = ('.toml', '.json')
+
+
+class MachineProfile:
+    """
+    Machine and beam model of a treatment machine, with the energy dependent quantities
+    stored as interpolation tables sorted by energy.
+    """
+
+    def __init__(self, name: str, data: dict):
+        self.name = name
+        self.description: str = data.get('description', '')
+        self.virtual_source_axis_distances: list[float] = list(data.get('virtual_source_axis_distances',
+                                                                        [2000.0, 2560.0]))  # mm
+        self.scan_spot_tune_id: str = str(data.get('scan_spot_tune_id', '4.0'))
+        self.limits: dict = dict(data.get('limits', {}))
+        self.impac: dict = dict(data.get('impac', {}))
+
+        beam_model = data.get('beam_model', {})
+        energy = np.asarray(beam_model.get('energy', []), dtype=np.float64)
+        if len(energy) == 0:
+            raise ValueError(f"Machine profile {name} has no beam_model energies")
+        order = np.argsort(energy)
+        self.energy = energy[order]
+        self.tables: dict[str, np.ndarray] = {}
+        for key, values in beam_model.items():
+            if key == 'energy':
+                continue
+            values = np.asarray(values, dtype=np.float64)
+            if len(values) != len(energy):
+                raise ValueError(f"Machine profile {name}: beam_model.{key} has {len(values)} values, "
+                                 f"expected {len(energy)}")
+            self.tables[key] = values[order]
+
+    def interpolate(self, key: str, energies) -> np.ndarray:
+        """
+        Interpolate the beam model table key at the given energies [MeV].
+        """
+        if key not in self.tables:
+            raise KeyError(f"Machine profile {self.name} has no beam_model.{key} table")
+        return np.interp(np.asarray(energies, dtype=np.float64), self.energy, self.tables[key])
+
+    def spot_fwhm(self, energies) -> np.ndarray:
+        """
+        Return the spot size FWHM at isocentre in mm as an array of shape (..., 2) for x and y.
+        """
+        return np.stack((self.interpolate('spot_fwhm_x', energies), self.interpolate('spot_fwhm_y', energies)), axis=-1)
+
+    def range(self, energies) -> np.ndarray:
+        """
+        Return the range in water [g/cm2] at the given energies [MeV].
+        """
+        return self.interpolate('range', energies)
+
+    def particles_per_mu(self, energies) -> np.ndarray:
+        """
+        Return the number of particles per MU at the given energies [MeV].
+        """
+        return self.interpolate('particles_per_mu', energies)
+
+    def limit(self, key: str, default=None):
+        """
+        Return a machine limit, or default if the profile does not define it.
+        """
+        return self.limits.get(key, default)
+
+
+def _profile_path(name_or_path: str) -> Optional[Path]:
+    """
+    Find the profile file for a machine name or a path to a profile file.
+    """
+    if is_profile_file(name_or_path):
+        return Path(name_or_path)
+
+    machines = resources.files('dicomplan') / 'machines'
+    for suffix in PROFILE_SUFFIXES:
+        candidate = machines / f"{name_or_path.lower()}{suffix}"
+        if candidate.is_file():
+            return Path(str(candidate))
+    return None
+
+
+def is_profile_file(name_or_path: str) -> bool:
+    """
+    Return True if name_or_path refers to a machine profile file rather than a machine name.
+    """
+    path = Path(name_or_path)
+    return path.suffix.lower() in PROFILE_SUFFIXES and path.is_file()
+
+
+@functools.lru_cache(maxsize=None)
+def load_machine(name_or_path: str = DEFAULT_MACHINE) -> MachineProfile:
+    """
+    Load a machine profile by machine name (looked up in dicomplan/machines) or from a TOML/JSON file.
+    Profiles are parsed once per process. Unknown machine names fall back to the default profile.
+    """
+    path = _profile_path(name_or_path)
+    if path is None:
+        if name_or_path.lower() == DEFAULT_MACHINE:
+            raise FileNotFoundError(f"Default machine profile {DEFAULT_MACHINE} not found")
+        logger.warning(f"No machine profile for '{name_or_path}', using the beam model of {DEFAULT_MACHINE}")
+        return load_machine(DEFAULT_MACHINE)
+
+    logger.debug(f"Loading machine profile {path}")
+    if path.suffix.lower() == '.json':
+        data = json.loads(path.read_text())
+    else:
+        data = tomllib.loads(path.read_text())
+    return MachineProfile(data.get('name', path.stem), data)
+
+
+def machine_for_model(model: PlanInputModel) -> MachineProfile:
+    """
+    Return the machine profile selected for a model.
+    """
+    return load_machine(model.field_machine_profile or model.field_treatment_machine or DEFAULT_MACHINE)
+
+
+def dose_fwhm(model: PlanInputModel, energy: float) -> list[float]:
+    """
+    Return the dose plot FWHM [cm] for x and y: the one set in the model, or the machine spot size at energy.
+    """
+    if model.plot_dose_fwhm is not None:
+        return list(model.plot_dose_fwhm)
+    return (machine_for_model(model).spot_fwhm(energy) / 10.0).tolist()  # mm to cm
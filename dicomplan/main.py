@@ -1,7 +1,14 @@
 from dicomplan.config_parser import parse_arguments
-from dicomplan.config_parser import get_model_from_args
 
-from dicomplan.dicom import Dicom
+from dicomplan.build import build_plan
+from dicomplan.gamma import gamma_from_args
+from dicomplan.index import index_from_args, query_from_args
+from dicomplan.info import info_files
+from dicomplan.montecarlo import export_mc_from_args
+from dicomplan.robust import robust_from_args
+from dicomplan.sweep import sweep_from_args
+from dicomplan.validate import validate_files
+from dicomplan.watch import watch_manifest
 
 import sys
 import logging
@@ -17,36 +24,63 @@ def main(args=None):
 
     # Parse the command-line arguments
     parsed_args = parse_arguments(args)
-    # Populate the model from the parsed arguments
-    m = get_model_from_args(parsed_args)
 
+    _setup_logging(parsed_args.verbosity)
+
+    if parsed_args.pattern_type == 'validate':
+        return validate_files(parsed_args.files, parsed_args.machine)
+
+    if parsed_args.pattern_type == 'info':
+        return info_files(parsed_args.files, parsed_args.tags, parsed_args.layers, not parsed_args.no_bbox,
+                          parsed_args.jobs, parsed_args.dump)
+
+    if parsed_args.pattern_type == 'export-mc':
+        return export_mc_from_args(parsed_args)
+
+    if parsed_args.pattern_type == 'gamma':
+        return gamma_from_args(parsed_args)
+
+    if parsed_args.pattern_type == 'index':
+        return index_from_args(parsed_args)
+
+    if parsed_args.pattern_type == 'query':
+        return query_from_args(parsed_args)
+
+    if parsed_args.pattern_type == 'watch':
+        return watch_manifest(parsed_args.manifest, parsed_args.poll_interval, parsed_args.debounce,
+                              use_inotify=not parsed_args.poll)
+
+    if parsed_args.pattern_type == 'robust':
+        return robust_from_args(parsed_args)
+
+    if parsed_args.pattern_type == 'sweep':
+        return sweep_from_args(parsed_args)
+
+    return build_plan(parsed_args)
+
+
+def _setup_logging(verbosity: int):
+    """
+    Configure logging for the dicomplan package according to the -v count.
+    """
     # Root logger stays at WARNING so third-party libraries (matplotlib etc.) stay quiet.
     logging.basicConfig(level=logging.WARNING)
 
     # Give the dicomplan logger its own handler and disable propagation so its records
     # never reach the root handler's WARNING gate, allowing -v/-vv to work correctly.
     pkg_logger = logging.getLogger('dicomplan')
-    pkg_handler = logging.StreamHandler()
-    pkg_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
-    pkg_logger.addHandler(pkg_handler)
+    if not pkg_logger.handlers:
+        pkg_handler = logging.StreamHandler()
+        pkg_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+        pkg_logger.addHandler(pkg_handler)
     pkg_logger.propagate = False
-    if parsed_args.verbosity == 1:
+    if verbosity == 1:
         pkg_logger.setLevel(logging.INFO)
-    elif parsed_args.verbosity > 1:
+    elif verbosity > 1:
         pkg_logger.setLevel(logging.DEBUG)
     else:
         pkg_logger.setLevel(logging.WARNING)
 
-    d = Dicom()
-    d.apply_model(m)
-
-    if m.output_path is None:
-        logger.error("Output path is not set. Cannot write DICOM file.")
-        return 1
-    d.write(m.output_path)
-
-    logger.info(f"Plan written to {m.output_path}")
-
 
 if __name__ == '__main__':
     sys.exit(main())
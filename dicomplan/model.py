@@ -1,7 +1,33 @@
+import datetime
+import json
 from typing import Optional
 
+import numpy as np
+
+# model fields which name output files only and do not change the plan content
+OUTPUT_ONLY_FIELDS = ('plan_id', 'output_path', 'plot_dose_filepath', 'export_spots_path', 'stats_path',
+                      'export_mc_path', 'export_frame')
+
 
 class PlanInputModel:
+    """
+    Plan parameters from the command line. The fields are fixed by __slots__, so a misspelt name raises
+    AttributeError instead of adding a field, and the model pickles as a plain tuple of its values.
+    """
+
+    __slots__ = (
+        'plan_id', 'plan_name', 'plan_description', 'output_path', 'export_spots_path', 'export_frame', 'stats_path',
+        'export_mc_path', 'plan_label', 'plan_patient_name', 'plan_patient_id', 'plan_reviewer_name',
+        'plan_operator_name', 'plan_reproducible', 'field_treatment_machine', 'field_machine_profile',
+        'field_gantry_angle', 'field_couch_angle', 'field_table_position', 'field_snout_position', 'spot_spacing',
+        'spot_spacing_sigma', 'spot_xymin', 'spot_xymax', 'trim_corners', 'boost_rim', 'spot_diameter', 'spot_center',
+        'spot_count', 'spot_energy', 'spot_energies', 'spot_mu', 'spot_shape', 'spot_pattern_type', 'spot_mu_min',
+        'spot_mu_max', 'spot_mu_resolution', 'spot_mu_low_policy', 'spot_max_per_cp', 'repaint_count', 'repaint_mode',
+        'spot_image_path', 'spot_energy_range', 'spot_halftone', 'spot_expression', 'spot_min_distance',
+        'spot_custom_path', 'plot_dose', 'plot_dose_fwhm', 'plot_dose_filepath', 'plot_dose_resolution',
+        'plot_dose_renderer', 'plot_dose_grid',
+    )
+
     def __init__(self, plan_id: str, plan_name: str, plan_description: str):
 
         # these are model.py only, will not be passed to dicom
@@ -11,42 +37,176 @@ class PlanInputModel:
 
         # these are passed to dicom
         self.output_path: Optional[str] = None
+        self.export_spots_path: Optional[str] = None  # spot list export, .npz, .csv or .npy
+        self.export_frame: str = 'beam'  # IEC 61217 frame of the exported spot positions, see geometry.py
+        self.stats_path: Optional[str] = None  # plan statistics, JSON
+        self.export_mc_path: Optional[str] = None  # Monte Carlo beam source, see montecarlo.py
         self.plan_label: Optional[str] = None
         self.plan_patient_name: Optional[str] = None
         self.plan_patient_id: Optional[str] = None
         self.plan_reviewer_name: Optional[str] = None
         self.plan_operator_name: Optional[str] = None
+        self.plan_reproducible: bool = False  # fixed timestamp and UIDs derived from the model hash
         self.field_treatment_machine: Optional[str] = None
+        self.field_machine_profile: Optional[str] = None  # machine name or profile file, see machine.py
         self.field_gantry_angle: Optional[float] = None
+        self.field_couch_angle: float = 0.0  # degrees, patient support angle
         self.field_table_position: Optional[list[float]] = None  # cm
         self.field_snout_position: Optional[float] = None  # cm
 
         self.spot_spacing: Optional[float] = None
+        self.spot_spacing_sigma: Optional[float] = None  # spacing as fraction of the spot sigma at each layer energy
 
         # position data with offsets
         # only for square patterns
         self.spot_xymin: list[float] = [0.0, 0.0]  # cm
         self.spot_xymax: list[float] = [0.0, 0.0]  # cm
-        self.spot_shape: Optional[str] = None
         self.trim_corners: bool = False
         self.boost_rim: float = 1.0
 
         # only for circular patterns
         self.spot_diameter = 10.0  # cm
-        self.spot_center = [0.0, 0.0]  # cm
+        self.spot_center = [0.0, 0.0]  # cm, also the offset added to the positions of custom spot maps
         self.spot_count = None
 
         self.spot_energy: float = 0.0  # MeV
+        self.spot_energies: Optional[list[float]] = None  # MeV, one layer per energy, None is spot_energy only
         self.spot_mu: Optional[float] = None
-        self.spot_shape: Optional[str] = None  # circular, square, or image
+        self.spot_shape: Optional[str] = None  # circular, square, image, compose or custom
         self.spot_pattern_type: Optional[str] = None  # square or hexagonal
 
+        # machine limits on the MU delivered per spot and painting
+        self.spot_mu_min: Optional[float] = None  # MU
+        self.spot_mu_max: Optional[float] = None  # MU
+        self.spot_mu_resolution: Optional[float] = None  # MU, weights are rounded to multiples of this
+        self.spot_mu_low_policy: str = 'drop'  # drop, merge or round spots below spot_mu_min
+        self.spot_max_per_cp: Optional[int] = None  # spots per control point pair, larger layers are split
+
+        # repainting: number of paintings, and whether to repaint each layer ('layered')
+        # or the full stack of layers ('volumetric')
+        self.repaint_count: int = 1
+        self.repaint_mode: str = 'layered'
+
         # in case of user loads a png image, this will be the path to the image
         self.spot_image_path: Optional[str] = None
+        # MeV, energies of the first and last frame of a multi-frame image, spread evenly over the frames
+        self.spot_energy_range: Optional[tuple[float, float]] = None
+        # bayer or diffusion: constant weight spots with the grey level as spot density, None weights by grey level
+        self.spot_halftone: Optional[str] = None
+
+        # shape expression for the compose shape, see compose.py, and the minimum distance [cm] between
+        # spots of different lattices in a union, None is half the smaller spacing
+        self.spot_expression: Optional[str] = None
+        self.spot_min_distance: Optional[float] = None
+
+        # precomputed spot map (x, y, weight[, energy]) for the custom shape, .npy or .csv
+        self.spot_custom_path: Optional[str] = None
 
         self.plot_dose: bool = False
 
         # sigma to fwhm conversion: fwhm = 2.355 * sigma
 
-        self.plot_dose_fwhm = [0.893, 0.615]  # cm, full width at half maximum for dose plot
+        # cm, full width at half maximum for dose plot, None follows the machine beam model
+        self.plot_dose_fwhm: Optional[list[float]] = None
         self.plot_dose_filepath = "plot_dose.png"
+        self.plot_dose_resolution: Optional[float] = None  # cm, None derives it from the FWHM
+        self.plot_dose_renderer = "pillow"  # pillow (fast) or matplotlib (publication quality)
+        self.plot_dose_grid: bool = True  # draw 1 cm / 0.5 cm grid lines
+
+    def fields(self) -> dict:
+        """
+        Return the fields of the model as a dict in declaration order, e.g. for a canonical serialisation.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def canonical(self, plot: bool = False) -> str:
+        """
+        Return a canonical JSON serialisation of the plan content: sorted keys, no whitespace, and without
+        the OUTPUT_ONLY_FIELDS. The dose plot options are only included if plot is True. Equal plans give
+        equal strings, so the string serves as a hashable key and as the input of the build cache digest.
+        """
+        content = {key: value for key, value in self.fields().items()
+                   if key not in OUTPUT_ONLY_FIELDS and (plot or not key.startswith('plot_'))}
+        return json.dumps(content, sort_keys=True, separators=(',', ':'), default=_json_default)
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__} in the plan model")
+
+
+class SpotTable:
+    """
+    The spots of a plan in delivery order, one contiguous array per column: positions xy [cm] as (N, 2)
+    float32, weight [MU] float32 and the layer index int32 of every spot, with the energy [MeV] and the
+    spot range of every layer, i.e. of every control point pair.
+
+    Consumers read the columns directly. Indexing the table by layer returns an (energy, coords, weights)
+    tuple like the lists the pipeline stages pass on, coords and weights as views of the columns with the
+    coords in the flat [x0, y0, x1, y1, ...] layout.
+    """
+
+    __slots__ = ('xy', 'weight', 'layer', 'energy', 'bounds')
+
+    def __init__(self, xy: np.ndarray, weight: np.ndarray, energy: np.ndarray, bounds: np.ndarray):
+        self.xy = np.ascontiguousarray(xy, dtype=np.float32).reshape(-1, 2)
+        self.weight = np.ascontiguousarray(weight, dtype=np.float32)
+        self.energy = np.asarray(energy, dtype=np.float64)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        if len(self.xy) != len(self.weight) or len(self.bounds) != len(self.energy) + 1 \
+                or self.bounds[-1] != len(self.weight):
+            raise ValueError(f"Spot table columns do not match: {len(self.xy)} positions, {len(self.weight)} "
+                             f"weights, {len(self.energy)} layers ending at spot {self.bounds[-1]}")
+        self.layer = np.repeat(np.arange(len(self.energy), dtype=np.int32), np.diff(self.bounds))
+
+    @classmethod
+    def from_layers(cls, layers: list[tuple[float, np.ndarray, np.ndarray]]) -> 'SpotTable':
+        """
+        Return the table of (energy, coords [cm], weights) layers, copying the spots into the columns once.
+        """
+        counts = [len(weights) for _, _, weights in layers]
+        nspots = sum(counts)
+        xy = np.empty((nspots, 2), dtype=np.float32)
+        weight = np.empty(nspots, dtype=np.float32)
+        bounds = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        for (_, coords, weights), start, stop in zip(layers, bounds[:-1], bounds[1:]):
+            xy[start:stop] = np.asarray(coords).reshape(-1, 2)
+            weight[start:stop] = weights
+        return cls(xy, weight, [energy for energy, _, _ in layers], bounds)
+
+    @classmethod
+    def of(cls, layers) -> 'SpotTable':
+        """
+        Return layers if it is a table already, else the table of the (energy, coords [cm], weights) layers.
+        """
+        return layers if isinstance(layers, cls) else cls.from_layers(layers)
+
+    @property
+    def nspots(self) -> int:
+        return len(self.weight)
+
+    def __len__(self) -> int:
+        return len(self.energy)
+
+    def __getitem__(self, index: int) -> tuple[float, np.ndarray, np.ndarray]:
+        if not isinstance(index, (int, np.integer)):
+            raise TypeError(f"Spot table layers are indexed by integers, not {type(index).__name__}; "
+                            "slice the columns instead")
+        index = range(len(self))[index]
+        start, stop = self.bounds[index], self.bounds[index + 1]
+        return float(self.energy[index]), self.xy[start:stop].reshape(-1), self.weight[start:stop]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
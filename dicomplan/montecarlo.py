@@ -0,0 +1,158 @@
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pydicom
+
+from dicomplan.dose import FWHM_TO_SIGMA
+from dicomplan.export import EXPORT_CHUNK, spot_blocks
+from dicomplan.machine import MachineProfile, load_machine
+from dicomplan.model import SpotTable
+from dicomplan.reader import plan_layers
+
+logger = logging.getLogger(__name__)
+
+MC_FORMATS = ('shieldhit', 'topas')
+MC_SUFFIXES = {'.dat': 'shieldhit', '.txt': 'topas'}  # format of an output path if not given
+DEFAULT_HISTORIES = 1000000  # TOPAS histories of the whole plan
+SHIELDHIT_LINE = '%.6f %.4f %.4f %.4f %.4f %.6e\n'  # energy [GeV], x, y, FWHM x, y [cm], particles
+TOPAS_SOURCE = "Beam"  # TOPAS particle source and the component it is placed on, "<source>Position"
+TOPAS_SPOT_PARAMETERS = (  # time feature, value type, unit
+    ('SpotEnergy', 'dv', 'MeV'),
+    ('SpotX', 'dv', 'mm'),
+    ('SpotY', 'dv', 'mm'),
+    ('SpotSigmaX', 'dv', 'mm'),
+    ('SpotSigmaY', 'dv', 'mm'),
+    ('SpotHistories', 'iv', ''),
+)
+
+
+def spot_source_blocks(layers: list[tuple[float, np.ndarray, np.ndarray]], machine: MachineProfile):
+    """
+    Yield blocks of the beam source columns energy [MeV], x, y [mm], spot FWHM x, y [mm] from the machine
+    beam model, and particles from the spot MU (the MU if the beam model has no particles_per_mu table),
+    in layer order. Blocks are converted one at a time from the SpotTable columns, see export.spot_blocks().
+    """
+    per_mu = 'particles_per_mu' in machine.tables
+    for _, block in spot_blocks(layers):
+        fwhm = machine.spot_fwhm(block['energy'])
+        particles = block['mu'] * machine.particles_per_mu(block['energy']) if per_mu \
+            else block['mu'].astype(np.float64)
+        yield block['energy'], block['x'], block['y'], fwhm[:, 0], fwhm[:, 1], particles
+
+
+def mc_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    Return the Monte Carlo format fmt, or the format of the path suffix, see MC_SUFFIXES.
+    """
+    if fmt is None:
+        fmt = MC_SUFFIXES.get(Path(path).suffix.lower())
+        if fmt is None:
+            raise ValueError(f"Cannot tell the Monte Carlo format of {path}, use a "
+                             f"{' or '.join(MC_SUFFIXES)} file or give the format")
+    if fmt not in MC_FORMATS:
+        raise ValueError(f"Unknown Monte Carlo format '{fmt}', use one of {', '.join(MC_FORMATS)}")
+    return fmt
+
+
+def export_mc(path: str, layers: list[tuple[float, np.ndarray, np.ndarray]], machine: MachineProfile,
+              fmt: Optional[str] = None, histories: int = DEFAULT_HISTORIES) -> int:
+    """
+    Write the (energy, coords [cm], MU) layers of a plan as a Monte Carlo beam source:
+      shieldhit : SHIELD-HIT12A sobp.dat spot list, one line per spot with energy [GeV], x, y [cm],
+                  FWHM x, y [cm] and the number of particles as weight,
+      topas : TOPAS parameter file with one time step per spot, setting the energy, position and
+              Gaussian sigma of the TOPAS_SOURCE beam and its histories, histories in total shared by
+              the particles of the spots.
+    fmt defaults to the format of the path suffix. The spot data is streamed in chunks, so the layers may be
+    memory mapped or views of a read plan. Returns the number of spots.
+    """
+    fmt = mc_format(path, fmt)
+    layers = SpotTable.of(layers)
+    nspots = layers.nspots
+    if nspots == 0:
+        raise ValueError("The plan has no spots to export")
+    if 'particles_per_mu' not in machine.tables:
+        logger.warning(f"Machine profile {machine.name} has no beam_model.particles_per_mu table, "
+                       f"particle weights are MU")
+
+    with open(path, 'w') as f:
+        if fmt == 'shieldhit':
+            for energy, x, y, fwhm_x, fwhm_y, particles in spot_source_blocks(layers, machine):
+                # MeV to GeV, mm to cm
+                columns = np.column_stack((energy / 1000.0, x / 10.0, y / 10.0, fwhm_x / 10.0, fwhm_y / 10.0,
+                                           particles))
+                _write_values(f, columns, SHIELDHIT_LINE)
+        else:
+            _write_topas(f, layers, machine, nspots, histories)
+
+    logger.info(f"Exported {nspots} spots in {len(layers)} layers as {fmt} beam source to {path}")
+    return nspots
+
+
+def _write_topas(f, layers: list[tuple[float, np.ndarray, np.ndarray]], machine: MachineProfile, nspots: int,
+                 histories: int):
+    """
+    Write the TOPAS time features, one parameter line per spot column. Each line streams the layers again,
+    the first pass sums the particles to scale them to histories.
+    """
+    total = sum(float(np.sum(block[-1])) for block in spot_source_blocks(layers, machine))
+    scale = histories / total
+
+    f.write(f"# TOPAS beam source of {nspots} spots in {len(layers)} layers, one time step per spot\n")
+    f.write(f"i:Tc/NumberOfSequentialTimes = {nspots}\n")
+    f.write(f"d:Tc/TimelineEnd = {nspots} ms\n")
+    f.write(f"dv:Tf/SpotEnergy/Times = {nspots} ")
+    for start in range(1, nspots + 1, EXPORT_CHUNK):
+        _write_values(f, np.arange(start, min(start + EXPORT_CHUNK, nspots + 1)), '%d ')
+    f.write("ms\n")
+
+    for column, (name, kind, unit) in enumerate(TOPAS_SPOT_PARAMETERS):
+        f.write(f's:Tf/{name}/Function = "Step"\n')
+        if name != 'SpotEnergy':
+            f.write(f"dv:Tf/{name}/Times = Tf/SpotEnergy/Times ms\n")
+        f.write(f"{kind}:Tf/{name}/Values = {nspots} ")
+        for block in spot_source_blocks(layers, machine):
+            values = block[column]
+            if name == 'SpotHistories':
+                _write_values(f, np.rint(values * scale).astype(np.int64), '%d ')
+            elif name.startswith('SpotSigma'):
+                _write_values(f, values * FWHM_TO_SIGMA, '%.4f ')
+            else:
+                _write_values(f, values, '%.4f ')
+        f.write(f"{unit}\n")
+
+    f.write(f"d:So/{TOPAS_SOURCE}/BeamEnergy = Tf/SpotEnergy/Value MeV\n")
+    f.write(f's:So/{TOPAS_SOURCE}/BeamPositionDistribution = "Gaussian"\n')
+    f.write(f"d:So/{TOPAS_SOURCE}/BeamPositionSpreadX = Tf/SpotSigmaX/Value mm\n")
+    f.write(f"d:So/{TOPAS_SOURCE}/BeamPositionSpreadY = Tf/SpotSigmaY/Value mm\n")
+    f.write(f"i:So/{TOPAS_SOURCE}/NumberOfHistoriesInRun = Tf/SpotHistories/Value\n")
+    f.write(f"d:Ge/{TOPAS_SOURCE}Position/TransX = Tf/SpotX/Value mm\n")
+    f.write(f"d:Ge/{TOPAS_SOURCE}Position/TransY = Tf/SpotY/Value mm\n")
+
+
+def _write_values(f, values: np.ndarray, fmt: str):
+    """
+    Write the values of a chunk, fmt per row, formatted in one operation, which is several times faster than
+    np.savetxt.
+    """
+    f.write((fmt * len(values)) % tuple(values.ravel().tolist()))
+
+
+def export_mc_from_args(args) -> Optional[int]:
+    """
+    Run the export-mc subcommand: write the beam source of a DICOM plan.
+    """
+    ds = pydicom.dcmread(args.plan)
+    layers = plan_layers(ds, args.beam)
+    if not layers:
+        logger.error(f"{args.plan} has no spots with meterset weight")
+        return 1
+    machine = args.machine
+    if machine is None:
+        # beam model of the first exported beam's treatment machine
+        beams = [beam for beam in ds.IonBeamSequence if args.beam is None or beam.get('BeamNumber') == args.beam]
+        machine = beams[0].get('TreatmentMachineName') or None
+    export_mc(args.source, layers, load_machine(machine) if machine else load_machine(), args.format, args.histories)
+    return None
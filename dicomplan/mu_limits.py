@@ -0,0 +1,188 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+from dicomplan.dose import layered_dose_grid
+from dicomplan.model import SpotTable
+from dicomplan.stats import nearest_indices
+
+logger = logging.getLogger(__name__)
+
+LOW_MU_POLICIES = ('drop', 'merge', 'round')
+
+DOSE_IMPACT_FWHM_FRACTION = 0.25  # dose impact is evaluated on a coarser grid than the dose plot
+RESIDUAL_TOLERANCE = 1e-6  # MU, layer totals the limits do not restore within this are reported
+
+
+def enforce_mu_limits(coords: np.ndarray, mu: np.ndarray, mu_min: Optional[float] = None,
+                      mu_resolution: Optional[float] = None, policy: str = 'drop', mu_max: Optional[float] = None
+                      ) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Enforce the machine minimum and maximum MU and the MU resolution on the spots of a single layer.
+
+    Spots below mu_min are handled according to policy:
+      'drop'  : remove the spot,
+      'merge' : add its MU to the nearest spot at or above mu_min,
+      'round' : round up to mu_min if it holds at least half of mu_min, otherwise drop it.
+    The MU lost or gained is then distributed over the spots above mu_min, keeping them within
+    mu_min and mu_max, so the layer total is conserved whenever the limits allow it. Finally, MU are
+    rounded to multiples of mu_resolution with the largest remainder method, which keeps the layer
+    total up to one resolution step.
+
+    Returns the kept flat coords, their MU, and a dict with the MU per original spot (0 for removed
+    spots), counts of dropped, merged and rounded spots, and the residual MU by which the limits, before
+    rounding to the resolution, did not allow to restore the layer total.
+    """
+    if policy not in LOW_MU_POLICIES:
+        raise ValueError(f"Unknown low MU policy: {policy}")
+
+    mu = np.asarray(mu, dtype=np.float64)
+    xy = np.asarray(coords).reshape(-1, 2)
+    total = mu.sum()
+    new_mu = mu.copy()
+    stats = {'dropped': 0, 'merged': 0, 'rounded': 0}
+
+    if mu_min is not None and mu_min > 0:
+        low = mu < mu_min
+        if low.all():
+            raise ValueError(f"All {len(mu)} spots are below the minimum of {mu_min} MU per spot")
+        if low.any():
+            if policy == 'merge':
+                low_idx = np.flatnonzero(low)
+                keep_idx = np.flatnonzero(~low)
+                nearest = nearest_indices(xy[low_idx], xy[keep_idx])
+                np.add.at(new_mu, keep_idx[nearest], mu[low_idx])
+                new_mu[low_idx] = 0.0
+                stats['merged'] = len(low_idx)
+            elif policy == 'round':
+                up = low & (mu >= mu_min / 2)
+                new_mu[up] = mu_min
+                new_mu[low & ~up] = 0.0
+                stats['rounded'] = int(up.sum())
+                stats['dropped'] = int((low & ~up).sum())
+            else:
+                new_mu[low] = 0.0
+                stats['dropped'] = int(low.sum())
+
+            # conserve the layer total by rescaling the spots that were not touched
+            _rescale(new_mu, ~low, total, mu_min, mu_max)
+
+    stats['residual'] = float(new_mu.sum() - total)
+
+    if mu_resolution is not None and mu_resolution > 0:
+        new_mu = _round_largest_remainder(new_mu, mu_resolution, mu_min, mu_max)
+
+    keep = new_mu > 0
+    stats['mu'] = new_mu
+    return xy[keep].ravel(), new_mu[keep], stats
+
+
+def _rescale(mu: np.ndarray, free: np.ndarray, total: float, mu_min: Optional[float] = None,
+             mu_max: Optional[float] = None):
+    """
+    Scale the free spots of mu in place so the sum of mu becomes total, keeping them within mu_min and
+    mu_max. Spots clamped to a limit leave the free set and the others are scaled again, until the total
+    is reached or no free spot is left.
+    """
+    low = mu_min if mu_min is not None else 0.0
+    high = mu_max if mu_max is not None else np.inf
+    free = free.copy()
+    while free.any():
+        idx = np.flatnonzero(free)
+        free_total = mu[idx].sum()
+        if free_total <= 0:
+            break
+        scaled = mu[idx] * ((total - (mu.sum() - free_total)) / free_total)
+        mu[idx] = np.clip(scaled, low, high)
+        clamped = mu[idx] != scaled
+        if not clamped.any():
+            break
+        free[idx[clamped]] = False
+
+
+def apply_mu_limits(layers: SpotTable, mu_min: Optional[float] = None, mu_resolution: Optional[float] = None,
+                    policy: str = 'drop', fwhms: Optional[list[list[float]]] = None, mu_max: Optional[float] = None
+                    ) -> tuple[SpotTable, dict]:
+    """
+    Apply enforce_mu_limits() to every layer of a SpotTable (or a list of (energy, coords, mu) layers).
+
+    Returns the table of the kept spots and a report with the spot counts, the total MU before and after, the
+    residual MU the limits did not allow to restore and, if the FWHM (x, y) [cm] of every layer is given
+    and spots were removed or rounded up, the maximum dose change relative to the maximum dose in percent.
+    """
+    table = SpotTable.of(layers)
+    if mu_min is None and mu_resolution is None:
+        return table, {}
+
+    report = {'spots_before': table.nspots, 'spots_after': 0, 'dropped': 0, 'merged': 0, 'rounded': 0,
+              'mu_before': 0.0, 'mu_after': 0.0, 'residual': 0.0}
+    old_mu = table.weight.astype(np.float64)
+    new_mu = np.zeros_like(old_mu)  # MU per original spot, 0 for removed spots
+    for start, stop in zip(table.bounds[:-1], table.bounds[1:]):
+        if stop == start:
+            continue
+        _, _, stats = enforce_mu_limits(table.xy[start:stop], old_mu[start:stop], mu_min, mu_resolution, policy, mu_max)
+        new_mu[start:stop] = stats['mu']
+        for key in ('dropped', 'merged', 'rounded', 'residual'):
+            report[key] += stats[key]
+
+    keep = new_mu > 0
+    kept = np.concatenate(([0], np.cumsum(keep, dtype=np.int64)))
+    new_table = SpotTable(table.xy[keep], new_mu[keep], table.energy, kept[table.bounds])
+    report['spots_after'] = new_table.nspots
+    report['mu_before'] = float(old_mu.sum())
+    report['mu_after'] = float(new_mu.sum())
+    report['max_spot_mu_change'] = float(np.max(np.abs(new_mu - old_mu), initial=0.0))
+
+    changed = report['dropped'] + report['merged'] + report['rounded'] > 0
+    if fwhms is not None and changed:
+        # evaluate both on the original spot positions with the spot size of each layer, so the dose grids
+        # are identical
+        layer_slices = [slice(start, stop) for start, stop in zip(table.bounds[:-1], table.bounds[1:])]
+        resolution = DOSE_IMPACT_FWHM_FRACTION * float(np.min(fwhms))
+        _, _, dose_before = layered_dose_grid([(table.xy[s], old_mu[s]) for s in layer_slices], fwhms, resolution)
+        _, _, dose_after = layered_dose_grid([(table.xy[s], new_mu[s]) for s in layer_slices], fwhms, resolution)
+        report['max_dose_change_percent'] = float(100.0 * np.max(np.abs(dose_after - dose_before)) / np.max(dose_before))
+
+    # removed or changed spots alter the delivered dose, so they are reported as warnings
+    log = logger.warning if changed else logger.info
+    log(f"MU limits ({policy}): {report['spots_before']} -> {report['spots_after']} spots, "
+        f"{report['dropped']} dropped, {report['merged']} merged, {report['rounded']} rounded, "
+        f"total MU {report['mu_before']:.3f} -> {report['mu_after']:.3f}")
+    if 'max_dose_change_percent' in report:
+        logger.warning(f"MU limits: maximum dose change {report['max_dose_change_percent']:.2f} %")
+    if abs(report['residual']) > RESIDUAL_TOLERANCE:
+        logger.warning(f"MU limits: the layer totals cannot be conserved within the spot MU limits, "
+                       f"{report['residual']:+.3f} MU")
+
+    return new_table, report
+
+
+def _round_largest_remainder(mu: np.ndarray, resolution: float, mu_min: Optional[float] = None,
+                             mu_max: Optional[float] = None) -> np.ndarray:
+    """
+    Round MU to multiples of resolution, keeping the total (rounded to the resolution) constant.
+    Non-zero spots never round below mu_min or above mu_max.
+    """
+    units = mu / resolution
+    base = np.floor(units + 1e-9)
+    active = mu > 0
+    min_units = np.ceil(mu_min / resolution - 1e-9) if mu_min is not None and mu_min > 0 else 1.0
+    max_units = np.floor(mu_max / resolution + 1e-9) if mu_max is not None else np.inf
+    base[active] = np.clip(base[active], min_units, max_units)
+
+    deficit = int(round(units.sum() - base.sum()))
+    remainder = units - base
+    if deficit > 0:
+        # add one unit to the spots which lost the most, without going above the maximum
+        can_raise = active & (base < max_units)
+        idx = np.argsort(-np.where(can_raise, remainder, -np.inf), kind='stable')[:min(deficit, int(can_raise.sum()))]
+        base[idx] += 1
+    elif deficit < 0:
+        # remove one unit from the spots which gained the most, without going below the minimum
+        can_lower = active & (base > min_units)
+        idx = np.argsort(np.where(can_lower, remainder, np.inf), kind='stable')[:min(-deficit, int(can_lower.sum()))]
+        base[idx] -= 1
+
+    return base * resolution
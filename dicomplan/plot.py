@@ -0,0 +1,130 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# matplotlib 'tab20' colours as 8-bit RGB, one discrete colour per 5 % dose step.
+_TAB20 = np.array([
+    [31, 119, 180], [174, 199, 232], [255, 127, 14], [255, 187, 120], [44, 160, 44],
+    [152, 223, 138], [214, 39, 40], [255, 152, 150], [148, 103, 189], [197, 176, 213],
+    [140, 86, 75], [196, 156, 148], [227, 119, 194], [247, 182, 210], [127, 127, 127],
+    [199, 199, 199], [188, 189, 34], [219, 219, 141], [23, 190, 207], [158, 218, 229],
+], dtype=np.uint8)
+
+LUT_SIZE = 256
+
+# Precomputed lookup table: LUT index i covers relative dose [i/255, (i+1)/255) and maps onto
+# the same discrete colour matplotlib would pick for tab20 at that dose level.
+DOSE_LUT = _TAB20[np.minimum((np.arange(LUT_SIZE) * len(_TAB20)) // (LUT_SIZE - 1), len(_TAB20) - 1)]
+
+GRID_MAJOR = 1.0  # cm
+GRID_MINOR = 0.5  # cm
+GRID_MAJOR_COLOR = (0, 0, 0)
+GRID_MINOR_COLOR = (128, 128, 128)
+GRID_DASH = 4  # pixels per dash for minor grid lines
+
+MIN_IMAGE_SIZE = 500  # pixels along the longest side, small grids are upscaled by an integer factor
+COLORBAR_WIDTH = 20  # pixels
+
+
+def render_dose_pillow(fname: str, dose: np.ndarray, extent: tuple[float, float, float, float],
+                       grid: bool = True) -> None:
+    """
+    Render a normalised dose array directly to a PNG file with Pillow.
+
+    dose is indexed [ix, iy] as returned by np.meshgrid(..., indexing='ij'), extent is
+    (xmin, xmax, ymin, ymax) in cm of the outer pixel edges. Dose values are mapped through
+    DOSE_LUT after bilinear upscaling of small grids, optionally overlaid with the 1 cm / 0.5 cm
+    grid, and a colour bar is added on the right.
+    """
+    from PIL import Image
+
+    # image rows run top to bottom, so flip y to get ymax at the top
+    img = np.ascontiguousarray(dose.T[::-1], dtype=np.float32)
+
+    # coarse dose grids are interpolated before the colour lookup, so isodose bands stay smooth
+    scale = max(1, -(-MIN_IMAGE_SIZE // max(img.shape)))
+    if scale > 1:
+        size = (img.shape[1] * scale, img.shape[0] * scale)
+        img = np.asarray(Image.fromarray(img, 'F').resize(size, Image.Resampling.BILINEAR))
+
+    rgb = DOSE_LUT[np.clip(img * (LUT_SIZE - 1), 0, LUT_SIZE - 1).astype(np.uint8)]
+
+    if grid:
+        _paint_grid(rgb, extent)
+
+    rgb = np.concatenate((rgb, _colorbar(rgb.shape[0])), axis=1)
+
+    Image.fromarray(np.ascontiguousarray(rgb), 'RGB').save(fname)
+    logger.debug(f"Dose plot {fname} written with Pillow, {rgb.shape[1]} x {rgb.shape[0]} pixels")
+
+
+def render_dose_matplotlib(fname: str, dose: np.ndarray, extent: tuple[float, float, float, float],
+                           grid: bool = True, title: str = "") -> None:
+    """
+    Render a normalised dose array to an image file with matplotlib, including colour bar,
+    axis labels and grid lines. Slower than render_dose_pillow(), but suitable for publications.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MultipleLocator
+
+    plt.figure(figsize=(6, 5))
+    # use crazy discrete color map to better visualize the dose distribution
+    mycmap = plt.get_cmap('tab20', 20)  # 20 discrete colors for 5% variations in dose
+    plt.imshow(dose.T, extent=extent, origin='lower', cmap=mycmap, vmin=0.0, vmax=1.0)
+    plt.colorbar(label='Relative Dose')
+    plt.title(f'Dose Distribution {title}')
+    plt.xlabel('X (cm)')
+    plt.ylabel('Y (cm)')
+    if grid:
+        # add grid lines: 1 cm major, 0.5 cm minor
+        ax = plt.gca()
+        ax.xaxis.set_major_locator(MultipleLocator(GRID_MAJOR))
+        ax.yaxis.set_major_locator(MultipleLocator(GRID_MAJOR))
+        ax.xaxis.set_minor_locator(MultipleLocator(GRID_MINOR))
+        ax.yaxis.set_minor_locator(MultipleLocator(GRID_MINOR))
+        ax.grid(True, which='major', color='black', linestyle='-', linewidth=0.5)
+        ax.grid(True, which='minor', color='gray', linestyle='--', linewidth=0.25)
+
+    plt.savefig(fname)
+    plt.close()
+
+
+def _grid_pixels(lo: float, hi: float, npix: int, step: float) -> np.ndarray:
+    """
+    Return the pixel indices along one axis where grid lines at multiples of step fall.
+    """
+    values = np.arange(np.ceil(lo / step) * step, hi, step)
+    pix = np.floor((values - lo) / (hi - lo) * npix).astype(int)
+    return pix[(pix >= 0) & (pix < npix)]
+
+
+def _paint_grid(rgb: np.ndarray, extent: tuple[float, float, float, float]) -> None:
+    """
+    Paint dashed minor and solid major grid lines into an RGB image array in place.
+    """
+    xmin, xmax, ymin, ymax = extent
+    nrows, ncols = rgb.shape[:2]
+
+    for step, color, dashed in ((GRID_MINOR, GRID_MINOR_COLOR, True), (GRID_MAJOR, GRID_MAJOR_COLOR, False)):
+        cols = _grid_pixels(xmin, xmax, ncols, step)
+        # rows count downwards from ymax
+        rows = nrows - 1 - _grid_pixels(ymin, ymax, nrows, step)
+        if dashed:
+            on_rows = (np.arange(nrows) // GRID_DASH) % 2 == 0
+            on_cols = (np.arange(ncols) // GRID_DASH) % 2 == 0
+            rgb[np.ix_(on_rows.nonzero()[0], cols)] = color
+            rgb[np.ix_(rows, on_cols.nonzero()[0])] = color
+        else:
+            rgb[:, cols] = color
+            rgb[rows, :] = color
+
+
+def _colorbar(nrows: int) -> np.ndarray:
+    """
+    Return a vertical colour bar strip for DOSE_LUT, relative dose 0 at the bottom and 1 at the top.
+    """
+    idx = np.linspace(LUT_SIZE - 1, 0, nrows).astype(np.uint8)
+    bar = np.full((nrows, COLORBAR_WIDTH, 3), 255, dtype=np.uint8)
+    bar[:, COLORBAR_WIDTH // 4:] = DOSE_LUT[idx][:, None, :]
+    return bar
@@ -0,0 +1,142 @@
+import logging
+
+import numpy as np
+import pydicom
+from pydicom.datadict import tag_for_keyword
+from pydicom.uid import ExplicitVRBigEndian
+
+logger = logging.getLogger(__name__)
+
+
+def float_array(ds: pydicom.Dataset, keyword: str, big_endian: bool = False) -> np.ndarray:
+    """
+    Return the values of a float (FL) element as a float32 array.
+
+    For datasets read from file, the raw element bytes are used directly with np.frombuffer,
+    so large values like ScanSpotPositionMap are never converted to Python floats.
+    Returns an empty array if the element is missing.
+    """
+    tag = tag_for_keyword(keyword)
+    if tag not in ds:
+        return np.empty(0, dtype=np.float32)
+    elem = ds.get_item(tag)
+    if elem.value is None:
+        # deferred element, read it from file now
+        elem = ds[tag]
+    value = elem.value
+    if isinstance(value, (bytes, bytearray)):
+        return np.frombuffer(value, dtype='>f4' if big_endian else '<f4').astype(np.float32)
+    if value is None or value == '':
+        return np.empty(0, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32).ravel()
+
+
+def is_big_endian(ds: pydicom.Dataset) -> bool:
+    """
+    Return True if the dataset was read with the (retired) explicit VR big endian transfer syntax.
+    """
+    file_meta = getattr(ds, 'file_meta', None)
+    return file_meta is not None and file_meta.get('TransferSyntaxUID') == ExplicitVRBigEndian
+
+
+class BeamArrays:
+    """
+    Control point and spot data of one ion beam, as flat arrays.
+
+    Per control point: index, energy [MeV], cumulative meterset weight, declared number of spots,
+    and the start offset of its spots in the spot arrays (cp_start has ncp + 1 entries).
+    Per spot: x, y [mm] and meterset weight, with cp_of_spot mapping each spot to its control point.
+    """
+
+    def __init__(self, beam: pydicom.Dataset, big_endian: bool = False):
+        cps = beam.get('IonControlPointSequence', [])
+        self.beam_number = beam.get('BeamNumber')
+        self.beam_name = beam.get('BeamName', '')
+        self.machine = beam.get('TreatmentMachineName', '')
+        self.final_cumulative_meterset_weight = float(beam.get('FinalCumulativeMetersetWeight', 0.0))
+        self.number_of_control_points = int(beam.get('NumberOfControlPoints', len(cps)))
+        self.gantry_angle = float(cps[0].get('GantryAngle', 0.0)) if len(cps) > 0 else 0.0
+
+        ncp = len(cps)
+        self.cp_index = np.empty(ncp, dtype=np.int64)
+        self.energy = np.empty(ncp, dtype=np.float64)
+        self.cumulative_weight = np.empty(ncp, dtype=np.float64)
+        self.declared_spots = np.empty(ncp, dtype=np.int64)
+        positions = []
+        weights = []
+
+        energy = 0.0
+        for i, cp in enumerate(cps):
+            self.cp_index[i] = int(cp.get('ControlPointIndex', i))
+            # NominalBeamEnergy is only required when it changes
+            energy = float(cp.get('NominalBeamEnergy', energy))
+            self.energy[i] = energy
+            self.cumulative_weight[i] = float(cp.get('CumulativeMetersetWeight', np.nan))
+            self.declared_spots[i] = int(cp.get('NumberOfScanSpotPositions', 0))
+            positions.append(float_array(cp, 'ScanSpotPositionMap', big_endian))
+            weights.append(float_array(cp, 'ScanSpotMetersetWeights', big_endian))
+
+        self.position_counts = np.array([len(p) for p in positions], dtype=np.int64)
+        self.weight_counts = np.array([len(w) for w in weights], dtype=np.int64)
+
+        # spots of control points with inconsistent arrays are truncated to what is pairable
+        nspots = np.minimum(self.position_counts // 2, self.weight_counts)
+        self.cp_start = np.concatenate(([0], np.cumsum(nspots)))
+        xy = [p[:2 * n].reshape(-1, 2) for p, n in zip(positions, nspots)]
+        self.xy = np.concatenate(xy) if xy else np.empty((0, 2), dtype=np.float32)
+        self.weights = np.concatenate([w[:n] for w, n in zip(weights, nspots)]) if weights \
+            else np.empty(0, dtype=np.float32)
+        self.cp_of_spot = np.repeat(np.arange(ncp), nspots)
+
+    @property
+    def nspots(self) -> np.ndarray:
+        """
+        Number of spots per control point.
+        """
+        return np.diff(self.cp_start)
+
+    @property
+    def weight_sums(self) -> np.ndarray:
+        """
+        Sum of the spot meterset weights per control point.
+        """
+        return np.bincount(self.cp_of_spot, weights=self.weights, minlength=len(self.energy))
+
+
+def beam_arrays(ds: pydicom.Dataset) -> list[BeamArrays]:
+    """
+    Return the BeamArrays of all ion beams in a plan.
+    """
+    big_endian = is_big_endian(ds)
+    return [BeamArrays(beam, big_endian) for beam in ds.get('IonBeamSequence', [])]
+
+
+def beam_meterset(ds: pydicom.Dataset, beam_number) -> float:
+    """
+    Return the BeamMeterset of a beam from the first fraction group, or NaN if not referenced.
+    """
+    for fg in ds.get('FractionGroupSequence', [])[:1]:
+        for rb in fg.get('ReferencedBeamSequence', []):
+            if rb.get('ReferencedBeamNumber') == beam_number:
+                return float(rb.get('BeamMeterset', np.nan))
+    return float('nan')
+
+
+def plan_layers(ds: pydicom.Dataset, beam_number=None) -> list[tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Return the (energy, coords [cm], MU) layers of the control points with spot weights of a plan, like the
+    layers of a build, for all beams or only beam_number. Spot MU are the meterset weights scaled by
+    BeamMeterset / FinalCumulativeMetersetWeight, or the weights if the beam has no meterset.
+    """
+    layers = []
+    for beam in beam_arrays(ds):
+        if beam_number is not None and beam.beam_number != beam_number:
+            continue
+        meterset = beam_meterset(ds, beam.beam_number)
+        scale = meterset / beam.final_cumulative_meterset_weight \
+            if np.isfinite(meterset) and beam.final_cumulative_meterset_weight > 0 else 1.0
+        for cp in np.flatnonzero(beam.weight_sums > 0):
+            start, stop = beam.cp_start[cp], beam.cp_start[cp + 1]
+            layers.append((float(beam.energy[cp]), beam.xy[start:stop].ravel() / 10.0,  # mm to cm
+                           beam.weights[start:stop] * np.float32(scale)))
+    return layers
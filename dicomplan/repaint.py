@@ -0,0 +1,119 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+from dicomplan.model import SpotTable
+
+logger = logging.getLogger(__name__)
+
+REPAINT_MODES = ('layered', 'volumetric')
+
+
+def painting_counts(mu: np.ndarray, paintings: int = 1,
+                    mu_min: Optional[float] = None, mu_max: Optional[float] = None) -> np.ndarray:
+    """
+    Return the number of paintings each spot is delivered in.
+
+    Nominally every spot is split into `paintings` equal parts. Spots that would fall below mu_min
+    per painting are delivered in fewer paintings (at least one), and spots that would exceed mu_max
+    per painting get extra paintings, so every painting carries between mu_min and mu_max MU where possible.
+    """
+    if paintings < 1:
+        raise ValueError(f"Number of paintings must be at least 1, got {paintings}")
+
+    mu = np.asarray(mu)
+    counts = np.full(len(mu), paintings, dtype=np.int64)
+    if mu_min is not None and mu_min > 0:
+        counts = np.minimum(counts, np.maximum(1, np.floor(mu / mu_min).astype(np.int64)))
+    if mu_max is not None and mu_max > 0:
+        counts = np.maximum(counts, np.ceil(mu / mu_max).astype(np.int64))
+    return counts
+
+
+def split_paintings(coords: np.ndarray, mu: np.ndarray, counts: np.ndarray) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Split a single layer into paintings, given the number of paintings per spot from painting_counts().
+
+    Spot i is delivered with mu[i] / counts[i] MU in each of the first counts[i] paintings.
+    The original scan order is kept within every painting. Returns a list of (coords, mu) per painting.
+    """
+    nspots = len(mu)
+    if nspots == 0:
+        return []
+
+    # one row per delivered spot: spot index and the painting it belongs to
+    spot_idx = np.repeat(np.arange(nspots), counts)
+    painting = np.arange(len(spot_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    order = np.argsort(painting, kind='stable')
+    spot_idx = spot_idx[order]
+    bounds = np.searchsorted(painting[order], np.arange(int(counts.max()) + 1))
+
+    xy = np.asarray(coords).reshape(-1, 2)
+    mu_per_painting = (mu / counts).astype(mu.dtype, copy=False)
+
+    paintings = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        idx = spot_idx[start:stop]
+        paintings.append((xy[idx].ravel(), mu_per_painting[idx]))
+    return paintings
+
+
+def paint_layers(layers: SpotTable, paintings: int = 1, mode: str = 'layered',
+                 mu_min: Optional[float] = None, mu_max: Optional[float] = None) -> SpotTable:
+    """
+    Apply repainting to the layers of a SpotTable (or a list of (energy, coords, mu) layers) and return
+    the table of the paintings in delivery order, one layer per painting of each energy layer.
+
+    In 'layered' mode each energy layer is repainted before moving on to the next energy,
+    in 'volumetric' mode the full stack of layers is delivered once per painting. Within a painting the
+    scan order of the layer is kept. The total MU per spot is conserved, see painting_counts().
+    """
+    if mode not in REPAINT_MODES:
+        raise ValueError(f"Unknown repainting mode: {mode}")
+
+    table = SpotTable.of(layers)
+    if paintings == 1 and mu_min is None and mu_max is None:
+        return table
+
+    # one row per delivered spot: spot index, its layer and the painting it belongs to
+    counts = painting_counts(table.weight, paintings, mu_min, mu_max)
+    spot_idx = np.repeat(np.arange(table.nspots), counts)
+    painting = np.arange(len(spot_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    layer = table.layer[spot_idx]
+
+    # delivery order, np.lexsort sorts by the last key first
+    keys = (spot_idx, painting, layer) if mode == 'layered' else (spot_idx, layer, painting)
+    order = np.lexsort(keys)
+    spot_idx, painting, layer = spot_idx[order], painting[order], layer[order]
+
+    # every painting of a layer becomes a layer of the new table
+    starts = np.flatnonzero((np.diff(layer) != 0) | (np.diff(painting) != 0)) + 1
+    bounds = np.concatenate(([0], starts, [len(spot_idx)])) if len(spot_idx) else np.zeros(1, dtype=np.int64)
+    mu_per_painting = table.weight / counts.astype(table.weight.dtype)
+    logger.debug(f"{len(table)} layers in {len(bounds) - 1} paintings, {len(spot_idx)} delivered spots")
+    return SpotTable(table.xy[spot_idx], mu_per_painting[spot_idx], table.energy[layer[bounds[:-1]]], bounds)
+
+
+def split_layers(layers: SpotTable, max_spots: Optional[int] = None) -> SpotTable:
+    """
+    Split the layers of a SpotTable (or a list of (energy, coords, mu) layers) with more than max_spots spots
+    into consecutive layers at the same energy, each delivered as its own control point pair. Only the layer
+    bounds change, the returned table shares the spot columns.
+    """
+    table = SpotTable.of(layers)
+    if max_spots is None:
+        return table
+    if max_spots < 1:
+        raise ValueError(f"Maximum number of spots per control point must be at least 1, got {max_spots}")
+
+    # equal parts, so the last control point pair is not left with a few spots
+    counts = np.diff(table.bounds)
+    nparts = np.maximum(1, -(-counts // max_spots))
+    layer = np.repeat(np.arange(len(table)), nparts)
+    part = np.arange(len(layer)) - np.repeat(np.cumsum(nparts) - nparts, nparts)
+    starts = table.bounds[layer] + counts[layer] * part // nparts[layer]
+    if len(layer) > len(table):
+        logger.debug(f"{len(table)} layers split into {len(layer)} control point pairs of at most {max_spots} spots")
+    return SpotTable(table.xy, table.weight, table.energy[layer], np.append(starts, table.nspots))
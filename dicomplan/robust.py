@@ -0,0 +1,220 @@
+import csv
+import json
+import logging
+import shlex
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from dicomplan.config_parser import DEFAULT_SCENARIOS, get_model_from_args, parse_arguments
+from dicomplan.dose import FWHM_TO_SIGMA, METRIC_FIELDS, field_metrics, grid_axes, grid_resolution
+from dicomplan.machine import dose_fwhm
+from dicomplan.spots import generate_layers
+
+logger = logging.getLogger(__name__)
+
+ROBUST_BATCH_ELEMENTS = 1 << 23  # grid points of all scenarios of a batch
+ROBUST_MARGIN_SD = 3.0  # the dose grid is widened by this many standard deviations of the position errors
+ROBUST_PAD_SIGMA = 5.0  # zero padding of the FFT grid, in spot sigma
+MAX_SIZE_SD = 4.0  # spot size errors are limited to this many standard deviations
+SCENARIO_FIELDS = ['scenario', 'shift_x', 'shift_y', 'spot_size_x', 'spot_size_y']
+PERCENTILES = (5, 95)
+
+
+class ScenarioErrors:
+    """
+    Standard deviations of the errors sampled per scenario: a systematic shift of the whole field and a
+    random shift of every spot [cm], a relative spot size error per axis, and a relative MU error per spot.
+    """
+
+    def __init__(self, systematic: float = 0.0, random: float = 0.0, spot_size: float = 0.0, mu: float = 0.0):
+        if min(systematic, random, spot_size, mu) < 0:
+            raise ValueError("Error standard deviations must not be negative")
+        self.systematic = systematic
+        self.random = random
+        self.spot_size = spot_size
+        self.mu = mu
+
+
+def scenario_doses(layers: list[tuple[np.ndarray, np.ndarray]], fwhms: list[list[float]], errors: ScenarioErrors,
+                   scenarios: int, resolution: Optional[float] = None, seed: Optional[int] = None) \
+        -> Iterator[tuple[np.ndarray, np.ndarray, list[dict], np.ndarray]]:
+    """
+    Yield (x, y, scenario rows, doses) for batches of error scenarios of the (coords [cm], weights) layers,
+    with the Gaussian spot model of layered_dose_grid(). doses has shape (batch, nx, ny) on one grid for
+    all scenarios, the first scenario of the first batch is the nominal plan.
+
+    The spots of every scenario are spread bilinearly onto the grid and convolved with the Gaussian kernel
+    by FFT, with the scenarios as an extra leading axis. The kernel spectrum is precomputed per layer from
+    the squared grid frequencies, corrected for the bilinear spreading, and only rescaled for the spot size
+    error of each scenario, so a scenario costs one spreading of its spots and two FFTs of the grid, however
+    many spots overlap. The doses agree with the direct Gaussian sum to about 0.2 % of the maximum dose.
+    A spot size error keeps the spot fluence. The grid is zero padded by ROBUST_PAD_SIGMA sigma against
+    wrap-around.
+    """
+    fwhms = np.asarray(fwhms, dtype=np.float64).reshape(-1, 2)
+    xys = [np.asarray(coords, dtype=np.float32).reshape(-1, 2) for coords, _ in layers]
+    weights = [np.asarray(w, dtype=np.float32) for _, w in layers]
+    resolution = grid_resolution(fwhms.min(axis=0), resolution)
+    x, y = grid_axes(xys, fwhms, resolution, ROBUST_MARGIN_SD * (errors.systematic + errors.random))
+    rng = np.random.default_rng(seed)
+
+    # spot size scales are limited to MAX_SIZE_SD standard deviations, so the padding covers them
+    max_scale = 1.0 + MAX_SIZE_SD * errors.spot_size
+    pad = int(np.ceil(ROBUST_PAD_SIGMA * fwhms.max() * FWHM_TO_SIGMA * max_scale / resolution))
+    shape = (_fft_length(len(x) + pad), _fft_length(len(y) + pad))
+    fx = np.fft.fftfreq(shape[0], resolution)
+    fy = np.fft.rfftfreq(shape[1], resolution)
+    # squared angular frequencies, and the spectrum of the bilinear spreading it is divided by
+    kx2 = (2 * np.pi * fx)**2
+    ky2 = (2 * np.pi * fy)**2
+    spread_x = np.sinc(fx * resolution)**2
+    spread_y = np.sinc(fy * resolution)**2
+
+    batch = max(1, ROBUST_BATCH_ELEMENTS // (shape[0] * shape[1]))
+    logger.debug(f"{scenarios} scenarios on a {len(x)} x {len(y)} grid, FFT {shape[0]} x {shape[1]}, "
+                 f"batches of {batch}")
+    for first in range(0, scenarios, batch):
+        n = min(batch, scenarios - first)
+        shift = rng.normal(0.0, errors.systematic, (n, 2))
+        size = np.clip(rng.normal(1.0, errors.spot_size, (n, 2)), 1.0 / max_scale, max_scale)
+        random = np.ones(n)  # scales the per-spot errors, 0 for the nominal scenario
+        if first == 0:
+            shift[0], size[0], random[0] = 0.0, 1.0, 0.0
+
+        spectrum = np.zeros((n, shape[0], len(fy)), dtype=np.complex64)
+        for xy, w, fwhm in zip(xys, weights, fwhms):
+            px = xy[None, :, 0] + shift[:, None, 0]
+            py = xy[None, :, 1] + shift[:, None, 1]
+            ws = np.broadcast_to(w, px.shape)
+            if errors.random > 0:
+                noise = rng.normal(0.0, errors.random, (2, *px.shape)) * random[:, None]
+                px, py = px + noise[0], py + noise[1]
+            if errors.mu > 0:
+                ws = ws * np.clip(1.0 + rng.normal(0.0, errors.mu, px.shape) * random[:, None], 0.0, None)
+            grid = _spread(px - float(x[0]), py - float(y[0]), ws, resolution, shape)
+
+            # spectrum of the Gaussian spot of amplitude 1 on the grid, with the fluence kept under size errors
+            sx2, sy2 = (fwhm * FWHM_TO_SIGMA)**2
+            gauss_x = np.exp(-0.5 * sx2 * size[:, 0, None]**2 * kx2) / spread_x
+            gauss_y = np.exp(-0.5 * sy2 * size[:, 1, None]**2 * ky2) / spread_y
+            kernel = (2 * np.pi * np.sqrt(sx2 * sy2) / resolution**2) * gauss_x[:, :, None] * gauss_y[:, None, :]
+            spectrum += np.fft.rfft2(grid) * kernel.astype(np.complex64)
+
+        dose = np.fft.irfft2(spectrum, s=shape)[:, :len(x), :len(y)].astype(np.float32)
+        rows = [{'scenario': first + i, 'shift_x': float(shift[i, 0]), 'shift_y': float(shift[i, 1]),
+                 'spot_size_x': float(size[i, 0]), 'spot_size_y': float(size[i, 1])} for i in range(n)]
+        yield x, y, rows, dose
+
+
+def _spread(px: np.ndarray, py: np.ndarray, weights: np.ndarray, resolution: float,
+            shape: tuple[int, int]) -> np.ndarray:
+    """
+    Spread the (scenarios, spots) weights at positions px, py [cm] from the first grid point bilinearly onto
+    the four nearest grid points, returning a (scenarios, *shape) float32 array.
+    """
+    n = px.shape[0]
+    fx = np.clip(px / resolution, 0, shape[0] - 1.001)
+    fy = np.clip(py / resolution, 0, shape[1] - 1.001)
+    ix, iy = np.floor(fx).astype(np.int64), np.floor(fy).astype(np.int64)
+    tx, ty = fx - ix, fy - iy
+    base = (np.arange(n)[:, None] * shape[0] + ix) * shape[1] + iy
+    index = np.concatenate([(base + offset).ravel() for offset in (0, 1, shape[1], shape[1] + 1)])
+    values = np.concatenate([(weights * (1 - tx) * (1 - ty)).ravel(), (weights * (1 - tx) * ty).ravel(),
+                             (weights * tx * (1 - ty)).ravel(), (weights * tx * ty).ravel()])
+    grid = np.bincount(index, weights=values, minlength=n * shape[0] * shape[1])
+    return grid.reshape(n, *shape).astype(np.float32)
+
+
+def _fft_length(n: int) -> int:
+    """
+    Return the smallest integer >= n with prime factors 2, 3 and 5 only, which FFTs handle fastest.
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def robust_analysis(layers: list[tuple[np.ndarray, np.ndarray]], fwhms: list[list[float]], errors: ScenarioErrors,
+                    scenarios: int = DEFAULT_SCENARIOS, resolution: Optional[float] = None,
+                    seed: Optional[int] = None) -> list[dict]:
+    """
+    Return one row per scenario, the nominal plan first, with the scenario errors and the field metrics
+    (field size, flatness, uniformity, see field_metrics()) of its dose.
+    """
+    rows = []
+    for x, y, batch_rows, doses in scenario_doses(layers, fwhms, errors, scenarios, resolution, seed):
+        for row, dose in zip(batch_rows, doses):
+            row.update(field_metrics(x, y, dose))
+            rows.append(row)
+    return rows
+
+
+def metric_spread(rows: list[dict]) -> dict[str, dict]:
+    """
+    Return the nominal value, mean, standard deviation, minimum, maximum and PERCENTILES of every metric
+    over the scenarios.
+    """
+    spread = {}
+    for name in METRIC_FIELDS:
+        values = np.array([row[name] for row in rows])
+        spread[name] = {'nominal': float(values[0]), 'mean': float(values.mean()), 'std': float(values.std()),
+                        'min': float(values.min()), 'max': float(values.max()),
+                        **{f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES}}
+    return spread
+
+
+def format_spread(spread: dict[str, dict]) -> str:
+    """
+    Format the metric spread as a text table.
+    """
+    columns = list(next(iter(spread.values())))
+    lines = [f"{'metric':<14}" + ''.join(f"{c:>10}" for c in columns)]
+    for name, values in spread.items():
+        lines.append(f"{name:<14}" + ''.join(f"{values[c]:>10.3f}" for c in columns))
+    return '\n'.join(lines)
+
+
+def write_scenarios(path: str, rows: list[dict], spread: dict[str, dict]):
+    """
+    Write the scenario rows as CSV, or the rows and the metric spread as JSON, by suffix.
+    """
+    if Path(path).suffix.lower() == '.json':
+        with open(path, 'w') as f:
+            json.dump({'spread': spread, 'scenarios': rows}, f, indent=1)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SCENARIO_FIELDS + METRIC_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    logger.info(f"Robustness scenarios written to {path}")
+
+
+def robust_from_args(args) -> Optional[int]:
+    """
+    Run the robust subcommand: the plan is given as a dicomplan command line like the sweep base.
+    """
+    base_args = parse_arguments(shlex.split(args.base))
+    if base_args.pattern_type not in ('square', 'circle', 'image', 'compose', 'custom'):
+        logger.error(f"The robustness base must build a plan, got '{base_args.pattern_type}'")
+        return 1
+    model = get_model_from_args(base_args)
+    model.plot_dose = False
+
+    layers = generate_layers(model)
+    errors = ScenarioErrors(args.systematic, args.random, args.spot_size / 100.0, args.mu / 100.0)
+    rows = robust_analysis([(coords, weights) for _, coords, weights in layers],
+                           [dose_fwhm(model, energy) for energy, _, _ in layers], errors, args.scenarios,
+                           args.resolution, args.seed)
+    spread = metric_spread(rows)
+    print(f"{len(rows)} scenarios of {sum(len(w) for _, _, w in layers)} spots in {len(layers)} layers")
+    print(format_spread(spread))
+    if args.output is not None:
+        write_scenarios(args.output, rows, spread)
+    return None
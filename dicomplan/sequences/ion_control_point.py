@@ -1,10 +1,15 @@
 import pydicom
 
 
-def ion_control_points() -> pydicom.Sequence:
+def ion_control_points(ncontrol_points: int = 2) -> pydicom.Sequence:
     """
     Create an IonControlPointSequence with at least two items.
+    Control points come in pairs per energy layer (or painting): the even one carries the spot weights,
+    the odd one is a zero-weight terminator.
     """
+    if ncontrol_points < 2 or ncontrol_points % 2 != 0:
+        raise ValueError(f"Number of control points must be an even number >= 2, got {ncontrol_points}")
+
     icps = pydicom.Sequence()
 
     # first dataset is more verbose, than the rest.
@@ -59,6 +64,9 @@ def ion_control_points() -> pydicom.Sequence:
     new_cummulative_meterset_weight = icp.CumulativeMetersetWeight + cm
     icps.append(_ion_control_point_next(1, empty=True, cm=new_cummulative_meterset_weight))
 
+    for idx in range(2, ncontrol_points):
+        icps.append(_ion_control_point_next(idx, empty=(idx % 2 == 1), cm=new_cummulative_meterset_weight))
+
     return icps
 
 
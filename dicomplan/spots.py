@@ -1,10 +1,23 @@
+import copy
+import functools
 import logging
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
 import numpy as np
 from dicomplan.model import PlanInputModel
-import matplotlib.pyplot as plt
+from dicomplan.compose import compose_spots, parse_shape_expression
+from dicomplan.halftone import halftone
+from dicomplan.dose import FWHM_TO_SIGMA, grid_resolution, layered_dose_grid
+from dicomplan.machine import dose_fwhm, machine_for_model
+from dicomplan.plot import render_dose_pillow, render_dose_matplotlib
 
 logger = logging.getLogger(__name__)
 
+PATTERN_BLOCK = 1 << 16  # candidate grid points generated per block of a streamed pattern
+SPACING_QUANTUM = 0.01  # cm, energy dependent spacings are rounded to this, so similar layers share a lattice
+
 
 def generate_spot_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
     """
@@ -16,29 +29,175 @@ def generate_spot_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray
      ...
      xn, y0, ..., xn, yn] format.
     The pattern is determined by the spot_shape and spot_pattern_type attributes of the model.
-    The spot_shape can be 'square', 'circular', or 'image'.
+    The spot_shape can be 'square', 'circular', 'image' or 'compose'.
     The spot_pattern_type can be 'square' or 'hexagonal'.
     The spot_spacing attribute determines the distance between spots in the pattern.
     The spot_xymin and spot_xymax attributes determine the bounding box of the pattern.
     The spot_diameter attribute determines the diameter of the circular pattern.
     """
-    logger.debug("Generating circular pattern with model")
-    if model.spot_shape == 'square':
-        coords, weights = generate_square_pattern(model)
-    elif model.spot_shape == 'circle':
-        coords, weights = generate_circular_pattern(model)
-    elif model.spot_shape == 'image':
-        coords, weights = generate_image_pattern(model)
-    else:
-        raise ValueError(f"Unknown spot shape: {model.spot_shape}")
+    coords, weights = _pattern(model)
 
     if model.plot_dose:
-        logger.info(f"Generating dose plot {model.plot_dose_filepath} with FWHM {model.plot_dose_fwhm} cm")
-        _dose_plot(model.plot_dose_filepath, model, coords, weights, model.plot_dose_fwhm)
+        fwhm = dose_fwhm(model, model.spot_energy)
+        logger.info(f"Generating dose plot {model.plot_dose_filepath} with FWHM {fwhm} cm")
+        _dose_plot(model.plot_dose_filepath, model, [(coords, weights)], [fwhm])
 
     return coords, weights
 
 
+def generate_layers(model: PlanInputModel) -> list[tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Generate the spot pattern of every energy layer as a list of (energy, coords, weights).
+
+    With model.spot_spacing_sigma set, the spacing of each layer is that fraction of the spot sigma
+    of the machine beam model at the layer energy, rounded to SPACING_QUANTUM, so every layer gets
+    its own lattice. Lattices are generated once per distinct spacing and shared between layers.
+    Otherwise all layers use model.spot_spacing.
+    """
+    energies = model.spot_energies if model.spot_energies else [model.spot_energy]
+    if model.spot_shape == 'custom':
+        layers = generate_custom_layers(model)
+    elif model.spot_shape == 'image' and model.spot_image_path is not None and \
+            (model.spot_energy_range is not None or image_frame_count(model.spot_image_path) > 1):
+        # one layer per frame; the spot maps are collected, the decoded frames are not
+        layers = list(generate_image_layers(model))
+        logger.info(f"{len(layers)} image frame layers, {sum(len(w) for _, _, w in layers)} spots")
+    elif len(energies) == 1 and model.spot_spacing_sigma is None:
+        return [(energies[0], *generate_spot_pattern(model))]
+    else:
+        lattices: dict[float, tuple[np.ndarray, np.ndarray]] = {}
+        layers = []
+        for energy in energies:
+            spacing = layer_spacing(model, energy)
+            if spacing not in lattices:
+                lattices[spacing] = _pattern(_with_spacing(model, spacing))
+                logger.debug(f"Lattice with {spacing} cm spacing: {len(lattices[spacing][1])} spots")
+            coords, weights = lattices[spacing]
+            # weights are scaled per layer later on, the coordinates are shared read-only
+            layers.append((energy, coords, weights.copy()))
+        logger.info(f"{len(layers)} layers on {len(lattices)} lattices, {sum(len(w) for _, _, w in layers)} spots")
+
+    if model.plot_dose:
+        fwhms = [dose_fwhm(model, energy) for energy, _, _ in layers]
+        logger.info(f"Generating dose plot {model.plot_dose_filepath} of {len(layers)} layers")
+        _dose_plot(model.plot_dose_filepath, model, [(c, w) for _, c, w in layers], fwhms)
+
+    return layers
+
+
+def load_custom_spots(path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Load a precomputed spot map and return the x, y [cm], weight and energy [MeV] columns;
+    energy is None if the map has none.
+
+    .npy files are memory mapped and may hold an (N, 3) or (N, 4) array, or a structured array with
+    fields x, y, weight (or mu) and optionally energy; the returned columns are views into the map.
+    .csv files have the columns x, y, weight[, energy] with an optional header line naming them.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.npy':
+        spots = np.load(path, mmap_mode='r')
+    elif suffix == '.csv':
+        with open(path) as f:
+            first = f.readline()
+        names = [name.strip().lower() for name in first.split(',')]
+        has_header = not _is_number(names[0])
+        spots = np.loadtxt(path, delimiter=',', skiprows=1 if has_header else 0, ndmin=2, dtype=np.float64)
+        if has_header:
+            spots = np.rec.fromarrays(spots.T, names=names)
+    else:
+        raise ValueError(f"Unknown spot map format '{suffix}', use .npy or .csv")
+
+    if spots.dtype.names is not None:
+        weight = 'weight' if 'weight' in spots.dtype.names else 'mu'
+        missing = {'x', 'y', weight} - set(spots.dtype.names)
+        if missing:
+            raise ValueError(f"Spot map {path} has no {', '.join(sorted(missing))} column")
+        energy = spots['energy'] if 'energy' in spots.dtype.names else None
+        return spots['x'], spots['y'], spots[weight], energy
+
+    if spots.ndim != 2 or spots.shape[1] not in (3, 4):
+        raise ValueError(f"Spot map {path} must have 3 or 4 columns (x, y, weight[, energy]), got shape {spots.shape}")
+    return spots[:, 0], spots[:, 1], spots[:, 2], spots[:, 3] if spots.shape[1] == 4 else None
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def generate_custom_layers(model: PlanInputModel) -> list[tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Return the (energy, coords, weights) layers of a precomputed spot map. Spots are grouped into layers
+    by their energy column, in descending energy order, or the full map is used at each model energy.
+    The model offset (spot_center) and rim boost are applied per layer.
+    """
+    if model.spot_custom_path is None:
+        raise ValueError("spot_custom_path must be defined for custom pattern")
+
+    x, y, weight, energy = load_custom_spots(model.spot_custom_path)
+    if len(x) == 0:
+        raise ValueError(f"Spot map {model.spot_custom_path} is empty")
+
+    # (N, 2) positions in one pass over the (mapped) columns, the layers hold flat views of them
+    xy = np.column_stack((x, y)).astype(np.float64, copy=False)
+    xy += model.spot_center
+    coords = xy.reshape(-1)
+    weights = np.asarray(weight, dtype=np.float32)
+
+    if energy is None:
+        energies = model.spot_energies if model.spot_energies else [model.spot_energy]
+        layers = [(float(e), coords, weights.copy()) for e in energies]
+    else:
+        energies, inverse = np.unique(np.asarray(energy), return_inverse=True)
+        order = np.argsort(-inverse, kind='stable')  # highest energy first, map order within a layer
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(inverse)[::-1])))
+        layers = [(float(e), xy[order[start:stop]].ravel(), weights[order[start:stop]])
+                  for e, start, stop in zip(energies[::-1], bounds[:-1], bounds[1:])]
+    logger.info(f"Custom spot map {model.spot_custom_path}: {len(x)} spots in {len(layers)} layers")
+
+    if model.boost_rim > 1.0:
+        layers = [(e, c, _boost_rim_spots(c, w, model)) for e, c, w in layers]
+    return layers
+
+
+def layer_spacing(model: PlanInputModel, energy: float) -> float:
+    """
+    Return the spot spacing [cm] of a layer: model.spot_spacing_sigma times the beam model spot sigma
+    (mean of x and y) at the energy, rounded to SPACING_QUANTUM, or model.spot_spacing if not set.
+    """
+    if model.spot_spacing_sigma is None:
+        return model.spot_spacing
+    sigma = float(np.mean(machine_for_model(model).spot_fwhm(energy))) * FWHM_TO_SIGMA / 10.0  # mm to cm
+    spacing = round(round(model.spot_spacing_sigma * sigma / SPACING_QUANTUM) * SPACING_QUANTUM, 6)
+    return max(spacing, SPACING_QUANTUM)
+
+
+def _with_spacing(model: PlanInputModel, spacing: float) -> PlanInputModel:
+    layer_model = copy.copy(model)
+    layer_model.spot_spacing = spacing
+    return layer_model
+
+
+def _pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generate the spot pattern of model.spot_shape.
+    """
+    logger.debug(f"Generating {model.spot_shape} pattern with model")
+    if model.spot_shape == 'square':
+        return generate_square_pattern(model)
+    elif model.spot_shape == 'circle':
+        return generate_circular_pattern(model)
+    elif model.spot_shape == 'image':
+        return generate_image_pattern(model)
+    elif model.spot_shape == 'compose':
+        return generate_composed_pattern(model)
+    raise ValueError(f"Unknown spot shape: {model.spot_shape}")
+
+
 def generate_square_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
     """
     Generate a square spot pattern in
@@ -47,7 +206,54 @@ def generate_square_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarr
      ...
      xn, y0, ..., xn, yn] format.
     """
+    return _collect_blocks(pattern_blocks(model))
+
 
+def generate_circular_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generate a circular spot pattern on a Cartesian mesh, with uniform spacing.
+    Only spots inside the circle defined by model.spot_diameter and model.spot_center are kept.
+    """
+    return _collect_blocks(pattern_blocks(model))
+
+
+def pattern_blocks(model: PlanInputModel) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield the spots of a square or circle pattern as (xy, weights) blocks in delivery order, xy as (n, 2)
+    positions [cm]. Each block covers a band of at most PATTERN_BLOCK candidate grid points, which are
+    trimmed (corners, outside the circle) before the next band is generated, so the candidate grid is never
+    held in memory as a whole. With a rim boost, the blocks are generated twice: the first pass collects
+    the y extent of every x column, the second boosts the rim spots block by block with the same test as
+    rim_mask().
+
+    Only the generation is streamed: generate_square_pattern() and generate_circular_pattern() collect the
+    blocks into the layer arrays, and the later stages (repainting, MU limits, control points) work on whole
+    layers, so memory grows with the number of spots rather than with the candidate grid.
+    """
+    if model.spot_shape == 'square':
+        def blocks():
+            return _square_blocks(model)
+    elif model.spot_shape == 'circle':
+        def blocks():
+            return _circle_blocks(model)
+    else:
+        raise ValueError(f"No streamed pattern for spot shape: {model.spot_shape}")
+
+    if model.boost_rim <= 1.0:
+        yield from blocks()
+        return
+
+    logger.info("Boosting rim spots by factor %s", model.boost_rim)
+    columns = _rim_columns(*_column_extents(blocks()))
+    for xy, weights in blocks():
+        weights[_rim_spots(xy, columns)] *= model.boost_rim
+        yield xy, weights
+
+
+def _square_blocks(model: PlanInputModel) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield the square pattern in blocks of x columns, or of rows for the hexagonal grid.
+    """
     logger.debug("Generating square pattern with spot spacing %s cm", model.spot_spacing)
 
     if model.spot_xymin is None or model.spot_xymax is None:
@@ -73,60 +279,62 @@ def generate_square_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarr
         n_cols = int((xymax[0] - xymin[0]) / 2 / spacing) + 1
 
         eps = spacing * 1e-6  # float tolerance for boundary inclusion
-        all_x = []
-        all_y = []
-        for k in row_indices:
-            yi = center_y + k * row_spacing
-            if yi < xymin[1] - eps or yi > xymax[1] + eps:  # clip rows outside y bounds
-                continue
-            if k % 2 == 0:
-                row_x = center_x + np.arange(-n_cols, n_cols + 1) * spacing
-            else:
-                row_x = center_x + (np.arange(-n_cols, n_cols + 1) + 0.5) * spacing
-            # clip to x bounding box
-            row_x = row_x[(row_x >= xymin[0] - eps) & (row_x <= xymax[0] + eps)]
-            all_x.append(row_x)
-            all_y.append(np.full_like(row_x, yi))
-
-        x_coords = np.concatenate(all_x)
-        y_coords = np.concatenate(all_y)
-        coords = np.column_stack((x_coords, y_coords)).ravel()
+        row_y = center_y + row_indices * row_spacing
+        # clip rows outside y bounds
+        keep = (row_y >= xymin[1] - eps) & (row_y <= xymax[1] + eps)
+        row_indices, row_y = row_indices[keep], row_y[keep]
+
+        # the two row types, clipped to the x bounding box
+        row_xs = []
+        for shift in (0.0, 0.5):
+            row_x = center_x + (np.arange(-n_cols, n_cols + 1) + shift) * spacing
+            row_xs.append(row_x[(row_x >= xymin[0] - eps) & (row_x <= xymax[0] + eps)])
+
+        band = max(1, PATTERN_BLOCK // (2 * n_cols + 1))
+        for start in range(0, len(row_y), band):
+            rows = []
+            for k, yi in zip(row_indices[start:start + band], row_y[start:start + band]):
+                row_x = row_xs[k % 2]
+                rows.append(np.column_stack((row_x, np.full_like(row_x, yi))))
+            yield _trim_corners(np.concatenate(rows), model)
+        return
+
+    # Calculate the number of spots in each direction
+    num_spots_x = int((xymax[0] - xymin[0]) / spacing)
+    num_spots_y = int((xymax[1] - xymin[1]) / spacing)
+
+    logger.debug("Number of spots in x direction: %d", num_spots_x)
+    logger.debug("Number of spots in y direction: %d", num_spots_y)
+
+    # Create a grid of spots
+    if spacing > 0:
+        # Use arange to ensure we cover the entire range with the specified spacing
+        # This ensures that the last spot is included if it fits within the bounds
+        x_coords = np.arange(xymin[0],
+                             xymax[0] + spacing * 0.5,
+                             spacing)
+        y_coords = np.arange(xymin[1],
+                             xymax[1] + spacing * 0.5,
+                             spacing)
     else:
+        # alternatively,
+        # if now spot spacing was given, we can use linspace to ensure we cover the entire range
+        # but then the spot spacing is changed so the corners always align with the requested rectangle
+        x_coords = np.linspace(xymin[0], xymax[0], num_spots_x)
+        y_coords = np.linspace(xymin[1], xymax[1], num_spots_y)
+
+    band = max(1, PATTERN_BLOCK // max(1, len(y_coords)))
+    for start in range(0, len(x_coords), band):
+        yield _trim_corners(_grid_block(x_coords[start:start + band], y_coords), model)
 
-        # Calculate the number of spots in each direction
-        num_spots_x = int((xymax[0] - xymin[0]) / spacing)
-        num_spots_y = int((xymax[1] - xymin[1]) / spacing)
-
-        logger.debug("Number of spots in x direction: %d", num_spots_x)
-        logger.debug("Number of spots in y direction: %d", num_spots_y)
-
-        # Create a grid of spots
-        if spacing > 0:
-            # Use arange to ensure we cover the entire range with the specified spacing
-            # This ensures that the last spot is included if it fits within the bounds
-            x_coords = np.arange(xymin[0],
-                                 xymax[0] + spacing * 0.5,
-                                 spacing)
-            y_coords = np.arange(xymin[1],
-                                 xymax[1] + spacing * 0.5,
-                                 spacing)
-        else:
-            # alternatively,
-            # if now spot spacing was given, we can use linspace to ensure we cover the entire range
-            # but then the spot spacing is changed so the corners always align with the requested rectangle
-            x_coords = np.linspace(xymin[0], xymax[0], num_spots_x)
-            y_coords = np.linspace(xymin[1], xymax[1], num_spots_y)
-
-        coords = _flat_grid(x_coords, y_coords)
-    assert len(coords) % 2 == 0, "Coordinate list must contain pairs (x, y)"
-    nspots = len(coords) // 2
-    weights = np.ones(nspots, dtype=np.float32)
-
-    # If trim_corners is True, we need to remove the spots that are in the corners of the square
+
+def _trim_corners(xy: np.ndarray, model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the (xy, weights) block of a square pattern without its corner spots if model.trim_corners is set.
+    """
     if model.trim_corners:
-        logger.debug("Trimming corners of square pattern")
-        cx: np.ndarray = coords[0::2]
-        cy: np.ndarray = coords[1::2]
+        xymin, xymax, spacing = model.spot_xymin, model.spot_xymax, model.spot_spacing
+        cx, cy = xy[:, 0], xy[:, 1]
         mask = ~((cx < xymin[0] + spacing) &
                  (cy < xymin[1] + spacing) |
                  (cx > xymax[0] - spacing) &
@@ -135,22 +343,14 @@ def generate_square_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarr
                  (cy > xymax[1] - spacing) |
                  (cx > xymax[0] - spacing) &
                  (cy > xymax[1] - spacing))
-        coords = np.column_stack((cx, cy)).ravel()[mask.repeat(2)]
-        weights = weights[mask]
+        xy = xy[mask]
+    return xy, np.ones(len(xy), dtype=np.float32)
 
-    if model.boost_rim > 1.0:
-        logger.debug("Boosting rim spots by factor %s", model.boost_rim)
-        weights = _boost_rim_spots(coords, weights, model)
 
-    return coords, weights
-
-
-def generate_circular_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
+def _circle_blocks(model: PlanInputModel) -> Iterator[tuple[np.ndarray, np.ndarray]]:
     """
-    Generate a circular spot pattern on a Cartesian mesh, with uniform spacing.
-    Only spots inside the circle defined by model.spot_diameter and model.spot_center are kept.
+    Yield the circular pattern in blocks of x columns, keeping the spots inside the circle.
     """
-
     if model.spot_diameter is None:
         raise ValueError("spot_diameter must be defined for circular pattern")
     if model.spot_center is None:
@@ -162,55 +362,132 @@ def generate_circular_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.nda
     spacing = model.spot_spacing
     cx, cy = model.spot_center
 
-    # Define bounding box limits
-    xmin = cx - radius
-    xmax = cx + radius
-    ymin = cy - radius
-    ymax = cy + radius
+    # Grid over the bounding box
+    x = np.arange(cx - radius, cx + radius + spacing, spacing)
+    y = np.arange(cy - radius, cy + radius + spacing, spacing)
 
-    # Generate grid
-    x = np.arange(xmin, xmax + spacing, spacing)
-    y = np.arange(ymin, ymax + spacing, spacing)
-    X, Y = np.meshgrid(x, y, indexing='ij')
+    band = max(1, PATTERN_BLOCK // len(y))
+    for start in range(0, len(x), band):
+        xy = _grid_block(x[start:start + band], y)
+        inside = (xy[:, 0] - cx)**2 + (xy[:, 1] - cy)**2 <= radius**2
+        xy = xy[inside]
+        yield xy, np.ones(len(xy), dtype=np.float32)
 
-    # Flatten and mask
-    dx = X - cx
-    dy = Y - cy
-    inside = dx**2 + dy**2 <= radius**2
 
-    X_flat = X[inside]
-    Y_flat = Y[inside]
-
-    coords = np.column_stack((X_flat, Y_flat)).ravel()
-    assert len(coords) % 2 == 0, "Coordinate list must contain pairs (x, y)"
-    nspots = len(coords) // 2
-    weights = np.ones(nspots, dtype=np.float32)
+def _grid_block(x_coords: np.ndarray, y_coords: np.ndarray) -> np.ndarray:
+    """
+    Return the (n, 2) grid points of the x and y coordinates, y varying fastest.
+    """
+    xy = np.empty((len(x_coords), len(y_coords), 2))
+    xy[:, :, 0] = x_coords[:, None]
+    xy[:, :, 1] = y_coords[None, :]
+    return xy.reshape(-1, 2)
 
-    if model.boost_rim > 1.0:
-        logger.debug("Boosting rim spots by factor %s", model.boost_rim)
-        weights = _boost_rim_spots(coords, weights, model)
 
-    return coords, weights
+def _column_extents(blocks: Iterator[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the sorted distinct x positions of the spots of the (xy, weights) blocks and the lowest and
+    highest y at each, see _rim_columns().
+    """
+    columns, lowest, highest = np.empty(0), np.empty(0), np.empty(0)
+    for xy, _ in blocks:
+        # merge the columns of the block into those found so far
+        columns, index = np.unique(np.concatenate((columns, xy[:, 0])), return_inverse=True)
+        block_lowest, block_highest = np.full(len(columns), np.inf), np.full(len(columns), -np.inf)
+        np.minimum.at(block_lowest, index, np.concatenate((lowest, xy[:, 1])))
+        np.maximum.at(block_highest, index, np.concatenate((highest, xy[:, 1])))
+        lowest, highest = block_lowest, block_highest
+    return columns, lowest, highest
+
+
+def _collect_blocks(blocks: Iterator[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the flat coords and the weights of the spot blocks.
+    """
+    xys, weights = [], []
+    for xy, w in blocks:
+        xys.append(xy)
+        weights.append(w)
+    if not xys:
+        return np.empty(0), np.empty(0, dtype=np.float32)
+    return np.concatenate(xys).ravel(), np.concatenate(weights)
 
 
 def generate_image_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
     """
     Generate a spot pattern based on an image.
     """
+    if model.spot_image_path is None:
+        raise ValueError("spot_image_path must be defined for image pattern")
+
+    # Load image, convert to grayscale
+    return _image_spots(_load_grayscale_image(model.spot_image_path), model)
+
+
+def image_frame_count(path: str) -> int:
+    """
+    Return the number of frames of an image, more than one for animated GIFs and multi-page TIFFs.
+    Only the image header is read.
+    """
     from PIL import Image
 
+    with Image.open(path) as image:
+        return getattr(image, 'n_frames', 1)
+
+
+def image_frames(path: str) -> Iterator:
+    """
+    Yield the frames of a multi-frame image as 8-bit grayscale images, decoding one frame at a time.
+    """
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield frame.convert("L")
+
+
+def frame_energies(model: PlanInputModel, nframes: int) -> list[float]:
+    """
+    Return the energy [MeV] of every frame of a multi-frame image: model.spot_energy_range spread evenly
+    over the frames, or one of model.spot_energies per frame.
+    """
+    if model.spot_energy_range is not None:
+        first, last = model.spot_energy_range
+        return np.linspace(first, last, nframes).round(6).tolist()
+    energies = model.spot_energies if model.spot_energies else [model.spot_energy]
+    if len(energies) != nframes:
+        raise ValueError(f"Image {model.spot_image_path} has {nframes} frames, give one energy per frame "
+                         f"or an energy range, got {len(energies)} energies")
+    return list(energies)
+
+
+def generate_image_layers(model: PlanInputModel) -> Iterator[tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Yield the (energy, coords, weights) layer of every frame of a multi-frame image, see frame_energies().
+    Frames are decoded lazily, only the spot map of a frame is kept once it is converted.
+    """
     if model.spot_image_path is None:
         raise ValueError("spot_image_path must be defined for image pattern")
+
+    energies = frame_energies(model, image_frame_count(model.spot_image_path))
+    for energy, frame in zip(energies, image_frames(model.spot_image_path)):
+        coords, weights = _image_spots(frame, _with_spacing(model, layer_spacing(model, energy)))
+        logger.debug(f"Image frame at {energy} MeV: {len(weights)} spots")
+        yield energy, coords, weights
+
+
+def _image_spots(image, model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the spot pattern of a grayscale image scaled to the model field, darker pixels get higher weights.
+    """
+    from PIL import Image
+
     if model.spot_xymin is None or model.spot_xymax is None:
         raise ValueError("spot_xymin and spot_xymax must be defined for image pattern")
     if model.spot_spacing is None:
         raise ValueError("spot_spacing must be defined for image pattern")
 
-    # Load image, convert to grayscale
-    image = Image.open(model.spot_image_path).convert("L")  # "L" = 8-bit grayscale
-    img_arr = np.array(image)
-
-    orig_height, orig_width = img_arr.shape
+    orig_width, orig_height = image.size
     logger.debug(f"Image shape: {orig_height} x {orig_width}")
 
     # Determine canvas size in cm
@@ -229,6 +506,15 @@ def generate_image_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarra
     image_resized = image.resize((target_width_px, target_height_px), Image.Resampling.BILINEAR)
     img_arr = np.array(image_resized)[::-1, :]
 
+    if model.spot_halftone is not None:
+        # constant weight, grey level as spot density; dithered in raster order, darker is denser
+        mask = halftone(1.0 - np.array(image_resized, dtype=np.float64) / 255.0, model.spot_halftone)[::-1, :]
+        y_coords, x_coords = np.where(mask)
+        coords = np.column_stack((x_coords * model.spot_spacing + model.spot_xymin[0],
+                                  y_coords * model.spot_spacing + model.spot_xymin[1])).ravel()
+        logger.debug(f"{model.spot_halftone} halftone: {len(x_coords)} of {mask.size} pixels")
+        return coords, np.ones(len(x_coords), dtype=np.float32)
+
     # Only keep non-zero pixels
     mask = img_arr > 0
     y_coords, x_coords = np.where(mask)
@@ -259,92 +545,117 @@ def generate_image_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarra
     return coords, weights
 
 
-def _flat_grid(x_coords: np.ndarray, y_coords: np.ndarray) -> np.ndarray:
+def generate_composed_pattern(model: PlanInputModel) -> tuple[np.ndarray, np.ndarray]:
     """
-    Flatten the grid of coordinates into a single array.
-    The coordinates are returned in the format:
-    [x0, y0, x0, y1, ..., x0, yn,
-     x1, y0, ..., x1, yn,
-     ...
-     xn, y0, ..., xn, yn]
+    Generate the spot pattern of the shape expression model.spot_expression, see compose.py, on a lattice
+    of model.spot_spacing anchored at the origin and shifted by model.spot_center.
     """
-    # Flatten the coordinates
-    X, Y = np.meshgrid(x_coords, y_coords, indexing='ij')
-    return np.column_stack((X.ravel(), Y.ravel())).ravel()
+    if model.spot_expression is None:
+        raise ValueError("spot_expression must be defined for composed pattern")
+
+    shape = parse_shape_expression(model.spot_expression, model.spot_spacing,
+                                   model.spot_pattern_type == 'hexagonal')
+    xy = compose_spots(shape, model.spot_min_distance)
+    if len(xy) == 0:
+        raise ValueError(f"Shape expression '{model.spot_expression}' has no spots")
+    logger.debug(f"Shape expression '{model.spot_expression}': {len(xy)} spots")
+
+    coords = (xy + np.asarray(model.spot_center)).ravel()
+    weights = np.ones(len(xy), dtype=np.float32)
+    if model.boost_rim > 1.0:
+        weights = _boost_rim_spots(coords, weights, model)
+    return coords, weights
+
+
+def _load_grayscale_image(path: str):
+    """
+    Return an image as 8-bit grayscale. Decoded images are cached by path, modification time and size,
+    so long-running processes (watch) only decode an image again when the file changed.
+    """
+    st = os.stat(path)
+    return _decode_grayscale_image(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _decode_grayscale_image(path: str, mtime_ns: int, size: int):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.convert("L")  # "L" = 8-bit grayscale
 
 
 def _boost_rim_spots(coords: np.ndarray, weights: np.ndarray, model: PlanInputModel) -> np.ndarray:
     """
-    Boost the weights of rim spots by multiplying them by the given factor.
-    Rim spots are the outermost spots of the pattern: the leftmost and rightmost x-columns,
-    and the top/bottom spot of every x-column.
+    Boost the weights of rim spots, see rim_mask(), by multiplying them by the given factor.
     """
 
     logger.info("Boosting rim spots by factor %s", model.boost_rim)
-
-    x_coords = coords[0::2]
-    y_coords = coords[1::2]
-    atol = (np.max(x_coords) - np.min(x_coords)) * 1e-6
-
-    unique_x = np.unique(x_coords)
-    x_min, x_max = unique_x[0], unique_x[-1]
-
-    rim_mask = np.zeros(len(weights), dtype=bool)
-
-    for x in unique_x:
-        col_mask = np.abs(x_coords - x) < atol
-        y_at_x = y_coords[col_mask]
-        if len(y_at_x) == 0:
-            continue
-        # outermost x-columns: all spots are rim spots
-        if np.abs(x - x_min) < atol or np.abs(x - x_max) < atol:
-            rim_mask |= col_mask
-        else:
-            # interior columns: only top and bottom spots
-            y_min, y_max = np.min(y_at_x), np.max(y_at_x)
-            rim_mask |= col_mask & ((np.abs(y_coords - y_min) < atol) | (np.abs(y_coords - y_max) < atol))
-
-    weights[rim_mask] *= model.boost_rim
+    weights[rim_mask(coords)] *= model.boost_rim
     return weights
 
 
-def _dose_plot(fname: str, model: PlanInputModel, coords: np.ndarray, weights: np.ndarray, fwhm: list[float]) -> None:
+def rim_mask(coords: np.ndarray) -> np.ndarray:
+    """
+    Return a boolean mask of the rim spots of a pattern, given as flat [x0, y0, x1, y1, ...] coords or
+    (N, 2) positions. Rim spots are the outermost spots of the pattern: the leftmost and rightmost x-columns,
+    and the top/bottom spot of every x-column. Spots closer than 1e-6 of the x extent are in one column.
+    """
+    xy = np.asarray(coords).reshape(-1, 2)
+    if len(xy) == 0:
+        return np.zeros(0, dtype=bool)
+    return _rim_spots(xy, _rim_columns(*_column_extents([(xy, None)])))
+
+
+def _rim_columns(xs: np.ndarray, lowest: np.ndarray, highest: np.ndarray
+                 ) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """
+    Group the sorted distinct x positions xs of a pattern, with the lowest and highest y at each, into
+    columns: positions closer than 1e-6 of the x extent to the previous one are in the same column.
+    Returns the first x, lowest and highest y of every column and the tolerance, for _rim_spots().
+    """
+    atol = float(xs[-1] - xs[0]) * 1e-6
+    new_column = np.concatenate(([True], np.diff(xs) >= atol if atol > 0 else np.zeros(len(xs) - 1, dtype=bool)))
+    column = np.cumsum(new_column) - 1
+    column_lowest = np.full(column[-1] + 1, np.inf)
+    column_highest = np.full(column[-1] + 1, -np.inf)
+    np.minimum.at(column_lowest, column, lowest)
+    np.maximum.at(column_highest, column, highest)
+    return xs[new_column], column_lowest, column_highest, atol
+
+
+def _rim_spots(xy: np.ndarray, columns: tuple[np.ndarray, np.ndarray, np.ndarray, float]) -> np.ndarray:
+    """
+    Return the rim mask of (N, 2) positions, given the columns of the whole pattern from _rim_columns():
+    all spots of the outermost columns and the top and bottom spots of every column.
+    """
+    starts, lowest, highest, atol = columns
+    column = np.searchsorted(starts, xy[:, 0], side='right') - 1
+    rim = (column == 0) | (column == len(starts) - 1)
+    if atol > 0:
+        rim |= (np.abs(xy[:, 1] - lowest[column]) < atol) | (np.abs(xy[:, 1] - highest[column]) < atol)
+    return rim
+
+
+def _dose_plot(fname: str, model: PlanInputModel, layers: list[tuple[np.ndarray, np.ndarray]],
+               fwhms: list[list[float]]) -> None:
     '''
-    Generate a dose plot of the plan, and save it as a PNG file.
-    The dose is calculated as a sum of Gaussian functions centered at each spot, with the given
-    full width at half maximum (FWHM).
+    Generate a dose plot of the plan, and save it as a PNG file using the renderer selected
+    in model.plot_dose_renderer.
+    The dose is calculated as a sum of Gaussian functions centered at each spot of the (coords, weights)
+    layers, with the full width at half maximum (FWHM) of each layer, on the grid defined by dose_grid().
     '''
 
-    resolution = 0.01  # cm
-    x = np.arange(model.spot_xymin[0] - 1, model.spot_xymax[0] + 1, resolution)
-    y = np.arange(model.spot_xymin[1] - 1, model.spot_xymax[1] + 1, resolution)
-    X, Y = np.meshgrid(x, y, indexing='ij')
-    dose = np.zeros_like(X)
-
-    sx2 = fwhm[0]**2 / (4 * np.log(2))
-    sy2 = fwhm[1]**2 / (4 * np.log(2))
+    resolution = grid_resolution(np.min(fwhms, axis=0), model.plot_dose_resolution)
+    x, y, dose = layered_dose_grid(layers, fwhms, resolution)
 
-    for (x0, y0), w in zip(coords.reshape(-1, 2), weights):
-        dose += w * np.exp(-(((X - x0)**2 / sx2) + ((Y - y0)**2 / sy2)))
     # Normalize dose for visualization
     dose /= np.max(dose)
-    plt.figure(figsize=(6, 5))
-    # use crazy discrete color map to better visualize the dose distribution
-    mycmap = plt.get_cmap('tab20', 20)  # 20 discrete colors for 5% variations in dose
-    plt.imshow(dose.T, extent=(x[0], x[-1], y[0], y[-1]), origin='lower', cmap=mycmap)
-    plt.colorbar(label='Relative Dose')
-    plt.title(f'Dose Distribution {model.output_path}')
-    plt.xlabel('X (cm)')
-    plt.ylabel('Y (cm)')
-    # add grid lines: 1 cm major, 0.5 cm minor
-    ax = plt.gca()
-    from matplotlib.ticker import MultipleLocator
-    ax.xaxis.set_major_locator(MultipleLocator(1.0))
-    ax.yaxis.set_major_locator(MultipleLocator(1.0))
-    ax.xaxis.set_minor_locator(MultipleLocator(0.5))
-    ax.yaxis.set_minor_locator(MultipleLocator(0.5))
-    ax.grid(True, which='major', color='black', linestyle='-', linewidth=0.5)
-    ax.grid(True, which='minor', color='gray', linestyle='--', linewidth=0.25)
-
-    plt.savefig(fname)
-    plt.close()
+    # extent of the outer pixel edges, x and y hold the pixel centres
+    extent = (x[0] - resolution / 2, x[-1] + resolution / 2, y[0] - resolution / 2, y[-1] + resolution / 2)
+
+    if model.plot_dose_renderer == 'matplotlib':
+        render_dose_matplotlib(fname, dose, extent, grid=model.plot_dose_grid, title=str(model.output_path))
+    elif model.plot_dose_renderer == 'pillow':
+        render_dose_pillow(fname, dose, extent, grid=model.plot_dose_grid)
+    else:
+        raise ValueError(f"Unknown dose plot renderer: {model.plot_dose_renderer}")
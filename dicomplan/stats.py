@@ -0,0 +1,194 @@
+import json
+import logging
+
+import numpy as np
+
+from dicomplan.model import SpotTable
+from dicomplan.spots import rim_mask
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BINS = 20
+NN_CELL_POINTS = 2.0  # mean number of points per cell of the nearest neighbour search
+DENSITY_CELL = 1.0  # cm, side of the cells over which the local spot density is counted
+SPACING_DECIMALS = 4  # mm
+
+
+def nearest_neighbour_distances(xy: np.ndarray) -> np.ndarray:
+    """
+    Return the distance of every point of an (N, 2) array to its nearest other point, inf for a single point.
+
+    The points are hashed into square cells of about NN_CELL_POINTS points each. Candidates are searched in
+    the ring of cells around each point's cell, growing the ring only for the points whose nearest neighbour
+    may lie beyond it, so a regular pattern is done after the first ring. Coincident points have distance 0.
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    n = len(xy)
+    best = np.full(n, np.inf)
+    if n < 2:
+        return best
+
+    lo = xy.min(axis=0)
+    extent = np.maximum(xy.max(axis=0) - lo, 1e-12)
+    cell = max(float(np.sqrt(NN_CELL_POINTS * extent[0] * extent[1] / n)), float(extent.max()) / n, 1e-9)
+    shape = (extent // cell).astype(np.int64) + 1
+    ij = ((xy - lo) // cell).astype(np.int64)
+
+    # points sorted by cell, with a dense table of the start and count of every cell
+    key = ij[:, 0] * shape[1] + ij[:, 1]
+    order = np.argsort(key, kind='stable')
+    counts = np.bincount(key, minlength=int(shape[0] * shape[1]))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    active = np.arange(n)
+    ring = 1
+    while len(active):
+        ci, cj = ij[active, 0], ij[active, 1]
+        for di in range(-ring, ring + 1):
+            for dj in range(-ring, ring + 1):
+                if ring > 1 and max(abs(di), abs(dj)) != ring:
+                    continue  # inner cells were searched in the previous rings
+                ni, nj = ci + di, cj + dj
+                inside = (ni >= 0) & (ni < shape[0]) & (nj >= 0) & (nj < shape[1])
+                points = active[inside]
+                neighbour = ni[inside] * shape[1] + nj[inside]
+                count = counts[neighbour]
+                for slot in range(int(count.max()) if len(count) else 0):
+                    has = count > slot
+                    p, other = points[has], order[starts[neighbour[has]] + slot]
+                    d = np.hypot(xy[p, 0] - xy[other, 0], xy[p, 1] - xy[other, 1])
+                    d[p == other] = np.inf
+                    best[p] = np.minimum(best[p], d)
+        # a neighbour within ring cells is certainly found, others need the next ring
+        active = active[best[active] > ring * cell]
+        ring += 1
+        if ring > shape.max():
+            break
+    return best
+
+
+def nearest_indices(points: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Return the index into the (M, 2) targets of the nearest target of every (N, 2) point, the lowest index
+    of equally near targets.
+
+    The targets are hashed into square cells of about NN_CELL_POINTS targets each, and the rings of cells
+    around each point's cell are searched as in nearest_neighbour_distances(), so a point only compares
+    against the targets near it.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    targets = np.asarray(targets, dtype=np.float64)
+    nearest = np.full(len(points), -1, dtype=np.int64)
+    if len(points) == 0:
+        return nearest
+    if len(targets) == 0:
+        raise ValueError("No targets to find the nearest of")
+
+    lo = np.minimum(points.min(axis=0), targets.min(axis=0))
+    extent = np.maximum(np.maximum(points.max(axis=0), targets.max(axis=0)) - lo, 1e-12)
+    cell = max(float(np.sqrt(NN_CELL_POINTS * extent[0] * extent[1] / len(targets))),
+               float(extent.max()) / len(targets), 1e-9)
+    shape = (extent // cell).astype(np.int64) + 1
+
+    ij = ((targets - lo) // cell).astype(np.int64)
+    key = ij[:, 0] * shape[1] + ij[:, 1]
+    order = np.argsort(key, kind='stable')
+    counts = np.bincount(key, minlength=int(shape[0] * shape[1]))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    pij = ((points - lo) // cell).astype(np.int64)
+    best = np.full(len(points), np.inf)
+    active = np.arange(len(points))
+    ring = 1
+    while len(active):
+        ci, cj = pij[active, 0], pij[active, 1]
+        for di in range(-ring, ring + 1):
+            for dj in range(-ring, ring + 1):
+                if ring > 1 and max(abs(di), abs(dj)) != ring:
+                    continue  # inner cells were searched in the previous rings
+                ni, nj = ci + di, cj + dj
+                inside = (ni >= 0) & (ni < shape[0]) & (nj >= 0) & (nj < shape[1])
+                candidates = active[inside]
+                neighbour = ni[inside] * shape[1] + nj[inside]
+                count = counts[neighbour]
+                for slot in range(int(count.max()) if len(count) else 0):
+                    has = count > slot
+                    p, other = candidates[has], order[starts[neighbour[has]] + slot]
+                    d = np.hypot(points[p, 0] - targets[other, 0], points[p, 1] - targets[other, 1])
+                    better = (d < best[p]) | ((d == best[p]) & (other < nearest[p]))
+                    best[p[better]] = d[better]
+                    nearest[p[better]] = other[better]
+        # a target within ring cells is certainly found, others need the next ring
+        active = active[~(best[active] < ring * cell)]
+        ring += 1
+        if ring > shape.max():
+            break
+    return nearest
+
+
+def _histogram(values: np.ndarray, bins: int = HISTOGRAM_BINS) -> dict:
+    counts, edges = np.histogram(values, bins=bins)
+    return {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+
+def _summary(values: np.ndarray) -> dict:
+    return {'min': float(values.min()), 'max': float(values.max()), 'mean': float(values.mean()),
+            'median': float(np.median(values)), 'std': float(values.std())}
+
+
+def plan_statistics(layers: list[tuple[float, np.ndarray, np.ndarray]]) -> dict:
+    """
+    Return statistics of the (energy, coords [cm], MU) layers of a plan or its SpotTable, one layer per control
+    point pair: the MU per spot and its histogram, the nearest neighbour spacing [mm] within each layer, the
+    local spot density [spots/cm2] over the occupied DENSITY_CELL cells, and the bounding box [mm] and rim and
+    interior spot counts per layer.
+    """
+    table = SpotTable.of(layers)
+    mu = table.weight.astype(np.float64)
+    if len(mu) == 0:
+        raise ValueError("Cannot calculate statistics for a plan without spots")
+
+    layer_stats = []
+    spacings = []
+    densities = []
+    for energy, start, stop in zip(table.energy, table.bounds[:-1], table.bounds[1:]):
+        xy = table.xy[start:stop].astype(np.float64) * 10.0  # cm to mm
+        rim = rim_mask(table.xy[start:stop])
+        nn = nearest_neighbour_distances(xy)
+        nn = np.round(nn[np.isfinite(nn)], SPACING_DECIMALS)  # lattice spacings without float noise
+        spacings.append(nn)
+
+        cells = np.floor(xy / (DENSITY_CELL * 10.0)).astype(np.int64)
+        _, counts = np.unique(cells, axis=0, return_counts=True)
+        densities.append(counts / DENSITY_CELL**2)
+
+        stats = {'energy': float(energy), 'spots': int(stop - start), 'mu': float(mu[start:stop].sum()),
+                 'bbox': [*xy.min(axis=0).tolist(), *xy.max(axis=0).tolist()],
+                 'rim_spots': int(rim.sum()), 'interior_spots': int(len(rim) - rim.sum())}
+        if len(nn):
+            stats['spacing_min'] = float(nn.min())
+            stats['spacing_median'] = float(np.median(nn))
+        layer_stats.append(stats)
+
+    spacing = np.concatenate(spacings)
+    density = np.concatenate(densities)
+    return {
+        'spots': len(mu),
+        'layers': len(table),
+        'total_mu': float(mu.sum()),
+        'mu_per_spot': {**_summary(mu), 'histogram': _histogram(mu)},
+        'spacing': {**_summary(spacing), 'histogram': _histogram(spacing)} if len(spacing) else None,
+        'density': {'cell_cm': DENSITY_CELL, **_summary(density)},
+        'rim_spots': sum(stats['rim_spots'] for stats in layer_stats),
+        'interior_spots': sum(stats['interior_spots'] for stats in layer_stats),
+        'layer_stats': layer_stats,
+    }
+
+
+def write_statistics(path: str, stats: dict):
+    """
+    Write plan statistics as JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=1)
+    logger.info(f"Plan statistics written to {path}")
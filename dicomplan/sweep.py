@@ -0,0 +1,252 @@
+import collections
+import copy
+import csv
+import itertools
+import json
+import logging
+import os
+import shlex
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from dicomplan.config_parser import get_model_from_args, parse_arguments
+from dicomplan.dicom import Dicom
+from dicomplan.dose import METRIC_FIELDS, field_metrics, layered_dose_grid
+from dicomplan.machine import dose_fwhm
+from dicomplan.model import PlanInputModel
+from dicomplan.reader import beam_arrays
+from dicomplan.spots import load_custom_spots
+from dicomplan.validate import has_errors
+
+logger = logging.getLogger(__name__)
+
+# sweep parameters which are not PlanInputModel attributes
+FIELD_SIZE = 'field_size'  # cm, side of a square/image field or diameter of a circular field
+
+SUMMARY_FIELDS = ['index', 'file', 'written', 'spots', 'layers', 'total_mu', 'errors', 'warnings']
+
+
+def parse_values(text: str) -> list[float]:
+    """
+    Parse the values of a sweep parameter: a comma separated list "0.3,0.4,0.5"
+    or an inclusive range "start:stop:step", e.g. "70:230:20".
+    """
+    if ':' in text:
+        parts = [float(p) for p in text.split(':')]
+        if len(parts) != 3 or parts[2] <= 0:
+            raise ValueError(f"Range must be start:stop:step with a positive step, got '{text}'")
+        start, stop, step = parts
+        n = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(max(n, 0))]
+    return [float(v) for v in text.split(',') if v.strip()]
+
+
+def parse_parameters(specs: list[str], base: PlanInputModel) -> dict[str, list]:
+    """
+    Parse "name=values" sweep specifications. name is a numeric PlanInputModel attribute
+    (e.g. spot_energy, spot_spacing, boost_rim, spot_mu) or field_size.
+    Values are converted to the type of the attribute in the base model. Parameters the base plan
+    ignores are rejected, so the plans of a sweep never stay identical along one axis.
+    """
+    parameters = {}
+    for spec in specs:
+        name, sep, text = spec.partition('=')
+        name = name.strip()
+        if not sep:
+            raise ValueError(f"Sweep parameter must be name=values, got '{spec}'")
+        if name != FIELD_SIZE:
+            value = getattr(base, name, None)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"'{name}' is not a numeric plan model attribute")
+        reason = _ignored_reason(name, base)
+        if reason is not None:
+            raise ValueError(f"Sweeping '{name}' has no effect on this base plan: {reason}")
+        values = parse_values(text)
+        if name != FIELD_SIZE and isinstance(getattr(base, name), int):
+            values = [int(v) for v in values]
+        parameters[name] = values
+    return parameters
+
+
+def _ignored_reason(name: str, base: PlanInputModel) -> Optional[str]:
+    """
+    Return why the base plan ignores the sweep parameter name, or None if it takes effect.
+    """
+    if name == 'spot_energy':
+        if base.spot_energies:
+            return "it has several --energy values"
+        if base.spot_shape == 'image' and base.spot_energy_range is not None:
+            return "the image frame energies follow --energy_range"
+        if base.spot_shape == 'custom' and load_custom_spots(base.spot_custom_path)[3] is not None:
+            return "the spot map has an energy column"
+    if name == 'spot_spacing':
+        if base.spot_spacing_sigma is not None:
+            return "--spacing_sigma sets the spacing of every layer"
+        if base.spot_shape == 'custom':
+            return "custom spot maps have fixed positions"
+    if name == FIELD_SIZE and base.spot_shape in ('compose', 'custom'):
+        return f"{base.spot_shape} plans have no field size"
+    return None
+
+
+def sweep_points(parameters: dict[str, list]) -> Iterator[tuple[int, dict]]:
+    """
+    Lazily yield (index, {name: value}) for the cartesian product of the parameter values,
+    with the last parameter varying fastest.
+    """
+    names = list(parameters)
+    for index, values in enumerate(itertools.product(*parameters.values())):
+        yield index, dict(zip(names, values))
+
+
+def sweep_size(parameters: dict[str, list]) -> int:
+    """
+    Return the number of plans in a sweep.
+    """
+    return int(np.prod([len(values) for values in parameters.values()], dtype=np.int64))
+
+
+def plan_filename(point: dict) -> str:
+    """
+    Return the deterministic file name of a sweep point, e.g. spot_energy-70_spot_spacing-0.3.dcm.
+    """
+    return "_".join(f"{name}-{value:g}" for name, value in point.items()) + ".dcm"
+
+
+def apply_point(base: PlanInputModel, point: dict) -> PlanInputModel:
+    """
+    Return a copy of the base model with the sweep parameters of a point applied.
+    """
+    model = copy.deepcopy(base)
+    for name, value in point.items():
+        if name == FIELD_SIZE:
+            _set_field_size(model, value)
+        else:
+            setattr(model, name, value)
+    return model
+
+
+def _set_field_size(model: PlanInputModel, size: float):
+    if model.spot_shape == 'circle':
+        model.spot_diameter = size
+        return
+    cx = (model.spot_xymin[0] + model.spot_xymax[0]) / 2
+    cy = (model.spot_xymin[1] + model.spot_xymax[1]) / 2
+    model.spot_xymin = [cx - size / 2, cy - size / 2]
+    model.spot_xymax = [cx + size / 2, cy + size / 2]
+
+
+def build_point(base: PlanInputModel, point: dict, index: int, output_dir: str,
+                force: bool = False, metrics: bool = False) -> dict:
+    """
+    Build and write the plan of one sweep point and return its summary row.
+    """
+    filename = plan_filename(point)
+    model = apply_point(base, point)
+    model.output_path = os.path.join(output_dir, filename)
+    model.plot_dose = False
+
+    d = Dicom()
+    try:
+        d.apply_model(model)
+    except ValueError as e:
+        # e.g. all spots below the minimum MU, the sweep carries on with the next plan
+        logger.error(f"{filename}: {e}")
+        return {'index': index, 'file': filename, 'written': False, **point, 'errors': 1}
+    written = force or not has_errors(d.issues)
+    if written:
+        d.write(model.output_path)
+
+    beam = beam_arrays(d.ds)[0]
+    delivered = beam.weights > 0
+    row = {'index': index, 'file': filename, 'written': written, **point,
+           'spots': int(delivered.sum()), 'layers': len(beam.energy) // 2,
+           'total_mu': beam.final_cumulative_meterset_weight,
+           'errors': sum(issue.severity == 'error' for issue in d.issues),
+           'warnings': sum(issue.severity == 'warning' for issue in d.issues)}
+    if metrics:
+        # one layer per control point with spots, each with the spot size at its energy
+        cps = np.flatnonzero(beam.weight_sums > 0)
+        layers = [(beam.xy[beam.cp_start[cp]:beam.cp_start[cp + 1]] / 10.0,  # mm to cm
+                   beam.weights[beam.cp_start[cp]:beam.cp_start[cp + 1]]) for cp in cps]
+        x, y, dose = layered_dose_grid(layers, [dose_fwhm(model, beam.energy[cp]) for cp in cps])
+        row.update(field_metrics(x, y, dose))
+    return row
+
+
+def _rows(base: PlanInputModel, parameters: dict, output_dir: str, jobs: int, force: bool,
+          metrics: bool) -> Iterator[dict]:
+    """
+    Yield the summary rows in sweep order. With jobs > 1, plans are built in a process pool with
+    at most 2 * jobs plans in flight, so memory use does not grow with the sweep size.
+    """
+    if jobs <= 1:
+        for index, point in sweep_points(parameters):
+            yield build_point(base, point, index, output_dir, force, metrics)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = collections.deque()
+        for index, point in sweep_points(parameters):
+            pending.append(pool.submit(build_point, base, point, index, output_dir, force, metrics))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_sweep(base: PlanInputModel, parameters: dict[str, list], output_dir: str, jobs: int = 1,
+              force: bool = False, metrics: bool = False, summary: Optional[str] = None) -> int:
+    """
+    Build all plans of a sweep into output_dir and stream the summary table to a CSV or JSON file
+    (by suffix, default output_dir/summary.csv). Returns the number of plans that were not written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    summary = summary or os.path.join(output_dir, "summary.csv")
+    fields = SUMMARY_FIELDS[:3] + list(parameters) + SUMMARY_FIELDS[3:] + (METRIC_FIELDS if metrics else [])
+    jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+    logger.info(f"Sweep of {sweep_size(parameters)} plans over {', '.join(parameters)} with {jobs} jobs")
+
+    failed = 0
+    as_json = Path(summary).suffix.lower() == '.json'
+    with open(summary, 'w', newline='') as f:
+        if as_json:
+            f.write('[')
+        else:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+        for row in _rows(base, parameters, output_dir, jobs, force, metrics):
+            failed += not row['written']
+            if not row['written'] and 'spots' in row:
+                logger.warning(f"{row['file']} failed validation, not written")
+            if as_json:
+                f.write(('\n' if row['index'] == 0 else ',\n') + json.dumps({k: row.get(k) for k in fields}))
+            else:
+                writer.writerow(row)
+        if as_json:
+            f.write('\n]\n')
+
+    logger.info(f"Sweep summary written to {summary}")
+    return failed
+
+
+def sweep_from_args(args) -> Optional[int]:
+    """
+    Run the sweep subcommand: the base plan is given as a dicomplan command line.
+    """
+    base_args = parse_arguments(shlex.split(args.base))
+    if base_args.pattern_type not in ('square', 'circle', 'image', 'compose', 'custom'):
+        logger.error(f"The sweep base must build a plan, got '{base_args.pattern_type}'")
+        return 1
+    base = get_model_from_args(base_args)
+    try:
+        parameters = parse_parameters(args.vary, base)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    failed = run_sweep(base, parameters, args.output_dir, args.jobs, args.force or base_args.force,
+                       args.metrics, args.summary)
+    return 1 if failed else None
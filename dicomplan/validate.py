@@ -0,0 +1,223 @@
+import logging
+from typing import Optional
+
+import numpy as np
+import pydicom
+
+from dicomplan.machine import MachineProfile, load_machine
+from dicomplan.reader import BeamArrays, beam_arrays, beam_meterset
+
+logger = logging.getLogger(__name__)
+
+MU_TOLERANCE = 1e-3  # MU, absolute tolerance on weights and cumulative meterset weights
+MU_RELATIVE_TOLERANCE = 1e-5  # relative tolerance on cumulative meterset weights, covers float32 sums
+DUPLICATE_TOLERANCE = 0.01  # mm, spots closer than this within a control point are duplicates
+
+
+class ValidationIssue:
+    """
+    A single validation finding. Errors would be rejected by the planning system or machine,
+    warnings are suspicious but deliverable.
+    """
+
+    def __init__(self, severity: str, check: str, message: str, beam_number=None):
+        self.severity = severity  # 'error' or 'warning'
+        self.check = check
+        self.message = message
+        self.beam_number = beam_number
+
+    def __str__(self):
+        beam = f"beam {self.beam_number} " if self.beam_number is not None else ""
+        return f"{self.severity.upper()}: {beam}{self.check}: {self.message}"
+
+    def __repr__(self):
+        return f"ValidationIssue({self.severity!r}, {self.check!r}, {self.message!r}, {self.beam_number!r})"
+
+
+def validate_dataset(ds: pydicom.Dataset, machine: Optional[MachineProfile] = None,
+                     enforce_mu: bool = True) -> list[ValidationIssue]:
+    """
+    Validate an RT Ion plan against the machine limits and for internal consistency.
+    If machine is None, the profile is selected by the TreatmentMachineName of each beam.
+    If enforce_mu is False, spot MU outside the machine MU limits are warnings instead of errors.
+    All checks work on the flat spot arrays of a beam, so large plans validate quickly.
+    """
+    issues = []
+    beams = beam_arrays(ds)
+    if len(beams) == 0:
+        issues.append(ValidationIssue('error', 'beams', "plan has no IonBeamSequence"))
+
+    for beam in beams:
+        beam_machine = machine if machine is not None else load_machine(beam.machine or 'tr4')
+        issues += [ValidationIssue(severity, check, message, beam.beam_number)
+                   for severity, check, message in _validate_beam(beam, beam_machine, beam_meterset(ds, beam.beam_number),
+                                                                       enforce_mu)]
+    return issues
+
+
+def _validate_beam(beam: BeamArrays, machine: MachineProfile, meterset: float,
+                   enforce_mu: bool = True) -> list[tuple[str, str, str]]:
+    """
+    Run all checks on a single beam and return (severity, check, message) tuples.
+    """
+    issues = []
+    ncp = len(beam.energy)
+    if ncp < 2:
+        return [('error', 'control points', f"{ncp} control points, at least 2 are required")]
+
+    # --- control point structure
+    if beam.number_of_control_points != ncp:
+        issues.append(('error', 'control points',
+                       f"NumberOfControlPoints is {beam.number_of_control_points}, sequence has {ncp} items"))
+    if not np.array_equal(beam.cp_index, np.arange(ncp)):
+        issues.append(('error', 'control points', "ControlPointIndex is not 0, 1, 2, ..."))
+
+    # --- spot counts per control point (layer)
+    bad = (beam.position_counts != 2 * beam.declared_spots) | (beam.weight_counts != beam.declared_spots)
+    if bad.any():
+        issues.append(('error', 'spot count', f"control points {_list(np.flatnonzero(bad))}: "
+                       "NumberOfScanSpotPositions does not match the position map or weights"))
+    max_spots = machine.limit('max_spots_per_layer')
+    if max_spots is not None:
+        bad = beam.nspots > max_spots
+        if bad.any():
+            issues.append(('error', 'spot count', f"control points {_list(np.flatnonzero(bad))}: "
+                           f"up to {int(beam.nspots.max())} spots, machine limit is {max_spots}"))
+
+    # --- energy range
+    energy_min = machine.limit('energy_min')
+    energy_max = machine.limit('energy_max')
+    if energy_min is not None and energy_max is not None:
+        bad = (beam.energy < energy_min) | (beam.energy > energy_max)
+        if bad.any():
+            issues.append(('error', 'energy', f"energies {_list(np.unique(beam.energy[bad]))} MeV outside "
+                           f"machine range {energy_min} - {energy_max} MeV"))
+
+    # --- field extent
+    scan_field = machine.limit('scan_field')
+    if scan_field is not None and len(beam.xy) > 0:
+        half = np.asarray(scan_field, dtype=np.float64) / 2.0
+        outside = (np.abs(beam.xy) > half + 1e-3).any(axis=1)
+        if outside.any():
+            issues.append(('error', 'field extent', f"{int(outside.sum())} spots outside the scanning field "
+                           f"+-{half[0]:g} x +-{half[1]:g} mm"))
+
+    # --- MU bounds, only delivered (non-zero) spots are checked against the minimum.
+    # Meterset weights are in MU when FinalCumulativeMetersetWeight equals BeamMeterset (as written
+    # by dicomplan), other planning systems use relative weights which are scaled to MU here.
+    final = beam.final_cumulative_meterset_weight
+    mu = beam.weights
+    if not np.isnan(meterset) and final > 0:
+        mu = beam.weights * (meterset / final)
+    if (mu < 0).any():
+        issues.append(('error', 'MU', f"{int((mu < 0).sum())} negative spot weights"))
+    mu_severity = 'error' if enforce_mu else 'warning'
+    mu_min = machine.limit('mu_min')
+    if mu_min is not None:
+        low = (mu > 0) & (mu < mu_min - MU_TOLERANCE)
+        if low.any():
+            issues.append((mu_severity, 'MU', f"{int(low.sum())} spots below the minimum of {mu_min} MU, "
+                           f"smallest {float(mu[low].min()):.4g} MU"))
+    mu_max = machine.limit('mu_max')
+    if mu_max is not None:
+        high = mu > mu_max + MU_TOLERANCE
+        if high.any():
+            issues.append((mu_severity, 'MU', f"{int(high.sum())} spots above the maximum of {mu_max} MU, "
+                           f"largest {float(mu[high].max()):.4g} MU"))
+
+    # --- cumulative meterset weights
+    cum = beam.cumulative_weight
+    tol = MU_TOLERANCE + MU_RELATIVE_TOLERANCE * max(final, 1.0)
+    if np.isnan(cum).any():
+        issues.append(('error', 'meterset', "control points without CumulativeMetersetWeight"))
+    else:
+        if abs(cum[0]) > tol:
+            issues.append(('error', 'meterset', f"first CumulativeMetersetWeight is {cum[0]:g}, expected 0"))
+        steps = np.diff(cum)
+        if (steps < -tol).any():
+            issues.append(('error', 'meterset', f"CumulativeMetersetWeight decreases at control points "
+                           f"{_list(np.flatnonzero(steps < -tol) + 1)}"))
+        # the weights of control point i are delivered between control points i and i + 1
+        sums = beam.weight_sums
+        bad = np.abs(steps - sums[:-1]) > tol
+        if bad.any():
+            issues.append(('error', 'meterset', f"control points {_list(np.flatnonzero(bad))}: spot weights do not "
+                           "match the CumulativeMetersetWeight increment"))
+        if sums[-1] > tol:
+            issues.append(('error', 'meterset', "last control point has non-zero spot weights"))
+        if abs(cum[-1] - final) > tol:
+            issues.append(('error', 'meterset', f"last CumulativeMetersetWeight {cum[-1]:g} != "
+                           f"FinalCumulativeMetersetWeight {final:g}"))
+    if not np.isnan(meterset) and abs(final - meterset) > MU_TOLERANCE + MU_RELATIVE_TOLERANCE * max(meterset, 1.0):
+        issues.append(('warning', 'meterset', f"FinalCumulativeMetersetWeight {final:g} != BeamMeterset {meterset:g}, "
+                       "spot weights are relative"))
+
+    # --- duplicate spot positions within a control point
+    ndup = _count_duplicates(beam)
+    if ndup > 0:
+        issues.append(('warning', 'duplicates', f"{ndup} duplicate spot positions within control points"))
+
+    return issues
+
+
+def _count_duplicates(beam: BeamArrays) -> int:
+    """
+    Count spots sharing a position (within DUPLICATE_TOLERANCE) with another spot of the same control point.
+    """
+    if len(beam.xy) < 2:
+        return 0
+    q = np.round(beam.xy / DUPLICATE_TOLERANCE).astype(np.int64)
+    order = np.lexsort((q[:, 1], q[:, 0], beam.cp_of_spot))
+    keys = np.column_stack((beam.cp_of_spot[order], q[order]))
+    same = (keys[1:] == keys[:-1]).all(axis=1)
+    return int(same.sum())
+
+
+def _list(values, nmax: int = 5) -> str:
+    """
+    Format the first few values of an array for a message.
+    """
+    values = list(np.asarray(values).tolist())
+    text = ", ".join(f"{v:g}" if isinstance(v, float) else str(v) for v in values[:nmax])
+    return text + (", ..." if len(values) > nmax else "")
+
+
+def log_issues(issues: list[ValidationIssue], prefix: str = "") -> None:
+    """
+    Log validation issues at error or warning level.
+    """
+    for issue in issues:
+        if issue.severity == 'error':
+            logger.error(f"{prefix}{issue}")
+        else:
+            logger.warning(f"{prefix}{issue}")
+
+
+def has_errors(issues: list[ValidationIssue]) -> bool:
+    """
+    Return True if any issue is an error.
+    """
+    return any(issue.severity == 'error' for issue in issues)
+
+
+def validate_files(paths: list[str], machine_name: Optional[str] = None) -> int:
+    """
+    Validate DICOM plan files and print the result per file. Returns 1 if any plan has errors.
+    """
+    machine = load_machine(machine_name) if machine_name is not None else None
+    status = 0
+    for path in paths:
+        try:
+            ds = pydicom.dcmread(path)
+        except Exception as e:
+            print(f"{path}: ERROR: cannot read plan: {e}")
+            status = 1
+            continue
+        issues = validate_dataset(ds, machine)
+        if not issues:
+            print(f"{path}: OK")
+        for issue in issues:
+            print(f"{path}: {issue}")
+        if has_errors(issues):
+            status = 1
+    return status
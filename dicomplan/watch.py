@@ -0,0 +1,256 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import shlex
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+from dicomplan.build import build_plan
+from dicomplan.config_parser import parse_arguments
+from dicomplan.machine import is_profile_file, load_machine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 0.5  # s
+DEFAULT_DEBOUNCE = 0.3  # s, quiet time after the last change before plans are rebuilt
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class ManifestEntry:
+    """
+    A single plan of a watch manifest: the command line, its parsed arguments and the input files it depends on.
+    """
+
+    def __init__(self, line: str):
+        self.line = line
+        tokens = shlex.split(line)
+        if tokens and tokens[0] == 'dicomplan':
+            tokens = tokens[1:]
+        self.args = parse_arguments(tokens)
+        if self.args.pattern_type not in ('square', 'circle', 'image', 'compose', 'custom'):
+            raise ValueError(f"Manifest entries must build a plan, got '{self.args.pattern_type}'")
+
+        self.dependencies: list[str] = []
+        if self.args.pattern_type == 'image':
+            self.dependencies.append(os.path.abspath(self.args.image_path))
+        if self.args.pattern_type == 'custom':
+            self.dependencies.append(os.path.abspath(self.args.spots_path))
+        if self.args.treatment_machine is not None and is_profile_file(self.args.treatment_machine):
+            self.dependencies.append(os.path.abspath(self.args.treatment_machine))
+
+
+def read_manifest(path: str) -> list[ManifestEntry]:
+    """
+    Read a watch manifest: one dicomplan command line per line, blank lines and '#' comments are ignored.
+    Lines which cannot be parsed are logged and skipped.
+    """
+    entries = []
+    for lineno, line in enumerate(Path(path).read_text().splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            entries.append(ManifestEntry(line))
+        except ValueError as e:
+            logger.error(f"{path}:{lineno}: invalid entry '{line}': {e}")
+        except SystemExit:
+            # argparse has printed the error and exits on bad arguments, which must not end the watch
+            logger.error(f"{path}:{lineno}: invalid arguments in '{line}'")
+    return entries
+
+
+def _signature(path: str) -> Optional[tuple[int, int]]:
+    """
+    Return the (mtime, size) of a file, or None if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class _Inotify:
+    """
+    Minimal inotify wrapper via ctypes. Directories are watched rather than files,
+    since editors often save by writing a new file and renaming it.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories: set[str] = set()
+
+    def watch(self, directory: str):
+        if directory in self.directories:
+            return
+        if self._add_watch(self.fd, os.fsencode(directory), IN_WATCH_MASK) < 0:
+            logger.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self.directories.add(directory)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds for events. Returns True if there were any, the events are discarded.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PlanWatcher:
+    """
+    Keeps the plans of a manifest up to date. The manifest and the input files of every entry are watched,
+    and only the plans affected by a change are rebuilt. Decoded images and machine profiles stay cached
+    in this process between builds.
+    """
+
+    def __init__(self, manifest: str, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 debounce: float = DEFAULT_DEBOUNCE, use_inotify: bool = True):
+        self.manifest = os.path.abspath(manifest)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.entries: dict[str, ManifestEntry] = {}
+        self.signatures: dict[str, Optional[tuple[int, int]]] = {}
+
+        self._inotify: Optional[_Inotify] = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify not available ({e}), polling every {poll_interval} s")
+
+    def _watched_paths(self) -> set[str]:
+        paths = {self.manifest}
+        for entry in self.entries.values():
+            paths.update(entry.dependencies)
+        return paths
+
+    def _snapshot(self) -> dict[str, Optional[tuple[int, int]]]:
+        return {path: _signature(path) for path in self._watched_paths()}
+
+    def _build(self, entries: list[ManifestEntry]) -> list[str]:
+        """
+        Build the given entries, errors are logged and do not stop the watch. Returns the outputs built.
+        """
+        built = []
+        for entry in entries:
+            logger.info(f"Building {entry.args.output}")
+            try:
+                if build_plan(entry.args) is None:
+                    built.append(entry.args.output)
+            except Exception as e:
+                logger.error(f"Building '{entry.line}' failed: {e}")
+        return built
+
+    def update(self) -> list[str]:
+        """
+        Rebuild the plans affected by changes since the last update (all plans on the first call).
+        Returns the output paths that were rebuilt.
+        """
+        new = self._snapshot()
+        changed = {path for path, signature in new.items() if self.signatures.get(path, ()) != signature}
+        if not changed:
+            return []
+
+        affected = []
+        if self.manifest in changed:
+            old_lines = set(self.entries)
+            self.entries = {entry.line: entry for entry in read_manifest(self.manifest)} \
+                if new[self.manifest] is not None else {}
+            affected = [entry for line, entry in self.entries.items() if line not in old_lines]
+            logger.info(f"Manifest has {len(self.entries)} plans, {len(affected)} new or changed")
+            new = self._snapshot()  # dependencies of new entries
+
+        # machine profiles are cached per path, reload edited ones
+        if any(is_profile_file(path) for path in changed):
+            load_machine.cache_clear()
+
+        affected += [entry for entry in self.entries.values()
+                     if entry not in affected and changed.intersection(entry.dependencies)]
+        self.signatures = new
+
+        if self._inotify is not None:
+            for path in new:
+                self._inotify.watch(os.path.dirname(path))
+        return self._build(affected)
+
+    def _wait(self, timeout: float) -> bool:
+        """
+        Wait for a change. With inotify, returns as soon as a watched directory changes;
+        when polling, sleeps for timeout and reports a possible change.
+        """
+        if self._inotify is not None:
+            return self._inotify.wait(timeout)
+        time.sleep(timeout)
+        return True
+
+    def run(self, max_updates: Optional[int] = None):
+        """
+        Build all plans, then rebuild affected plans on every change until interrupted.
+        Rapid successive saves are collected until the inputs have been quiet for the debounce time.
+        """
+        self.update()
+        updates = 0
+        while max_updates is None or updates < max_updates:
+            if not self._wait(self.poll_interval):
+                continue
+            # debounce: wait until the inputs stopped changing
+            snapshot = self._snapshot()
+            while True:
+                self._wait(self.debounce)
+                settled = self._snapshot()
+                if settled == snapshot:
+                    break
+                snapshot = settled
+            if self.update():
+                updates += 1
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+def watch_manifest(manifest: str, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                   debounce: float = DEFAULT_DEBOUNCE, use_inotify: bool = True) -> Optional[int]:
+    """
+    Watch a manifest and rebuild its plans on changes until interrupted with Ctrl-C.
+    """
+    if not os.path.isfile(manifest):
+        logger.error(f"Manifest {manifest} not found")
+        return 1
+    watcher = PlanWatcher(manifest, poll_interval, debounce, use_inotify)
+    logger.warning(f"Watching {manifest}, Ctrl-C to stop")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return None
@@ -0,0 +1,108 @@
+import os
+
+import pydicom
+
+from dicomplan.cache import BuildCache, model_digest
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.main import main
+
+
+def _model(*args):
+    return get_model_from_args(parse_arguments(list(args)))
+
+
+# ---------------------------------------------------------------------------
+# model_digest
+# ---------------------------------------------------------------------------
+
+class TestModelDigest:
+    def test_output_paths_do_not_change_digest(self):
+        a = _model("-o", "a.dcm", "circle", "8")
+        b = _model("-o", "b.dcm", "--dose_plot_filepath", "b.png", "circle", "8")
+        assert a.canonical() == b.canonical()
+        assert model_digest(a) == model_digest(b)
+
+    def test_plan_content_changes_digest(self):
+        assert model_digest(_model("circle", "8")) != model_digest(_model("circle", "8", "--energy", "150"))
+
+    def test_plot_options_only_with_plot(self):
+        a = _model("circle", "8")
+        b = _model("--dose_plot_renderer", "matplotlib", "circle", "8")
+        assert model_digest(a) == model_digest(b)
+        assert model_digest(a, plot=True) != model_digest(b, plot=True)
+
+    def test_image_content_changes_digest(self, tmp_path):
+        from PIL import Image
+        image = tmp_path / "field.png"
+        Image.new("L", (8, 8), 255).save(image)
+        before = model_digest(_model("image", "4", "4", str(image)))
+        Image.new("L", (8, 8), 128).save(image)
+        assert model_digest(_model("image", "4", "4", str(image))) != before
+
+
+# ---------------------------------------------------------------------------
+# CLI integration - reproducible builds and the build cache
+# ---------------------------------------------------------------------------
+
+class TestReproducibleBuild:
+    def test_identical_bytes(self, tmp_path):
+        a, b = tmp_path / "a.dcm", tmp_path / "b.dcm"
+        main(["--reproducible", "-o", str(a), "circle", "6"])
+        main(["--reproducible", "-o", str(b), "circle", "6"])
+        assert a.read_bytes() == b.read_bytes()
+
+    def test_uid_follows_content(self, tmp_path):
+        a, b = tmp_path / "a.dcm", tmp_path / "b.dcm"
+        main(["--reproducible", "-o", str(a), "circle", "6"])
+        main(["--reproducible", "-o", str(b), "circle", "7"])
+        assert pydicom.dcmread(a).SOPInstanceUID != pydicom.dcmread(b).SOPInstanceUID
+
+    def test_source_date_epoch(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("SOURCE_DATE_EPOCH", "1700000000")
+        output = tmp_path / "a.dcm"
+        main(["--reproducible", "-o", str(output), "circle", "6"])
+        ds = pydicom.dcmread(output)
+        assert ds.StudyDate == "20231114"
+        assert ds.StudyTime.startswith("221320")
+
+
+class TestBuildCache:
+    def test_unchanged_plan_is_skipped(self, tmp_path):
+        output = tmp_path / "a.dcm"
+        args = ["--cache", str(tmp_path / "cache"), "-o", str(output), "circle", "6"]
+        main(args)
+        mtime = os.stat(output).st_mtime_ns
+        main(args)
+        assert os.stat(output).st_mtime_ns == mtime
+
+    def test_restore_from_cache(self, tmp_path):
+        cache = tmp_path / "cache"
+        a, b = tmp_path / "a.dcm", tmp_path / "b.dcm"
+        main(["--cache", str(cache), "-o", str(a), "circle", "6"])
+        main(["--cache", str(cache), "-o", str(b), "circle", "6"])
+        assert a.read_bytes() == b.read_bytes()
+        assert len(list(cache.glob("*.dcm"))) == 1
+
+    def test_concurrent_records_are_kept(self, tmp_path):
+        # two builds sharing a cache record their outputs without losing each other's entries
+        cache = tmp_path / "cache"
+        first, second = BuildCache(str(cache)), BuildCache(str(cache))
+        a, b = tmp_path / "a.dcm", tmp_path / "b.dcm"
+        a.write_bytes(b"a")
+        b.write_bytes(b"b")
+        first.record(str(a), "digest-a")
+        second.record(str(b), "digest-b")
+        cache = BuildCache(str(cache))
+        assert cache.is_current(str(a), "digest-a")
+        assert cache.is_current(str(b), "digest-b")
+
+    def test_modified_output_is_rebuilt(self, tmp_path):
+        cache = tmp_path / "cache"
+        output = tmp_path / "a.dcm"
+        main(["--cache", str(cache), "-o", str(output), "circle", "6"])
+        digest = model_digest(_model("--cache", str(cache), "-o", str(output), "circle", "6"))
+        assert BuildCache(str(cache)).is_current(str(output), digest)
+        output.write_bytes(b"edited")
+        assert not BuildCache(str(cache)).is_current(str(output), digest)
+        main(["--cache", str(cache), "-o", str(output), "circle", "6"])
+        assert pydicom.dcmread(output).Modality == "RTPLAN"
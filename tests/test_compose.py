@@ -0,0 +1,103 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.compose import compose_spots, lattice_points, parse_shape_expression, within_distance
+from dicomplan.config_parser import get_model_from_args, parse_arguments
+from dicomplan.main import main
+from dicomplan.spots import generate_layers
+from dicomplan.stats import nearest_neighbour_distances
+
+
+def _spots(expression, spacing=0.5, hexagonal=False, min_distance=None):
+    return compose_spots(parse_shape_expression(expression, spacing, hexagonal), min_distance)
+
+
+def _as_set(xy):
+    return set(map(tuple, np.round(xy, 6).tolist()))
+
+
+# ---------------------------------------------------------------------------
+# parse_shape_expression / compose_spots
+# ---------------------------------------------------------------------------
+
+class TestShapeExpression:
+    def test_single_shapes_match_patterns(self):
+        model = get_model_from_args(parse_arguments(["square", "4", "3"]))
+        coords, _ = generate_layers(model)[0][1:]
+        assert _as_set(_spots("square(4, 3)")) == _as_set(coords.reshape(-1, 2))
+        assert len(_spots("circle(4)")) == 49
+
+    def test_difference_and_intersection(self):
+        square, hole = _as_set(_spots("square(10)")), _as_set(_spots("circle(3, x=1)"))
+        assert _as_set(_spots("square(10) - circle(3, x=1)")) == square - hole
+        assert _as_set(_spots("square(10) & circle(3, x=1)")) == hole
+        assert len(_spots("square(2) & square(2, x=10)")) == 0
+
+    def test_union_on_shared_lattice(self):
+        left, right = _as_set(_spots("circle(4, -1.5)")), _as_set(_spots("circle(4, 1.5)"))
+        xy = _spots("circle(4, -1.5) | circle(4, 1.5)")
+        assert _as_set(xy) == left | right
+        assert len(xy) == len(left | right)  # overlapping spots are not doubled
+        assert _as_set(_spots("(circle(4, -1.5) + circle(4, 1.5)) - square(0.5)")) == (left | right) - {(0.0, 0.0)}
+
+    def test_hexagonal_lattice(self):
+        xy = _spots("square(6)", hexagonal=True)
+        assert nearest_neighbour_distances(xy) == pytest.approx(0.5)
+        assert np.unique(np.round(xy[:, 1], 6)).tolist() == pytest.approx(np.arange(-6, 7) * 0.5 * np.sqrt(3) / 2)
+
+    @pytest.mark.parametrize("expression", ["square(4) * circle(2)", "circle()", "circle(4, z=1)", "hexagon(3)",
+                                            "square(4, x=1, x=2)", "square(4", "square(4, spacing=0)"])
+    def test_invalid(self, expression):
+        with pytest.raises(ValueError):
+            parse_shape_expression(expression, 0.5)
+
+
+class TestDifferentLattices:
+    def test_union_drops_close_spots(self):
+        xy = _spots("square(4) | square(4, x=1, spacing=0.4, hex=1)")
+        left = _spots("square(4)")
+        assert _as_set(left) <= _as_set(xy)
+        assert nearest_neighbour_distances(xy).min() >= 0.2 - 1e-9
+
+    def test_min_distance(self):
+        coarse = _spots("square(4) | circle(2, spacing=0.3)", min_distance=0.01)
+        fine = _spots("square(4) | circle(2, spacing=0.3)", min_distance=0.3)
+        assert len(coarse) > len(fine) == len(_spots("square(4)"))
+
+    def test_difference_uses_shape_area(self):
+        xy = _spots("square(6, spacing=0.3) - circle(2)")
+        assert np.all(np.hypot(xy[:, 0], xy[:, 1]) > 1.0)
+        assert len(xy) == len(_spots("square(6) - circle(2)", spacing=0.3))
+
+    def test_within_distance_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        points, reference = rng.uniform(-5, 5, (500, 2)), rng.uniform(-5, 5, (300, 2))
+        d = np.hypot(points[:, None, 0] - reference[None, :, 0], points[:, None, 1] - reference[None, :, 1])
+        np.testing.assert_array_equal(within_distance(points, reference, 0.3), d.min(axis=1) < 0.3)
+        assert not within_distance(points, np.empty((0, 2)), 0.3).any()
+
+    def test_lattice_points(self):
+        xy = lattice_points((-0.3, 0.1, 0.6, 1.0), (0.5, False))
+        assert _as_set(xy) == {(0.0, 0.5), (0.0, 1.0), (0.5, 0.5), (0.5, 1.0)}
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationCompose:
+    def test_square_with_hole(self, tmp_path):
+        output = tmp_path / "plan.dcm"
+        assert main(["-o", str(output), "compose", "square(6) - circle(2)", "--xoffset", "1", "--energy", "150", "100",
+                     "--mu-per-spot", "2"]) is None
+        ds = pydicom.dcmread(output)
+        cps = ds.IonBeamSequence[0].IonControlPointSequence
+        assert len(cps) == 4
+        xy = np.asarray(cps[0].ScanSpotPositionMap).reshape(-1, 2) / 10.0  # mm to cm
+        assert len(xy) == len(_spots("square(6) - circle(2)"))
+        assert np.all(np.hypot(xy[:, 0] - 1.0, xy[:, 1]) > 1.0)
+
+    def test_invalid_expression(self, tmp_path):
+        assert main(["-o", str(tmp_path / "plan.dcm"), "compose", "square(6) ** 2"]) == 1
+        assert not (tmp_path / "plan.dcm").exists()
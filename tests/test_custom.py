@@ -0,0 +1,136 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.main import main
+from dicomplan.spots import generate_layers, load_custom_spots
+
+
+def _model(*args):
+    return get_model_from_args(parse_arguments(list(args)))
+
+
+def _grid(n=5, spacing=0.5):
+    """
+    n x n spot map (x, y, weight) centred on the origin.
+    """
+    axis = (np.arange(n) - (n - 1) / 2) * spacing
+    x, y = np.meshgrid(axis, axis, indexing='ij')
+    return np.column_stack([x.ravel(), y.ravel(), np.ones(n * n)])
+
+
+# ---------------------------------------------------------------------------
+# load_custom_spots
+# ---------------------------------------------------------------------------
+
+class TestLoadCustomSpots:
+    def test_plain_npy_is_memory_mapped(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        np.save(path, _grid())
+        x, y, weight, energy = load_custom_spots(str(path))
+        assert isinstance(x, np.memmap)
+        assert len(x) == len(y) == len(weight) == 25
+        assert energy is None
+
+    def test_structured_npy(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        spots = np.zeros(3, dtype=[('x', 'f4'), ('y', 'f4'), ('mu', 'f4'), ('energy', 'f4')])
+        spots['x'] = [1, 2, 3]
+        spots['mu'] = [0.5, 1.0, 1.5]
+        spots['energy'] = [100, 150, 100]
+        np.save(path, spots)
+        x, _, weight, energy = load_custom_spots(str(path))
+        np.testing.assert_allclose(x, [1, 2, 3])
+        np.testing.assert_allclose(weight, [0.5, 1.0, 1.5])
+        np.testing.assert_allclose(energy, [100, 150, 100])
+
+    def test_csv_with_and_without_header(self, tmp_path):
+        plain = tmp_path / "plain.csv"
+        plain.write_text("0.0,0.0,1.0\n1.0,0.5,2.0\n")
+        header = tmp_path / "header.csv"
+        header.write_text("x,y,weight,energy\n0.0,0.0,1.0,120\n1.0,0.5,2.0,120\n")
+        x, y, weight, energy = load_custom_spots(str(plain))
+        assert energy is None
+        np.testing.assert_allclose(y, [0.0, 0.5])
+        x, y, weight, energy = load_custom_spots(str(header))
+        np.testing.assert_allclose(weight, [1.0, 2.0])
+        np.testing.assert_allclose(energy, [120, 120])
+
+    def test_bad_inputs(self, tmp_path):
+        with pytest.raises(ValueError, match="format"):
+            load_custom_spots(str(tmp_path / "spots.txt"))
+        path = tmp_path / "spots.npy"
+        np.save(path, np.zeros((4, 2)))
+        with pytest.raises(ValueError, match="columns"):
+            load_custom_spots(str(path))
+
+
+# ---------------------------------------------------------------------------
+# generate_layers for custom maps
+# ---------------------------------------------------------------------------
+
+class TestCustomLayers:
+    def test_map_used_unchanged(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        np.save(path, _grid())
+        layers = generate_layers(_model("custom", str(path), "--energy", "130"))
+        assert len(layers) == 1
+        energy, coords, weights = layers[0]
+        assert energy == 130.0
+        np.testing.assert_allclose(coords.reshape(-1, 2), _grid()[:, :2])
+        assert weights.dtype == np.float32
+
+    def test_layers_by_energy_column(self, tmp_path):
+        path = tmp_path / "spots.csv"
+        path.write_text("x,y,weight,energy\n0,0,1,100\n1,0,2,200\n2,0,3,100\n3,0,4,150\n")
+        layers = generate_layers(_model("custom", str(path)))
+        assert [energy for energy, _, _ in layers] == [200.0, 150.0, 100.0]
+        np.testing.assert_allclose(layers[2][1], [0, 0, 2, 0])  # map order kept within a layer
+        np.testing.assert_allclose(layers[2][2], [1, 3])
+
+    def test_offset(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        np.save(path, _grid())
+        _, coords, _ = generate_layers(_model("custom", str(path), "--xoffset", "1.0", "--yoffset", "-2.0"))[0]
+        assert coords[0::2].mean() == pytest.approx(1.0)
+        assert coords[1::2].mean() == pytest.approx(-2.0)
+
+    def test_rim_boost(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        np.save(path, _grid())
+        _, _, weights = generate_layers(_model("custom", str(path), "--boost_rim", "2.0"))[0]
+        assert weights.max() == pytest.approx(2.0)
+        assert np.sum(weights == 1.0) == 9  # inner 3 x 3 spots
+
+    def test_map_file_not_modified(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        np.save(path, _grid().astype(np.float32))
+        main(["-o", str(tmp_path / "plan.dcm"), "custom", str(path), "--mu-per-spot", "3", "--boost_rim", "2"])
+        np.testing.assert_array_equal(np.load(path), _grid().astype(np.float32))
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationCustom:
+    def test_custom_plan(self, tmp_path):
+        spots = tmp_path / "spots.npy"
+        np.save(spots, _grid())
+        output = tmp_path / "custom.dcm"
+        assert main(["-o", str(output), "custom", str(spots), "--mu-per-spot", "2", "--energy", "160"]) is None
+        ib = pydicom.dcmread(output).IonBeamSequence[0]
+        cp = ib.IonControlPointSequence[0]
+        assert float(cp.NominalBeamEnergy) == 160.0
+        assert cp.NumberOfScanSpotPositions == 25
+        np.testing.assert_allclose(np.asarray(cp.ScanSpotPositionMap).reshape(-1, 2), _grid()[:, :2] * 10.0)
+        assert float(ib.FinalCumulativeMetersetWeight) == pytest.approx(50.0)
+
+    def test_dose_plot(self, tmp_path):
+        spots = tmp_path / "spots.csv"
+        np.savetxt(spots, _grid(), delimiter=',')
+        plot = tmp_path / "dose.png"
+        main(["--dose_plot", "--dose_plot_filepath", str(plot), "-o", str(tmp_path / "custom.dcm"),
+              "custom", str(spots)])
+        assert plot.is_file()
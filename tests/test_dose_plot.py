@@ -0,0 +1,102 @@
+import numpy as np
+from PIL import Image
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.plot import DOSE_LUT, render_dose_pillow
+
+
+# ---------------------------------------------------------------------------
+# parse_arguments / get_model_from_args - dose plot options
+# ---------------------------------------------------------------------------
+
+class TestDosePlotArguments:
+    def test_renderer_default(self):
+        model = get_model_from_args(parse_arguments(["square", "10", "10"]))
+        assert model.plot_dose_renderer == "pillow"
+        assert model.plot_dose_grid is True
+
+    def test_renderer_matplotlib_no_grid(self):
+        args = parse_arguments(["--dose_plot_renderer", "matplotlib", "--no-dose_plot_grid", "square", "10", "10"])
+        model = get_model_from_args(args)
+        assert model.plot_dose_renderer == "matplotlib"
+        assert model.plot_dose_grid is False
+
+
+# ---------------------------------------------------------------------------
+# Pillow renderer
+# ---------------------------------------------------------------------------
+
+class TestRenderDosePillow:
+    def test_lut_matches_discrete_steps(self):
+        assert DOSE_LUT.shape == (256, 3)
+        assert (DOSE_LUT[0] == DOSE_LUT[12]).all()
+        assert (DOSE_LUT[255] != DOSE_LUT[0]).any()
+
+    def test_grid_painted(self, tmp_path):
+        dose = np.ones((100, 100), dtype=np.float32)
+        fname = tmp_path / "grid.png"
+        render_dose_pillow(str(fname), dose, (-5.0, 5.0, -5.0, 5.0), grid=True)
+        img = np.asarray(Image.open(fname))
+        # 1 cm major lines are black, uniform dose elsewhere keeps the top LUT colour
+        assert (img == 0).all(axis=2).any()
+        assert (img[:, :img.shape[0]] == DOSE_LUT[255]).all(axis=2).any()
+
+    def test_no_grid(self, tmp_path):
+        dose = np.ones((100, 100), dtype=np.float32)
+        fname = tmp_path / "nogrid.png"
+        render_dose_pillow(str(fname), dose, (-5.0, 5.0, -5.0, 5.0), grid=False)
+        img = np.asarray(Image.open(fname))
+        assert (img[:, :img.shape[0]] == DOSE_LUT[255]).all()
+
+
+# ---------------------------------------------------------------------------
+# CLI integration - dose plots
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationDosePlot:
+    def test_pillow_dose_plot(self, tmp_path):
+        from dicomplan.main import main
+        plot = tmp_path / "dose.png"
+        main(["-o", str(tmp_path / "plan.dcm"), "--dose_plot", "--dose_plot_filepath", str(plot),
+              "square", "4", "4", "--spacing", "1.0"])
+        assert plot.exists()
+        assert Image.open(plot).format == "PNG"
+
+    def test_matplotlib_dose_plot(self, tmp_path):
+        from dicomplan.main import main
+        plot = tmp_path / "dose_mpl.png"
+        main(["-o", str(tmp_path / "plan.dcm"), "--dose_plot", "--dose_plot_filepath", str(plot),
+              "--dose_plot_renderer", "matplotlib", "circle", "4", "--spacing", "1.0"])
+        assert plot.exists()
+
+
+# ---------------------------------------------------------------------------
+# Dose grid
+# ---------------------------------------------------------------------------
+
+class TestDoseGrid:
+    def test_default_resolution_from_fwhm(self):
+        from dicomplan.dose import grid_resolution
+        assert grid_resolution([1.0, 0.6]) == 0.06
+        assert grid_resolution([1.0, 0.6], 0.02) == 0.02
+
+    def test_extent_follows_circle_spots(self):
+        from dicomplan.dose import dose_grid
+        from dicomplan.spots import generate_circular_pattern
+        model = get_model_from_args(parse_arguments(["circle", "6", "--xoffset", "2.0"]))
+        coords, weights = generate_circular_pattern(model)
+        x, y, dose = dose_grid(coords, weights, [1.0, 1.0])
+        assert dose.dtype == np.float32
+        assert x[0] < -1.0 and x[-1] > 5.0
+        assert y[0] < -3.0 and y[-1] > 3.0
+
+    def test_matches_direct_sum(self):
+        from dicomplan.dose import dose_grid
+        coords = np.array([0.0, 0.0, 1.0, 0.5])
+        weights = np.array([1.0, 2.0])
+        x, y, dose = dose_grid(coords, weights, [1.0, 0.8], 0.05)
+        X, Y = np.meshgrid(x, y, indexing='ij')
+        s2x, s2y = 1.0 / (4 * np.log(2)), 0.64 / (4 * np.log(2))
+        ref = sum(w * np.exp(-((X - x0)**2 / s2x + (Y - y0)**2 / s2y))
+                  for (x0, y0), w in zip(coords.reshape(-1, 2), weights))
+        assert np.allclose(dose, ref, atol=1e-4)
@@ -0,0 +1,75 @@
+import numpy as np
+import pydicom
+import pytest
+
+import dicomplan.export
+from dicomplan.export import SPOT_DTYPE, export_spots, load_spots
+from dicomplan.main import main
+from dicomplan.model import SpotTable
+
+
+def _layers():
+    return [(200.0, np.array([0.0, 0.0, 1.0, 0.5, -1.0, 2.0], dtype=np.float32), np.array([1.0, 2.0, 3.0], dtype=np.float32)),
+            (150.0, np.array([0.5, -0.5], dtype=np.float32), np.array([4.0], dtype=np.float32))]
+
+
+# ---------------------------------------------------------------------------
+# export_spots
+# ---------------------------------------------------------------------------
+
+class TestExportSpots:
+    @pytest.mark.parametrize("suffix", [".npy", ".npz", ".csv"])
+    def test_round_trip(self, tmp_path, suffix):
+        path = tmp_path / f"spots{suffix}"
+        assert export_spots(str(path), _layers()) == 4
+        spots = load_spots(str(path))
+        assert spots.dtype == SPOT_DTYPE
+        assert spots["layer"].tolist() == [0, 0, 0, 1]
+        assert spots["energy"].tolist() == [200.0, 200.0, 200.0, 150.0]
+        assert spots["x"].tolist() == pytest.approx([0.0, 10.0, -10.0, 5.0])
+        assert spots["y"].tolist() == pytest.approx([0.0, 5.0, 20.0, -5.0])
+        assert spots["mu"].tolist() == [1.0, 2.0, 3.0, 4.0]
+
+    def test_npy_is_memory_mapped(self, tmp_path):
+        path = tmp_path / "spots.npy"
+        export_spots(str(path), _layers())
+        assert isinstance(np.load(path, mmap_mode="r"), np.memmap)
+
+    def test_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(dicomplan.export, "EXPORT_CHUNK", 2)
+        for suffix in (".npy", ".npz", ".csv"):
+            path = tmp_path / f"spots{suffix}"
+            export_spots(str(path), SpotTable.from_layers(_layers()))
+            spots = load_spots(str(path))
+            assert spots["mu"].tolist() == [1.0, 2.0, 3.0, 4.0]
+            # the second chunk spans both layers
+            assert spots["layer"].tolist() == [0, 0, 0, 1]
+            assert spots["energy"].tolist() == [200.0, 200.0, 200.0, 150.0]
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            export_spots(str(tmp_path / "spots.txt"), _layers())
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIExportSpots:
+    def test_export_matches_plan(self, tmp_path):
+        output = tmp_path / "plan.dcm"
+        spots_path = tmp_path / "spots.npy"
+        main(["--export-spots", str(spots_path), "-o", str(output), "square", "4", "4", "--energy", "180", "120"])
+        spots = load_spots(str(spots_path))
+        cps = pydicom.dcmread(output).IonBeamSequence[0].IonControlPointSequence
+        for layer, cp in enumerate(cps[::2]):
+            in_layer = spots[spots["layer"] == layer]
+            assert np.all(in_layer["energy"] == float(cp.NominalBeamEnergy))
+            assert np.column_stack((in_layer["x"], in_layer["y"])).ravel().tolist() == \
+                pytest.approx(list(cp.ScanSpotPositionMap))
+            assert in_layer["mu"].tolist() == pytest.approx(list(cp.ScanSpotMetersetWeights))
+
+    def test_unknown_format_not_written(self, tmp_path):
+        output = tmp_path / "plan.dcm"
+        assert main(["--export_spots", str(tmp_path / "spots.txt"), "-o", str(output), "square", "4", "4"]) == 1
+        assert not output.exists()
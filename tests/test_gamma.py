@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from dicomplan.gamma import gamma_index, load_dose_plane, pass_rate
+from dicomplan.main import main
+
+
+def _plane(shift=0.0, scale=1.0, n=81, resolution=0.05):
+    """
+    Flat 2 cm wide field with sigmoid penumbra along x, shifted by shift [cm].
+    """
+    x = (np.arange(n) - (n - 1) / 2) * resolution
+    y = x.copy()
+    profile = scale / (1 + np.exp((np.abs(x - shift) - 1.0) / 0.1))
+    return x, y, np.repeat(profile[:, None], n, axis=1)
+
+
+def _brute_force_1d(reference, evaluated, dd, dta, step):
+    """
+    Gamma along x of the middle row by an exhaustive search on a fine grid.
+    """
+    x, _, d_r = reference
+    _, _, d_e = evaluated
+    row_r, row_e = d_r[:, len(x) // 2], d_e[:, len(x) // 2]
+    gamma = []
+    for xi, ri in zip(x, row_r):
+        xs = xi + np.arange(-2 * dta, 2 * dta + step / 2, step)
+        xs = xs[(xs >= x[0]) & (xs <= x[-1])]
+        gamma.append(np.sqrt(np.min((xs - xi)**2 / dta**2 + (np.interp(xs, x, row_e) - ri)**2 / dd**2)))
+    return np.array(gamma)
+
+
+# ---------------------------------------------------------------------------
+# gamma_index
+# ---------------------------------------------------------------------------
+
+class TestGammaIndex:
+    def test_identical_planes(self):
+        plane = _plane()
+        gamma = gamma_index(plane, plane)
+        assert np.nanmax(gamma) == pytest.approx(0.0, abs=1e-4)
+        assert pass_rate(gamma) == 100.0
+
+    def test_cutoff(self):
+        x, y, dose = _plane()
+        gamma = gamma_index((x, y, dose), (x, y, dose), cutoff=0.5)
+        assert np.array_equal(np.isnan(gamma), dose < 0.5)
+
+    def test_shift_matches_brute_force(self):
+        reference, evaluated = _plane(), _plane(shift=0.12)
+        gamma = gamma_index(reference, evaluated, dose_criterion=0.03, dta=0.2, subsamples=20)
+        expected = _brute_force_1d(reference, evaluated, 0.03, 0.2, 0.01)
+        row = gamma[:, len(reference[0]) // 2]
+        evaluated_points = ~np.isnan(row)
+        np.testing.assert_allclose(row[evaluated_points], np.minimum(expected, 2.0)[evaluated_points], atol=0.01)
+        # a shift below the DTA passes, a shift of twice the DTA does not
+        assert pass_rate(gamma) == 100.0
+        assert pass_rate(gamma_index(reference, _plane(shift=0.4), dta=0.2)) < 100.0
+
+    def test_sub_voxel_shift_on_coarse_grid(self):
+        # evaluated plane with 5 x coarser pixels than the DTA search step
+        reference = _plane(resolution=0.02, n=201)
+        coarse = _plane(shift=0.05, resolution=0.1, n=41)
+        gamma = gamma_index(reference, coarse, dta=0.1)
+        assert pass_rate(gamma) == 100.0
+
+    def test_local_is_stricter_in_low_dose(self):
+        reference, evaluated = _plane(), _plane(scale=1.02)
+        x, y, dose = evaluated
+        evaluated = (x, y, dose + 0.02 * (dose < 0.5))
+        assert pass_rate(gamma_index(reference, evaluated, dta=0.1)) > \
+            pass_rate(gamma_index(reference, evaluated, dta=0.1, local=True))
+
+    def test_search_radius(self):
+        reference, evaluated = _plane(), _plane(shift=0.08)
+        narrow = gamma_index(reference, evaluated, dta=0.1, search_radius=0.03)
+        wide = gamma_index(reference, evaluated, dta=0.1, search_radius=0.2)
+        # a smaller search area can only miss better matches
+        assert np.all(narrow[~np.isnan(narrow)] >= wide[~np.isnan(wide)] - 1e-5)
+        assert pass_rate(narrow) < pass_rate(wide) == 100.0
+
+    def test_different_grids(self):
+        x, y, dose = _plane()
+        with pytest.raises(ValueError):
+            gamma_index((x, y, dose), (x[::-1], y, dose))
+
+
+# ---------------------------------------------------------------------------
+# dose planes / CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationGamma:
+    def test_plan_against_array(self, tmp_path, capsys):
+        plan = tmp_path / "plan.dcm"
+        main(["-o", str(plan), "square", "4", "4", "--energy", "150"])
+        x, y, dose = load_dose_plane(str(plan), resolution=0.05)
+        np.save(tmp_path / "measured.npy", dose)
+        gamma_map = tmp_path / "gamma.npz"
+
+        assert main(["gamma", str(plan), str(tmp_path / "measured.npy"), "--resolution", "0.05",
+                     "--gamma_map", str(gamma_map), "--min_pass_rate", "95"]) is None
+        assert "100.00 % of" in capsys.readouterr().out
+        with np.load(gamma_map) as data:
+            assert data['gamma'].shape == dose.shape
+
+    def test_min_pass_rate(self, tmp_path):
+        reference, shifted = tmp_path / "a.dcm", tmp_path / "b.dcm"
+        main(["-o", str(reference), "square", "4", "4"])
+        main(["-o", str(shifted), "square", "4", "4", "--xoffset", "0.5"])
+        assert main(["gamma", str(reference), str(shifted), "--gamma_map", str(tmp_path / "gamma.png"),
+                     "--min_pass_rate", "99"]) == 1
+        assert (tmp_path / "gamma.png").is_file()
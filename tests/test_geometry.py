@@ -0,0 +1,94 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import get_model_from_args, parse_arguments
+from dicomplan.export import FRAME_SPOT_DTYPE, export_spots, load_spots
+from dicomplan.geometry import FRAMES, BeamGeometry, geometry_for_model, spot_points
+from dicomplan.main import main
+
+
+# ---------------------------------------------------------------------------
+# BeamGeometry
+# ---------------------------------------------------------------------------
+
+class TestBeamGeometry:
+    def test_gantry_rotation(self):
+        # gantry 90 puts the source at +X of the room, the beam X axis then points down
+        geometry = BeamGeometry(gantry_angle=90.0)
+        assert geometry.source_position(1000.0) == pytest.approx([1000.0, 0.0, 0.0])
+        points = geometry.transform(np.array([[10.0, 20.0, 0.0]]), 'beam', 'room')
+        assert points[0] == pytest.approx([0.0, 20.0, -10.0])
+        assert BeamGeometry(gantry_angle=0.0).source_position(1000.0) == pytest.approx([0.0, 0.0, 1000.0])
+
+    def test_collimator_rotation(self):
+        geometry = BeamGeometry(collimator_angle=90.0)
+        assert geometry.transform(np.array([[10.0, 0.0, 0.0]]), 'beam', 'gantry')[0] == pytest.approx([0.0, 10.0, 0.0])
+
+    def test_couch_and_table(self):
+        # couch 90 turns the table counter-clockwise seen from above, the table top longitudinal axis points to -X
+        geometry = BeamGeometry(couch_angle=90.0, table_position=(-30.0, 100.0, 5.0))
+        room = geometry.transform(np.zeros((1, 3)), 'table', 'room')[0]
+        assert room == pytest.approx([-100.0, 5.0, -30.0])
+        assert geometry.transform(np.array([[0.0, 10.0, 0.0]]), 'support', 'room')[0] == pytest.approx([-10.0, 0.0, 0.0])
+
+    def test_round_trip(self):
+        geometry = BeamGeometry(35.0, 10.0, -20.0, (12.0, -40.0, 7.0))
+        points = np.random.default_rng(0).uniform(-100, 100, (50, 3))
+        for source in FRAMES:
+            for target in FRAMES:
+                there = geometry.transform(points, source, target)
+                np.testing.assert_allclose(geometry.transform(there, target, source), points, atol=1e-9)
+                np.testing.assert_allclose(geometry.matrix(source, target) @ geometry.matrix(target, source),
+                                           np.eye(4), atol=1e-12)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            BeamGeometry().transform(np.zeros((3, 3)), 'beam', 'patient')
+        with pytest.raises(ValueError):
+            BeamGeometry().transform(np.zeros((3, 2)), 'beam', 'room')
+
+    def test_million_points(self):
+        geometry = BeamGeometry(45.0, 0.0, 15.0, (10.0, 20.0, 30.0))
+        coords = np.random.default_rng(1).uniform(-100, 100, 2 * 10**6)
+        points = geometry.transform(spot_points(coords), 'beam', 'table')
+        assert points.shape == (10**6, 3)
+        # reference: the homogeneous matrix applied to every point
+        homogeneous = np.column_stack((spot_points(coords), np.ones(10**6)))
+        np.testing.assert_allclose(points, (homogeneous @ geometry.matrix('beam', 'table').T)[:, :3], atol=1e-9)
+        # rotations keep the distances between points
+        np.testing.assert_allclose(np.linalg.norm(points[1:] - points[:-1], axis=1),
+                                   np.linalg.norm(np.diff(spot_points(coords), axis=0), axis=1))
+
+
+# ---------------------------------------------------------------------------
+# spot export / CLI integration
+# ---------------------------------------------------------------------------
+
+class TestFrameExport:
+    def test_export_in_room_frame(self, tmp_path):
+        layers = [(150.0, np.array([1.0, 2.0, -1.0, 0.0]), np.array([1.0, 2.0], dtype=np.float32))]
+        for suffix in (".npy", ".npz", ".csv"):
+            path = tmp_path / f"spots{suffix}"
+            export_spots(str(path), layers, BeamGeometry(gantry_angle=90.0), 'room')
+            spots = load_spots(str(path))
+            assert spots.dtype == FRAME_SPOT_DTYPE
+            xyz = np.column_stack((spots['x'], spots['y'], spots['z']))
+            np.testing.assert_allclose(xyz, [[0.0, 20.0, -10.0], [0.0, 0.0, 10.0]], atol=1e-5)
+            assert spots['mu'].tolist() == [1.0, 2.0]
+
+    def test_model_geometry(self):
+        model = get_model_from_args(parse_arguments(["-g", "270", "-ca", "15", "-tp", "1,2,3", "square", "2", "2"]))
+        geometry = geometry_for_model(model)
+        assert (geometry.gantry_angle, geometry.couch_angle) == (270.0, 15.0)
+        assert geometry.table_position == [10.0, 20.0, 30.0]
+
+    def test_cli(self, tmp_path):
+        output, spots_path = tmp_path / "plan.dcm", tmp_path / "spots.csv"
+        assert main(["-o", str(output), "-g", "0", "-ca", "90", "--export_spots", str(spots_path),
+                     "--export_frame", "support", "square", "2", "2"]) is None
+        assert float(pydicom.dcmread(output).IonBeamSequence[0].IonControlPointSequence[0].PatientSupportAngle) == 90.0
+        spots = load_spots(str(spots_path))
+        # beam x runs along the room x axis, which is the support -y axis at couch 90
+        assert np.abs(spots['y']).max() == pytest.approx(10.0)
+        np.testing.assert_allclose(spots['z'], 0.0, atol=1e-5)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from dicomplan.config_parser import get_model_from_args, parse_arguments
+from dicomplan.halftone import bayer_matrix, error_diffusion, halftone, ordered_dither
+from dicomplan.spots import generate_layers
+
+
+def _raster_diffusion(levels):
+    """
+    Floyd-Steinberg error diffusion, one pixel at a time in raster order.
+    """
+    work = levels.astype(np.float64).copy()
+    ny, nx = work.shape
+    on = np.zeros((ny, nx), dtype=bool)
+    for y in range(ny):
+        for x in range(nx):
+            on[y, x] = work[y, x] >= 0.5
+            error = work[y, x] - on[y, x]
+            for dy, dx, share in ((0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16)):
+                if y + dy < ny and 0 <= x + dx < nx:
+                    work[y + dy, x + dx] += share * error
+    return on
+
+
+# ---------------------------------------------------------------------------
+# ordered dithering / error diffusion
+# ---------------------------------------------------------------------------
+
+class TestHalftone:
+    def test_bayer_matrix(self):
+        assert bayer_matrix(1).tolist() == [[0, 2], [3, 1]]
+        assert sorted(bayer_matrix(3).ravel().tolist()) == list(range(64))
+
+    @pytest.mark.parametrize("level", [0.0, 0.25, 0.5, 0.8, 1.0])
+    def test_ordered_density(self, level):
+        assert ordered_dither(np.full((16, 24), level)).mean() == pytest.approx(level, abs=1 / 64)
+
+    def test_diffusion_matches_raster_order(self):
+        levels = np.random.default_rng(0).uniform(0, 1, (13, 17))
+        np.testing.assert_array_equal(error_diffusion(levels), _raster_diffusion(levels))
+        np.testing.assert_array_equal(error_diffusion(levels[:1]), _raster_diffusion(levels[:1]))
+        np.testing.assert_array_equal(error_diffusion(levels[:, :1]), _raster_diffusion(levels[:, :1]))
+
+    def test_diffusion_density(self):
+        levels = np.tile(np.linspace(0, 1, 1000), (1000, 1))
+        on = error_diffusion(levels)
+        # the first rows do not depend on the rows below them
+        np.testing.assert_array_equal(on[:20], _raster_diffusion(levels[:20]))
+        assert on.mean() == pytest.approx(0.5, abs=0.01)
+        np.testing.assert_allclose(on[:, 450:550].mean(), 0.5, atol=0.02)
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            halftone(np.zeros((2, 2)), 'stochastic')
+
+
+# ---------------------------------------------------------------------------
+# image patterns
+# ---------------------------------------------------------------------------
+
+class TestHalftoneImage:
+    @pytest.mark.parametrize("mode", ["bayer", "diffusion"])
+    def test_constant_weights(self, tmp_path, mode):
+        from PIL import Image
+        path = tmp_path / "ramp.png"
+        Image.fromarray(np.tile(np.linspace(255, 0, 40).astype(np.uint8), (40, 1))).save(path)
+        model = get_model_from_args(parse_arguments(["image", "20", "20", str(path), "--halftone", mode]))
+        _, coords, weights = generate_layers(model)[0]
+        assert np.all(weights == 1.0)
+        x = coords.reshape(-1, 2)[:, 0]
+        # darker to the right, so the right half holds about three quarters of the spots
+        assert np.mean(x > 0) == pytest.approx(0.75, abs=0.05)
+        assert len(weights) == pytest.approx(800, rel=0.05)
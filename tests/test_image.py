@@ -1,7 +1,11 @@
+import numpy as np
+import pydicom
 import pytest
 from pathlib import Path
+from PIL import Image
 
 from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.spots import generate_layers, image_frame_count
 
 RES_DIR = Path(__file__).parent.parent / "res"
 IMG = RES_DIR / "img.png"
@@ -24,7 +28,7 @@ class TestParseArgumentsImage:
         args = parse_arguments(["image", "10", "10", str(IMG)])
         assert args.spacing == 0.5
         assert args.mu_per_spot == 10.0
-        assert args.energy == 120.0
+        assert args.energy == [120.0]
 
     def test_image_custom_spacing(self):
         args = parse_arguments(["image", "10", "10", str(IMG), "--spacing", "1.0"])
@@ -60,6 +64,57 @@ class TestGetModelFromArgsImage:
         assert model.spot_xymax == pytest.approx([6.0, 7.0])
 
 
+# ---------------------------------------------------------------------------
+# multi-frame images
+# ---------------------------------------------------------------------------
+
+def _stack(path, sizes):
+    """
+    Write frames with a dark grey square of each size [px] on white, 20 x 20 px, as GIF or TIFF.
+    """
+    frames = []
+    for size in sizes:
+        frame = Image.new("L", (20, 20), 255)
+        frame.paste(64, (10 - size // 2, 10 - size // 2, 10 + size // 2, 10 + size // 2))
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+    return str(path)
+
+
+class TestMultiFrameImage:
+    @pytest.mark.parametrize("suffix", [".gif", ".tif"])
+    def test_frame_per_layer(self, tmp_path, suffix):
+        path = _stack(tmp_path / f"stack{suffix}", [4, 8, 12])
+        assert image_frame_count(path) == 3
+        model = get_model_from_args(parse_arguments(["image", "10", "10", path, "--energy_range", "150", "110"]))
+        layers = generate_layers(model)
+        assert [energy for energy, _, _ in layers] == [150.0, 130.0, 110.0]
+        # 10 cm over 20 px at 0.5 cm spacing keeps the image scale, one spot per grey pixel
+        assert [len(w) for _, _, w in layers] == [16, 64, 144]
+
+    def test_energy_per_frame(self, tmp_path):
+        path = _stack(tmp_path / "stack.tif", [4, 8])
+        model = get_model_from_args(parse_arguments(["image", "10", "10", path, "--energy", "140", "120"]))
+        assert [energy for energy, _, _ in generate_layers(model)] == [140.0, 120.0]
+        model = get_model_from_args(parse_arguments(["image", "10", "10", path, "--energy", "140", "120", "100"]))
+        with pytest.raises(ValueError):
+            generate_layers(model)
+
+    def test_single_frame_energies_repeat(self):
+        model = get_model_from_args(parse_arguments(["image", "10", "10", str(IMG), "--energy", "140", "120"]))
+        layers = generate_layers(model)
+        assert np.array_equal(layers[0][1], layers[1][1])
+
+    def test_writes_control_points(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "stack.dcm"
+        main(["-o", str(output), "image", "10", "10", _stack(tmp_path / "stack.gif", [4, 8]),
+              "--energy_range", "150", "100"])
+        cps = pydicom.dcmread(output).IonBeamSequence[0].IonControlPointSequence
+        assert [float(cp.NominalBeamEnergy) for cp in cps[::2]] == [150.0, 100.0]
+        assert [int(cp.NumberOfScanSpotPositions) for cp in cps[::2]] == [16, 64]
+
+
 # ---------------------------------------------------------------------------
 # CLI integration - image pattern writes DICOM
 # ---------------------------------------------------------------------------
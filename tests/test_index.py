@@ -0,0 +1,88 @@
+import os
+import sqlite3
+
+import pytest
+
+from dicomplan.index import query_index, update_index
+from dicomplan.main import main
+
+
+def _write_plan(path, *args):
+    assert main(["-o", str(path), *args]) is None
+    return path
+
+
+@pytest.fixture
+def plans(tmp_path):
+    directory = tmp_path / "plans"
+    (directory / "sub").mkdir(parents=True)
+    _write_plan(directory / "low.dcm", "square", "4", "4", "--energy", "70", "100", "--spacing", "0.2")
+    _write_plan(directory / "sub" / "high.dcm", "-g", "270", "circle", "3", "--energy", "200")
+    return directory
+
+
+# ---------------------------------------------------------------------------
+# update_index
+# ---------------------------------------------------------------------------
+
+class TestUpdateIndex:
+    def test_plans_beams_and_layers(self, tmp_path, plans):
+        db = str(tmp_path / "index.sqlite")
+        assert update_index(db, [str(plans)]) == (2, 0)
+        with sqlite3.connect(db) as con:
+            assert con.execute("SELECT count(*) FROM plans").fetchone() == (2,)
+            energies = con.execute("SELECT energy FROM layers WHERE path LIKE '%low.dcm' ORDER BY layer").fetchall()
+            assert energies == [(70.0,), (100.0,)]
+            assert con.execute("SELECT gantry_angle, machine FROM beams WHERE path LIKE '%high.dcm'").fetchone() \
+                == (270.0, 'tr4')
+            uid, spots = con.execute("SELECT sop_instance_uid, spots FROM plans WHERE path LIKE '%low.dcm'").fetchone()
+            assert uid and spots == 2 * 21 * 21
+
+    def test_incremental(self, tmp_path, plans):
+        db = str(tmp_path / "index.sqlite")
+        update_index(db, [str(plans)], jobs=2)
+        assert update_index(db, [str(plans)]) == (0, 0)
+
+        _write_plan(plans / "low.dcm", "square", "4", "4", "--energy", "150")
+        os.remove(plans / "sub" / "high.dcm")
+        assert update_index(db, [str(plans)]) == (1, 1)
+        rows = query_index(db)
+        assert len(rows) == 1
+        with sqlite3.connect(db) as con:
+            # layers and beams of removed or re-indexed plans are gone
+            assert con.execute("SELECT count(*) FROM layers").fetchone() == (1,)
+            assert con.execute("SELECT count(*) FROM beams").fetchone() == (1,)
+
+    def test_unreadable_file_is_recorded(self, tmp_path, plans):
+        (plans / "broken.dcm").write_bytes(b"not a plan")
+        db = str(tmp_path / "index.sqlite")
+        assert update_index(db, [str(plans)]) == (3, 0)
+        assert len(query_index(db)) == 2
+        assert update_index(db, [str(plans)]) == (0, 0)
+
+
+# ---------------------------------------------------------------------------
+# query_index / CLI
+# ---------------------------------------------------------------------------
+
+class TestQuery:
+    def test_conditions(self, tmp_path, plans):
+        db = str(tmp_path / "index.sqlite")
+        update_index(db, [str(plans)])
+        assert [os.path.basename(row[0]) for row in query_index(db, energy=70.2)] == ["low.dcm"]
+        assert query_index(db, energy=70.0, min_spots=10000) == []
+        assert len(query_index(db, machine="TR4")) == 2
+        assert [os.path.basename(row[0]) for row in query_index(db, gantry_angle=270)] == ["high.dcm"]
+        assert [os.path.basename(row[0]) for row in query_index(db, where="layers > 1")] == ["low.dcm"]
+
+    def test_cli(self, tmp_path, plans, capsys):
+        db = str(tmp_path / "index.sqlite")
+        assert main(["index", str(plans), "--db", db]) is None
+        capsys.readouterr()
+        assert main(["query", "--db", db, "--energy", "200"]) is None
+        out = capsys.readouterr().out
+        assert "high.dcm" in out and "low.dcm" not in out
+        assert main(["query", "--db", db, "--count", "--min_spots", "1"]) is None
+        assert capsys.readouterr().out.strip() == "2"
+        assert main(["query", "--db", db, "--energy", "230"]) == 1
+        assert main(["query", "--db", str(tmp_path / "missing.sqlite")]) == 1
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import pytest
+
+from dicomplan.info import find_plans, format_summary, info_files, plan_summary
+from dicomplan.main import main
+
+PLAN = Path(__file__).parent.parent / "res" / "Plan5.5.dcm"
+
+
+def _write_plan(path, *args):
+    assert main(["-o", str(path), *args]) is None
+    return path
+
+
+# ---------------------------------------------------------------------------
+# plan_summary
+# ---------------------------------------------------------------------------
+
+class TestPlanSummary:
+    def test_generated_plan(self, tmp_path):
+        path = _write_plan(tmp_path / "plan.dcm", "-pl", "Info", "square", "2", "2", "--spacing", "0.5",
+                           "--mu-per-spot", "5", "--energy", "150")
+        summary = plan_summary(str(path))
+        assert summary['label'] == "Info"
+        beam, = summary['beams']
+        assert beam['control_points'] == 2
+        assert beam['layers'] == [{'energy': 150.0, 'spots': 25, 'mu': pytest.approx(125.0),
+                                   'bbox': pytest.approx([-10.0, -10.0, 10.0, 10.0])}]
+        assert beam['spots'] == 25
+        assert beam['mu'] == pytest.approx(125.0)
+        assert beam['bbox'] == pytest.approx([-10.0, -10.0, 10.0, 10.0])
+
+    def test_layers_and_repaint(self, tmp_path):
+        path = _write_plan(tmp_path / "plan.dcm", "--repaint", "2", "square", "2", "2", "--spacing", "0.5",
+                           "--mu-per-spot", "10", "--energy", "200", "150")
+        beam, = plan_summary(str(path))['beams']
+        assert [layer['energy'] for layer in beam['layers']] == [200.0, 150.0]
+        # both paintings of a layer count
+        assert [layer['spots'] for layer in beam['layers']] == [50, 50]
+        assert beam['mu'] == pytest.approx(500.0)
+
+    def test_clinical_plan(self):
+        summary = plan_summary(str(PLAN), tags=['StudyInstanceUID'], bbox=False)
+        beam, = summary['beams']
+        assert len(beam['layers']) == 8
+        assert sum(layer['mu'] for layer in beam['layers']) == pytest.approx(beam['mu'], rel=1e-6)
+        assert 'bbox' not in beam
+        assert summary['tags']['StudyInstanceUID'].startswith("1.2.246")
+
+    def test_unreadable_file(self, tmp_path):
+        path = tmp_path / "broken.dcm"
+        path.write_bytes(b"not a dicom file")
+        summary = plan_summary(str(path))
+        assert 'error' in summary
+        assert "ERROR" in format_summary(summary)
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationInfo:
+    def test_directories_in_parallel(self, tmp_path, capsys):
+        plans = tmp_path / "plans"
+        (plans / "sub").mkdir(parents=True)
+        _write_plan(plans / "b.dcm", "circle", "3")
+        _write_plan(plans / "sub" / "a.dcm", "square", "3", "3")
+        (plans / "notes.txt").write_text("not a plan")
+        assert find_plans([str(plans)]) == [str(plans / "b.dcm"), str(plans / "sub" / "a.dcm")]
+
+        assert main(["info", str(plans), str(PLAN), "-j", "2", "--layers"]) == 0
+        out = capsys.readouterr().out
+        # results are printed in input order
+        assert out.index("b.dcm") < out.index("a.dcm") < out.index("Plan5.5.dcm")
+        assert "8 layers, 106.483-83.383 MeV, 784 spots, 38433.96 MU" in out
+        assert "layer 8: 83.383 MeV" in out
+
+    def test_dump_is_compact(self, tmp_path, capsys):
+        path = _write_plan(tmp_path / "plan.dcm", "square", "10", "10", "--spacing", "0.2")
+        assert info_files([str(path)], dump=True) == 0
+        out = capsys.readouterr().out
+        assert "Scan Spot Position Map" in out
+        assert "Array of" in out
+
+    def test_missing_file(self, tmp_path, capsys):
+        assert main(["info", str(tmp_path / "missing.dcm")]) == 1
+        assert "cannot read plan" in capsys.readouterr().out
@@ -0,0 +1,119 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.main import main
+from dicomplan import spots
+from dicomplan.spots import generate_layers, layer_spacing, pattern_blocks, rim_mask
+
+
+def _model(*args):
+    return get_model_from_args(parse_arguments(list(args)))
+
+
+# ---------------------------------------------------------------------------
+# layer_spacing / generate_layers
+# ---------------------------------------------------------------------------
+
+class TestLayerSpacing:
+    def test_fixed_spacing(self):
+        assert layer_spacing(_model("square", "10", "10", "--spacing", "0.4"), 200.0) == 0.4
+
+    def test_spacing_follows_spot_size(self):
+        model = _model("square", "10", "10", "--spacing_sigma", "1.0")
+        low, high = layer_spacing(model, 70.0), layer_spacing(model, 230.0)
+        assert low > high
+        # 11.3 mm FWHM at 100 MeV, sigma 0.48 cm
+        assert layer_spacing(model, 100.0) == pytest.approx(0.48, abs=0.01)
+
+
+class TestGenerateLayers:
+    def test_single_energy_unchanged(self):
+        layers = generate_layers(_model("square", "4", "4", "--energy", "150"))
+        assert len(layers) == 1
+        assert layers[0][0] == 150.0
+        assert len(layers[0][2]) == 81
+
+    def test_one_layer_per_energy(self):
+        layers = generate_layers(_model("circle", "6", "--energy", "200", "150", "100", "--spacing_sigma", "1.0"))
+        assert [energy for energy, _, _ in layers] == [200.0, 150.0, 100.0]
+        nspots = [len(weights) for _, _, weights in layers]
+        assert nspots[0] > nspots[1] > nspots[2]
+
+    def test_lattice_shared_between_layers(self):
+        layers = generate_layers(_model("square", "6", "6", "--energy", "200", "201", "--spacing_sigma", "1.0"))
+        (_, coords_a, weights_a), (_, coords_b, weights_b) = layers
+        assert coords_a is coords_b
+        assert weights_a is not weights_b
+
+    def test_fewer_spots_than_fixed_spacing(self):
+        energies = ["230", "190", "150", "110", "70"]
+        model = _model("square", "10", "10", "--energy", *energies, "--spacing_sigma", "1.0")
+        fixed = _model("square", "10", "10", "--energy", *energies,
+                       "--spacing", str(layer_spacing(model, 230.0)))
+        assert sum(len(w) for _, _, w in generate_layers(model)) < sum(len(w) for _, _, w in generate_layers(fixed))
+
+
+# ---------------------------------------------------------------------------
+# pattern_blocks
+# ---------------------------------------------------------------------------
+
+class TestPatternBlocks:
+    CASES = [("square", "6", "4", "--boost_rim", "2", "--trim_corners"),
+             ("square", "6", "4", "--hex", "--boost_rim", "1.5", "--trim_corners"),
+             ("circle", "5", "--spacing", "0.3", "--boost_rim", "2", "--xoffset", "0.1")]
+
+    @pytest.mark.parametrize("args", CASES)
+    def test_small_blocks_give_same_pattern(self, monkeypatch, args):
+        _, coords, weights = generate_layers(_model(*args))[0]
+        monkeypatch.setattr(spots, "PATTERN_BLOCK", 30)
+        blocks = list(pattern_blocks(_model(*args)))
+        assert len(blocks) > 3
+        assert max(len(xy) for xy, _ in blocks) <= 30
+        np.testing.assert_array_equal(np.concatenate([xy for xy, _ in blocks]).ravel(), coords)
+        np.testing.assert_array_equal(np.concatenate([w for _, w in blocks]), weights)
+
+    @pytest.mark.parametrize("args", CASES)
+    def test_rim_boost_matches_rim_mask(self, monkeypatch, args):
+        monkeypatch.setattr(spots, "PATTERN_BLOCK", 30)
+        _, coords, weights = generate_layers(_model(*args))[0]
+        boost = float(args[args.index("--boost_rim") + 1])
+        np.testing.assert_array_equal(weights == boost, rim_mask(coords))
+
+    def test_rim_tolerates_float_noise(self):
+        # a 5 x 4 lattice whose columns drift by float noise, fed in blocks that split the columns
+        x, y = np.meshgrid(np.arange(5) * 0.7, np.arange(4) * 0.5, indexing='ij')
+        xy = np.column_stack((x.ravel(), y.ravel()))
+        xy += np.random.default_rng(0).uniform(-1e-9, 1e-9, xy.shape)
+        expected = np.ones((5, 4), dtype=bool)
+        expected[1:-1, 1:-1] = False
+        np.testing.assert_array_equal(rim_mask(xy), expected.ravel())
+        columns = spots._rim_columns(*spots._column_extents((xy[i:i + 3], None) for i in range(0, len(xy), 3)))
+        np.testing.assert_array_equal(spots._rim_spots(xy, columns), expected.ravel())
+
+    def test_large_field(self):
+        blocks = pattern_blocks(_model("square", "40", "40", "--spacing", "0.1"))
+        assert sum(len(w) for _, w in blocks) == 401 * 401
+
+    def test_other_shapes(self):
+        with pytest.raises(ValueError):
+            list(pattern_blocks(_model("compose", "square(2)")))
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationLayers:
+    def test_control_point_pair_per_layer(self, tmp_path):
+        output = tmp_path / "layers.dcm"
+        main(["-o", str(output), "square", "4", "4", "--energy", "180", "120", "--spacing_sigma", "1.2"])
+        ib = pydicom.dcmread(output).IonBeamSequence[0]
+        assert ib.NumberOfControlPoints == 4
+        cps = ib.IonControlPointSequence
+        assert [float(cp.NominalBeamEnergy) for cp in cps] == [180.0, 180.0, 120.0, 120.0]
+        assert cps[0].NumberOfScanSpotPositions > cps[2].NumberOfScanSpotPositions
+        spacing = np.diff(np.unique(np.asarray(cps[0].ScanSpotPositionMap)[0::2]))
+        assert spacing.min() == pytest.approx(10.0 * layer_spacing(
+            _model("square", "4", "4", "--spacing_sigma", "1.2"), 180.0), abs=1e-3)
@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.machine import load_machine, dose_fwhm
+
+
+# ---------------------------------------------------------------------------
+# load_machine
+# ---------------------------------------------------------------------------
+
+class TestLoadMachine:
+    def test_default_profile_cached(self):
+        assert load_machine("tr4") is load_machine("tr4")
+
+    def test_spot_fwhm_interpolation(self):
+        machine = load_machine("tr4")
+        assert machine.spot_fwhm(100.0).tolist() == pytest.approx([11.3, 11.2])
+        sizes = machine.spot_fwhm(np.array([70.0, 85.0, 244.0]))
+        assert sizes.shape == (3, 2)
+        assert sizes[0, 0] > sizes[1, 0] > sizes[2, 0]
+
+    def test_range_increases_with_energy(self):
+        ranges = load_machine("tr4").range([70.0, 150.0, 230.0])
+        assert (np.diff(ranges) > 0).all()
+
+    def test_unknown_machine_falls_back(self):
+        assert load_machine("no_such_machine") is load_machine("tr4")
+
+    def test_json_profile(self, tmp_path):
+        profile = tmp_path / "mymachine.json"
+        profile.write_text(json.dumps({
+            "name": "MyMachine",
+            "limits": {"mu_min": 0.5},
+            "beam_model": {"energy": [100.0, 200.0], "spot_fwhm_x": [10.0, 6.0], "spot_fwhm_y": [9.0, 5.0]},
+        }))
+        machine = load_machine(str(profile))
+        assert machine.name == "MyMachine"
+        assert machine.limit("mu_min") == 0.5
+        assert machine.spot_fwhm(150.0).tolist() == pytest.approx([8.0, 7.0])
+
+    def test_mismatched_table(self, tmp_path):
+        profile = tmp_path / "broken.toml"
+        profile.write_text("[beam_model]\nenergy = [100.0, 200.0]\nspot_fwhm_x = [10.0]\n")
+        with pytest.raises(ValueError):
+            load_machine(str(profile))
+
+
+# ---------------------------------------------------------------------------
+# get_model_from_args - machine selection
+# ---------------------------------------------------------------------------
+
+class TestMachineArguments:
+    def test_dose_fwhm_follows_beam_model(self):
+        model = get_model_from_args(parse_arguments(["square", "10", "10", "--energy", "100"]))
+        assert model.plot_dose_fwhm is None
+        assert dose_fwhm(model, 100.0) == pytest.approx([1.13, 1.12])
+
+    def test_dose_fwhm_override(self):
+        model = get_model_from_args(parse_arguments(["--dose_plot_fwhm", "0.8,0.6", "square", "10", "10"]))
+        assert dose_fwhm(model, 100.0) == [0.8, 0.6]
+
+    def test_profile_file_sets_machine_name(self, tmp_path):
+        profile = tmp_path / "room2.toml"
+        profile.write_text('name = "ROOM2"\n[beam_model]\nenergy = [70.0, 240.0]\n'
+                           'spot_fwhm_x = [12.0, 6.0]\nspot_fwhm_y = [12.0, 6.0]\n')
+        model = get_model_from_args(parse_arguments(["-tm", str(profile), "square", "10", "10"]))
+        assert model.field_treatment_machine == "ROOM2"
+        assert model.field_machine_profile == str(profile)
+
+
+# ---------------------------------------------------------------------------
+# CLI integration - beam model in the written plan
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationMachine:
+    def test_spot_size_follows_energy(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "machine.dcm"
+        main(["-o", str(output), "square", "4", "4", "--energy", "200"])
+        ds = pydicom.dcmread(output)
+        ib = ds.IonBeamSequence[0]
+        assert list(ib.VirtualSourceAxisDistances) == [2000.0, 2560.0]
+        for cp in ib.IonControlPointSequence:
+            assert list(cp.ScanningSpotSize) == pytest.approx([7.1, 7.0])
+            assert cp.ScanSpotTuneID == "4.0"
@@ -0,0 +1,86 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from dicomplan.config_parser import get_model_from_args, parse_arguments
+from dicomplan.dicom import Dicom
+from dicomplan.model import PlanInputModel, SpotTable
+
+
+def _model():
+    return get_model_from_args(parse_arguments(["--repaint", "2", "circle", "4", "--energy", "150", "120"]))
+
+
+# ---------------------------------------------------------------------------
+# PlanInputModel
+# ---------------------------------------------------------------------------
+
+class TestPlanInputModel:
+    def test_fixed_fields(self):
+        model = _model()
+        with pytest.raises(AttributeError):
+            model.spot_spaceing = 0.3
+        assert not hasattr(model, '__dict__')
+        assert list(model.fields()) == list(PlanInputModel.__slots__)
+
+    def test_pickle_and_copy(self):
+        model = _model()
+        for clone in (pickle.loads(pickle.dumps(model)), copy.deepcopy(model), copy.copy(model)):
+            assert clone.fields() == model.fields()
+            assert clone.canonical() == model.canonical()
+        clone = copy.deepcopy(model)
+        clone.spot_energies.append(100.0)
+        assert model.spot_energies == [150.0, 120.0]
+
+
+# ---------------------------------------------------------------------------
+# SpotTable
+# ---------------------------------------------------------------------------
+
+class TestSpotTable:
+    LAYERS = [(150.0, np.array([0.0, 1.0, 2.0, 3.0]), np.array([1.0, 2.0], dtype=np.float32)),
+              (120.0, np.array([], dtype=np.float64), np.array([], dtype=np.float32)),
+              (100.0, np.array([-1.0, -2.0]), np.array([3.0], dtype=np.float32))]
+
+    def test_columns(self):
+        table = SpotTable.from_layers(self.LAYERS)
+        assert len(table) == 3 and table.nspots == 3
+        assert table.xy.dtype == np.float32 and table.xy.flags['C_CONTIGUOUS']
+        assert table.layer.tolist() == [0, 0, 2]
+        assert table.weight.tolist() == [1.0, 2.0, 3.0]
+
+    def test_layers_are_views(self):
+        table = SpotTable.from_layers(self.LAYERS)
+        for (energy, coords, weights), (e, c, w) in zip(table, self.LAYERS):
+            assert energy == e and coords.tolist() == c.tolist() and weights.tolist() == w.tolist()
+            assert len(coords) == 0 or np.shares_memory(coords, table.xy)
+        energy, coords, weights = table[-1]
+        assert energy == 100.0 and np.shares_memory(weights, table.weight)
+        with pytest.raises(IndexError):
+            table[3]
+        with pytest.raises(TypeError):
+            table[0:1]
+
+    def test_of(self):
+        table = SpotTable.from_layers(self.LAYERS)
+        assert SpotTable.of(table) is table
+        assert SpotTable.of(self.LAYERS).bounds.tolist() == table.bounds.tolist()
+
+    def test_pickle(self):
+        table = pickle.loads(pickle.dumps(SpotTable.from_layers(self.LAYERS)))
+        assert table.bounds.tolist() == [0, 2, 2, 3]
+
+    def test_mismatched_columns(self):
+        with pytest.raises(ValueError):
+            SpotTable(np.zeros((2, 2)), np.zeros(3), [150.0], [0, 3])
+
+    def test_plan_layers(self):
+        d = Dicom()
+        d.apply_model(_model())
+        assert isinstance(d.layers, SpotTable)
+        assert [energy for energy, _, _ in d.layers] == [150.0, 150.0, 120.0, 120.0]
+        cps = d.ds.IonBeamSequence[0].IonControlPointSequence
+        assert len(cps) == 2 * len(d.layers)
+        assert int(cps[0].NumberOfScanSpotPositions) == d.layers.bounds[1]
@@ -0,0 +1,100 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan import export, montecarlo
+from dicomplan.machine import load_machine
+from dicomplan.main import main
+from dicomplan.montecarlo import export_mc
+from dicomplan.reader import plan_layers
+
+
+def _layers():
+    xy = np.array([[-1.0, 0.0], [1.0, 0.5], [0.0, -2.0]])
+    return [(150.0, xy.ravel(), np.array([1.0, 2.0, 3.0], dtype=np.float32)),
+            (100.0, xy[:2].ravel(), np.array([4.0, 5.0], dtype=np.float32))]
+
+
+def _topas_parameters(path):
+    parameters = {}
+    for line in path.read_text().splitlines():
+        if not line.startswith('#'):
+            name, value = line.split(' = ')
+            parameters[name] = value
+    return parameters
+
+
+# ---------------------------------------------------------------------------
+# export_mc
+# ---------------------------------------------------------------------------
+
+class TestExportMC:
+    def test_shieldhit(self, tmp_path):
+        path = tmp_path / "sobp.dat"
+        assert export_mc(str(path), _layers(), load_machine()) == 5
+        rows = np.loadtxt(path)
+        assert rows.shape == (5, 6)
+        np.testing.assert_allclose(rows[:, 0], [0.15, 0.15, 0.15, 0.1, 0.1])  # GeV
+        np.testing.assert_allclose(rows[:3, 1:3], [[-1.0, 0.0], [1.0, 0.5], [0.0, -2.0]])  # cm
+        np.testing.assert_allclose(rows[0, 3:5], [0.86, 0.85])  # beam model FWHM at 150 MeV, cm
+        # MU times the particles per MU at 150 and 100 MeV
+        np.testing.assert_allclose(rows[:, 5], [8.6e7, 1.72e8, 2.58e8, 2.6e8, 3.25e8], rtol=1e-6)
+
+    def test_topas(self, tmp_path):
+        path = tmp_path / "beam.txt"
+        export_mc(str(path), _layers(), load_machine(), histories=1000)
+        parameters = _topas_parameters(path)
+        assert parameters['i:Tc/NumberOfSequentialTimes'] == "5"
+        assert parameters['dv:Tf/SpotEnergy/Times'].split() == ["5", "1", "2", "3", "4", "5", "ms"]
+        assert parameters['dv:Tf/SpotX/Times'] == "Tf/SpotEnergy/Times ms"
+        values = parameters['dv:Tf/SpotY/Values'].split()
+        assert values[0] == "5" and values[-1] == "mm"
+        np.testing.assert_allclose(np.array(values[1:-1], dtype=float), [0.0, 5.0, -20.0, 0.0, 5.0])
+        sigma = float(parameters['dv:Tf/SpotSigmaX/Values'].split()[1])
+        assert sigma == pytest.approx(8.6 / 2.3548, abs=1e-3)
+        histories = np.array(parameters['iv:Tf/SpotHistories/Values'].split()[1:], dtype=int)
+        assert histories.sum() == pytest.approx(1000, abs=3)
+        assert parameters['d:So/Beam/BeamEnergy'] == "Tf/SpotEnergy/Value MeV"
+
+    def test_streamed_in_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(export, 'EXPORT_CHUNK', 2)
+        monkeypatch.setattr(montecarlo, 'EXPORT_CHUNK', 2)
+        path = tmp_path / "beam.txt"
+        export_mc(str(path), _layers(), load_machine())
+        parameters = _topas_parameters(path)
+        assert len(parameters['dv:Tf/SpotEnergy/Times'].split()) == 7
+        assert len(parameters['dv:Tf/SpotSigmaY/Values'].split()) == 7
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            export_mc(str(tmp_path / "beam.xyz"), _layers(), load_machine())
+        with pytest.raises(ValueError):
+            export_mc(str(tmp_path / "beam.dat"), _layers(), load_machine(), fmt="fluka")
+
+
+# ---------------------------------------------------------------------------
+# plan_layers / CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationMC:
+    def test_plan_layers(self, tmp_path):
+        plan = tmp_path / "plan.dcm"
+        main(["-o", str(plan), "square", "2", "2", "--energy", "150", "100", "--mu-per-spot", "3"])
+        layers = plan_layers(pydicom.dcmread(plan))
+        assert [energy for energy, _, _ in layers] == [150.0, 100.0]
+        assert np.allclose(layers[0][2], 3.0)
+        assert layers[0][1].reshape(-1, 2).min() == pytest.approx(-1.0)  # cm
+
+    def test_export_from_build_matches_read_plan(self, tmp_path):
+        plan, built, read = tmp_path / "plan.dcm", tmp_path / "built.dat", tmp_path / "read.dat"
+        assert main(["-o", str(plan), "--export_mc", str(built), "circle", "3", "--energy", "120",
+                     "--mu-per-spot", "2"]) is None
+        assert main(["export-mc", str(plan), str(read)]) is None
+        np.testing.assert_allclose(np.loadtxt(built), np.loadtxt(read), rtol=1e-5)
+
+    def test_format_option(self, tmp_path):
+        plan, source = tmp_path / "plan.dcm", tmp_path / "beam.mc"
+        main(["-o", str(plan), "square", "2", "2"])
+        assert main(["export-mc", str(plan), str(source), "--format", "topas", "--histories", "500"]) is None
+        assert "i:Tc/NumberOfSequentialTimes = 25" in source.read_text()
+        assert main(["export-mc", str(plan), str(source), "--beam", "7"]) == 1
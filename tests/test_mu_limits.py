@@ -0,0 +1,161 @@
+import numpy as np
+import pydicom
+import pytest
+from pathlib import Path
+
+from dicomplan.dose import layered_dose_grid
+from dicomplan.model import SpotTable
+from dicomplan.mu_limits import enforce_mu_limits, apply_mu_limits
+
+RES_IMG = Path(__file__).parent.parent / "res" / "img.png"
+
+COORDS = np.array([0.0, 0.0, 1.0, 0.0, 2.0, 0.0, 3.0, 0.0])
+MU = np.array([10.0, 0.2, 0.8, 9.0])
+
+
+# ---------------------------------------------------------------------------
+# enforce_mu_limits
+# ---------------------------------------------------------------------------
+
+class TestEnforceMuLimits:
+    def test_drop_conserves_total(self):
+        coords, mu, stats = enforce_mu_limits(COORDS, MU, mu_min=1.0, policy='drop')
+        assert stats['dropped'] == 2
+        assert coords.tolist() == [0.0, 0.0, 3.0, 0.0]
+        assert mu.sum() == pytest.approx(MU.sum())
+        assert (mu >= 1.0).all()
+
+    def test_merge_into_nearest(self):
+        coords, mu, stats = enforce_mu_limits(COORDS, MU, mu_min=1.0, policy='merge')
+        assert stats['merged'] == 2
+        assert mu.tolist() == pytest.approx([10.2, 9.8])
+
+    def test_merge_at_image_scale(self):
+        # 200k spots on a 1 mm lattice, 20k of them below the minimum
+        rng = np.random.default_rng(0)
+        axis = np.arange(448) * 0.1
+        xy = np.stack(np.meshgrid(axis, axis), axis=-1).reshape(-1, 2)[:200000]
+        mu_in = rng.uniform(1.0, 5.0, len(xy))
+        low = rng.choice(len(xy), 20000, replace=False)
+        mu_in[low] = 0.3
+        coords, mu, stats = enforce_mu_limits(xy.ravel(), mu_in, mu_min=1.0, policy='merge')
+        assert stats['merged'] == 20000 and len(mu) == 180000
+        assert mu.sum() == pytest.approx(mu_in.sum())
+        # the MU of a sample of low spots went to the nearest kept spot, the first of equally near ones
+        kept = np.setdiff1d(np.arange(len(xy)), low)
+        sample = low[:200]
+        d2 = ((xy[sample, None, :] - xy[None, kept, :])**2).sum(axis=2)
+        gained = stats['mu'] - mu_in
+        assert np.all(gained[kept[np.argmin(d2, axis=1)]] > 0)
+
+    def test_round(self):
+        coords, mu, stats = enforce_mu_limits(COORDS, MU, mu_min=1.0, policy='round')
+        assert stats['rounded'] == 1
+        assert stats['dropped'] == 1
+        assert len(mu) == 3
+        assert mu.sum() == pytest.approx(MU.sum())
+        assert (mu >= 1.0).all()
+
+    def test_rescale_down_conserves_total(self):
+        # rounding 0.6 up to 1.0 scales the other spots down, two of them to the minimum
+        mu_in = np.array([0.6, 1.05, 1.05, 3.0])
+        _, mu, stats = enforce_mu_limits(np.zeros(8), mu_in, mu_min=1.0, policy='round')
+        assert mu.sum() == pytest.approx(mu_in.sum())
+        assert mu.tolist() == pytest.approx([1.0, 1.0, 1.0, 2.7])
+        assert stats['residual'] == pytest.approx(0.0)
+
+    def test_residual_when_limits_prevent_conservation(self):
+        mu_in = np.array([0.6, 1.05, 1.05, 1.05])
+        _, mu, stats = enforce_mu_limits(np.zeros(8), mu_in, mu_min=1.0, policy='round')
+        assert mu.tolist() == pytest.approx([1.0] * 4)
+        assert stats['residual'] == pytest.approx(0.25)
+
+    def test_rescale_up_respects_maximum(self):
+        mu_in = np.array([0.5, 1.9, 1.9, 1.0])
+        _, mu, stats = enforce_mu_limits(np.zeros(8), mu_in, mu_min=1.0, policy='drop', mu_max=2.0,
+                                         mu_resolution=0.1)
+        assert (mu <= 2.0 + 1e-9).all()
+        assert mu.sum() == pytest.approx(mu_in.sum())
+        assert mu.tolist() == pytest.approx([2.0, 2.0, 1.3])
+
+    def test_resolution_largest_remainder(self):
+        mu_in = np.array([1.26, 1.26, 1.26, 1.22])
+        _, mu, _ = enforce_mu_limits(np.zeros(8), mu_in, mu_resolution=0.1)
+        assert np.allclose(mu / 0.1, np.round(mu / 0.1))
+        assert mu.sum() == pytest.approx(5.0)
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            enforce_mu_limits(COORDS, MU, mu_min=1.0, policy='ignore')
+
+    def test_all_below_minimum(self):
+        with pytest.raises(ValueError):
+            enforce_mu_limits(COORDS, MU, mu_min=100.0)
+
+
+# ---------------------------------------------------------------------------
+# apply_mu_limits
+# ---------------------------------------------------------------------------
+
+class TestApplyMuLimits:
+    def test_no_limits_is_identity(self):
+        layers = SpotTable.from_layers([(100.0, COORDS, MU)])
+        new_layers, report = apply_mu_limits(layers)
+        assert new_layers is layers
+        assert report == {}
+
+    def test_report_dose_impact(self):
+        new_layers, report = apply_mu_limits([(100.0, COORDS, MU)], mu_min=1.0, fwhms=[[1.0, 1.0]])
+        assert report['spots_before'] == 4
+        assert report['spots_after'] == 2
+        assert report['mu_after'] == pytest.approx(report['mu_before'])
+        assert report['max_dose_change_percent'] > 0
+
+
+    def test_dose_impact_uses_layer_fwhm(self):
+        layers = [(200.0, COORDS, np.array([10.0, 9.0, 8.0, 9.0])), (100.0, COORDS + 0.5, MU)]
+        fwhms = [[0.4, 0.4], [1.5, 1.5]]
+        _, report = apply_mu_limits(layers, mu_min=1.0, fwhms=fwhms)
+        resolution = 0.25 * 0.4
+        _, _, before = layered_dose_grid([(c, mu) for _, c, mu in layers], fwhms, resolution)
+        after_mu = [enforce_mu_limits(c, mu, mu_min=1.0)[2]['mu'] for _, c, mu in layers]
+        _, _, after = layered_dose_grid([(c, mu) for (_, c, _), mu in zip(layers, after_mu)], fwhms, resolution)
+        expected = 100.0 * np.max(np.abs(after - before)) / np.max(before)
+        assert report['max_dose_change_percent'] == pytest.approx(expected, rel=1e-4)
+        _, single = apply_mu_limits(layers, mu_min=1.0, fwhms=[[0.4, 0.4]] * 2)
+        assert single['max_dose_change_percent'] != pytest.approx(expected, rel=1e-2)
+
+
+# ---------------------------------------------------------------------------
+# CLI integration - image pattern with machine MU limits
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationMuLimits:
+    def test_image_min_mu(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "image_limits.dcm"
+        main(["-o", str(output), "--min_mu_per_spot", "2.0", "--mu_resolution", "0.1", "--low_mu_policy", "merge",
+              "image", "10", "10", str(RES_IMG), "--mu-per-spot", "5"])
+        ds = pydicom.dcmread(output)
+        ib = ds.IonBeamSequence[0]
+        weights = np.array(ib.IonControlPointSequence[0].ScanSpotMetersetWeights)
+        assert weights.min() >= 2.0 - 1e-4
+        assert np.allclose(weights * 10, np.round(weights * 10), atol=1e-3)
+        assert float(ib.FinalCumulativeMetersetWeight) == pytest.approx(weights.sum(), rel=1e-6)
+
+    def test_machine_limits_are_opt_in(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "default.dcm"
+        assert main(["-o", str(output), "square", "10", "10", "--mu-per-spot", "0.5"]) is None
+        weights = pydicom.dcmread(output).IonBeamSequence[0].IonControlPointSequence[0].ScanSpotMetersetWeights
+        assert np.allclose(weights, 0.5)
+
+        output = tmp_path / "tr4.dcm"
+        assert main(["-o", str(output), "-tm", "tr4", "square", "10", "10", "--mu-per-spot", "0.5"]) == 1
+        assert not output.exists()
+
+    def test_all_below_minimum_fails(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "low.dcm"
+        assert main(["-o", str(output), "--min_mu_per_spot", "1", "square", "10", "10", "--mu-per-spot", "0.5"]) == 1
+        assert not output.exists()
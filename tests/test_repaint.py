@@ -0,0 +1,139 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.model import SpotTable
+from dicomplan.repaint import painting_counts, split_paintings, paint_layers, split_layers
+
+
+# ---------------------------------------------------------------------------
+# painting_counts / split_paintings
+# ---------------------------------------------------------------------------
+
+class TestSplitPaintings:
+    def test_counts_nominal(self):
+        counts = painting_counts(np.array([10.0, 20.0]), paintings=4)
+        assert counts.tolist() == [4, 4]
+
+    def test_counts_min_mu(self):
+        # 3 MU at 1 MU minimum can only be painted three times, 0.5 MU still once
+        counts = painting_counts(np.array([10.0, 3.0, 0.5]), paintings=4, mu_min=1.0)
+        assert counts.tolist() == [4, 3, 1]
+
+    def test_counts_max_mu(self):
+        counts = painting_counts(np.array([10.0, 50.0]), paintings=2, mu_max=10.0)
+        assert counts.tolist() == [2, 5]
+
+    def test_invalid_paintings(self):
+        with pytest.raises(ValueError):
+            painting_counts(np.array([1.0]), paintings=0)
+
+    def test_split_conserves_mu_and_order(self):
+        coords = np.array([0.0, 0.0, 1.0, 0.0, 2.0, 0.0])
+        mu = np.array([4.0, 1.0, 2.0], dtype=np.float32)
+        counts = np.array([2, 1, 2])
+        paintings = split_paintings(coords, mu, counts)
+        assert len(paintings) == 2
+        assert paintings[0][0].tolist() == [0.0, 0.0, 1.0, 0.0, 2.0, 0.0]
+        assert paintings[0][1].tolist() == [2.0, 1.0, 1.0]
+        assert paintings[1][0].tolist() == [0.0, 0.0, 2.0, 0.0]
+        assert sum(w.sum() for _, w in paintings) == pytest.approx(mu.sum())
+
+
+# ---------------------------------------------------------------------------
+# paint_layers
+# ---------------------------------------------------------------------------
+
+class TestPaintLayers:
+    LAYERS = [(70.0, np.array([0.0, 0.0, 1.0, 1.0]), np.array([2.0, 2.0])),
+              (100.0, np.array([0.0, 0.0]), np.array([3.0]))]
+
+    def test_no_repainting_is_identity(self):
+        table = SpotTable.from_layers(self.LAYERS)
+        assert paint_layers(table) is table
+
+    def test_paintings_conserve_mu(self):
+        layers = paint_layers(self.LAYERS, paintings=4, mu_min=1.0)
+        assert isinstance(layers, SpotTable)
+        assert [(e, w.tolist()) for e, _, w in layers] == [(70.0, [1.0, 1.0]), (70.0, [1.0, 1.0]), (100.0, [1.0]),
+                                                          (100.0, [1.0]), (100.0, [1.0])]
+        assert layers.layer.tolist() == [0, 0, 1, 1, 2, 3, 4]
+
+    def test_layered_order(self):
+        layers = paint_layers(self.LAYERS, paintings=2, mode='layered')
+        assert [e for e, _, _ in layers] == [70.0, 70.0, 100.0, 100.0]
+
+    def test_volumetric_order(self):
+        layers = paint_layers(self.LAYERS, paintings=2, mode='volumetric')
+        assert [e for e, _, _ in layers] == [70.0, 100.0, 70.0, 100.0]
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            paint_layers(self.LAYERS, paintings=2, mode='spiral')
+
+
+# ---------------------------------------------------------------------------
+# split_layers
+# ---------------------------------------------------------------------------
+
+class TestSplitLayers:
+    def test_equal_parts_share_the_columns(self):
+        coords, mu = np.arange(14.0), np.arange(7.0)
+        table = SpotTable.from_layers([(150.0, coords, mu), (100.0, coords[:4], mu[:2])])
+        layers = split_layers(table, max_spots=3)
+        assert [(e, len(w)) for e, _, w in layers] == [(150.0, 2), (150.0, 2), (150.0, 3), (100.0, 2)]
+        assert layers.xy[:7].ravel().tolist() == coords.tolist()
+        assert layers.weight[:7].tolist() == mu.tolist()
+        assert np.shares_memory(layers.xy, table.xy) and np.shares_memory(layers.weight, table.weight)
+
+    def test_no_limit_is_identity(self):
+        table = SpotTable.from_layers(TestPaintLayers.LAYERS)
+        assert split_layers(table) is table
+        assert split_layers(table, 2).bounds.tolist() == table.bounds.tolist()
+        with pytest.raises(ValueError):
+            split_layers(table, 0)
+
+
+# ---------------------------------------------------------------------------
+# CLI integration - repainted plan
+# ---------------------------------------------------------------------------
+
+class TestCLIIntegrationRepaint:
+    def test_repaint_arguments(self):
+        args = parse_arguments(["--repaint", "3", "--repaint_mode", "volumetric", "--min_mu_per_spot", "2",
+                                "square", "10", "10"])
+        model = get_model_from_args(args)
+        assert model.repaint_count == 3
+        assert model.repaint_mode == "volumetric"
+        assert model.spot_mu_min == 2.0
+        assert model.spot_mu_max is None
+
+    def test_repainted_control_points(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "repaint.dcm"
+        main(["-o", str(output), "--repaint", "4", "square", "4", "4", "--spacing", "1.0", "--mu-per-spot", "8"])
+        ds = pydicom.dcmread(output)
+        ib = ds.IonBeamSequence[0]
+        cps = ib.IonControlPointSequence
+        assert ib.NumberOfControlPoints == len(cps) == 8
+        cum = [float(cp.CumulativeMetersetWeight) for cp in cps]
+        assert cum == sorted(cum)
+        assert cum[-1] == pytest.approx(float(ib.FinalCumulativeMetersetWeight))
+        assert cum[-1] == pytest.approx(ds.FractionGroupSequence[0].ReferencedBeamSequence[0].BeamMeterset)
+        assert cum[-1] == pytest.approx(25 * 8.0)
+        assert all(w == pytest.approx(2.0) for w in cps[0].ScanSpotMetersetWeights)
+
+    def test_split_control_points(self, tmp_path):
+        from dicomplan.main import main
+        output = tmp_path / "split.dcm"
+        main(["-o", str(output), "--max_spots_per_cp", "10", "square", "4", "4", "--spacing", "1.0",
+              "--mu-per-spot", "2", "--energy", "150", "100"])
+        cps = pydicom.dcmread(output).IonBeamSequence[0].IonControlPointSequence
+        assert len(cps) == 12
+        assert [int(cp.NumberOfScanSpotPositions) for cp in cps[::2]] == [8, 8, 9] * 2
+        assert [float(cp.NominalBeamEnergy) for cp in cps[::2]] == [150.0] * 3 + [100.0] * 3
+        cum = [float(cp.CumulativeMetersetWeight) for cp in cps]
+        assert cum == pytest.approx([0, 16, 16, 32, 32, 50, 50, 66, 66, 82, 82, 100])
+        xy = np.concatenate([cp.ScanSpotPositionMap for cp in cps[0:6:2]]).reshape(-1, 2)
+        assert len(np.unique(xy, axis=0)) == 25
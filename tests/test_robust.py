@@ -0,0 +1,101 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from dicomplan.dose import FWHM_TO_SIGMA
+from dicomplan.main import main
+from dicomplan.robust import ScenarioErrors, metric_spread, robust_analysis, scenario_doses
+
+
+def _layers():
+    rng = np.random.default_rng(0)
+    return [(rng.uniform(-3, 3, 200), rng.uniform(0.5, 1.0, 100)), (rng.uniform(-2, 2, 100), rng.uniform(0.5, 1.0, 50))]
+
+
+FWHMS = [[0.86, 0.85], [1.2, 1.1]]
+
+
+def _exact(x, y, layers, fwhms, shift=(0.0, 0.0), size=(1.0, 1.0)):
+    """
+    Gaussian spot sum evaluated directly on the grid, fluence kept under spot size changes.
+    """
+    dose = np.zeros((len(x), len(y)))
+    for (coords, w), (fwhm_x, fwhm_y) in zip(layers, fwhms):
+        xy = np.asarray(coords).reshape(-1, 2) + shift
+        sx, sy = fwhm_x * FWHM_TO_SIGMA * size[0], fwhm_y * FWHM_TO_SIGMA * size[1]
+        gx = np.exp(-(x[:, None] - xy[None, :, 0])**2 / (2 * sx**2))
+        gy = np.exp(-(y[:, None] - xy[None, :, 1])**2 / (2 * sy**2))
+        dose += (gx * w / (size[0] * size[1])) @ gy.T
+    return dose
+
+
+def _scenarios(errors, n, seed=0):
+    return [(x, y, row, dose) for x, y, rows, doses in scenario_doses(_layers(), FWHMS, errors, n, seed=seed)
+            for row, dose in zip(rows, doses)]
+
+
+# ---------------------------------------------------------------------------
+# scenario_doses
+# ---------------------------------------------------------------------------
+
+class TestScenarioDoses:
+    def test_nominal_matches_gaussian_model(self):
+        x, y, row, dose = _scenarios(ScenarioErrors(systematic=0.2, spot_size=0.1), 1)[0]
+        exact = _exact(x, y, _layers(), FWHMS)
+        assert row['shift_x'] == 0.0 and row['spot_size_x'] == 1.0
+        assert np.abs(dose - exact).max() < 3e-3 * exact.max()
+
+    def test_shift_and_spot_size(self):
+        for x, y, row, dose in _scenarios(ScenarioErrors(systematic=0.3, spot_size=0.1), 5)[1:]:
+            exact = _exact(x, y, _layers(), FWHMS, (row['shift_x'], row['shift_y']),
+                           (row['spot_size_x'], row['spot_size_y']))
+            assert np.abs(dose - exact).max() < 3e-3 * exact.max()
+            assert dose.sum() == pytest.approx(exact.sum(), rel=1e-3)
+
+    def test_per_spot_errors_are_seeded(self):
+        errors = ScenarioErrors(random=0.05, mu=0.02)
+        first, second = _scenarios(errors, 4), _scenarios(errors, 4)
+        assert all(np.array_equal(a[3], b[3]) for a, b in zip(first, second))
+        nominal = first[0][3]
+        assert all(not np.allclose(dose, nominal) for _, _, _, dose in first[1:])
+        assert np.abs(nominal - _exact(first[0][0], first[0][1], _layers(), FWHMS)).max() < 3e-3 * nominal.max()
+
+    def test_invalid_errors(self):
+        with pytest.raises(ValueError):
+            ScenarioErrors(random=-0.1)
+
+
+# ---------------------------------------------------------------------------
+# robust_analysis / CLI integration
+# ---------------------------------------------------------------------------
+
+class TestRobustAnalysis:
+    def test_spread(self):
+        axis = np.arange(-5, 5.1, 0.5)
+        layers = [(np.stack(np.meshgrid(axis, axis), axis=-1).reshape(-1), np.ones(441))]
+        rows = robust_analysis(layers, [[0.86, 0.86]], ScenarioErrors(mu=0.05), scenarios=20, seed=1)
+        spread = metric_spread(rows)
+        assert len(rows) == 20
+        assert spread['flatness_x']['nominal'] < 0.5 < spread['flatness_x']['mean']
+        assert spread['field_size_x']['nominal'] == pytest.approx(10.5, abs=0.05)
+        assert spread['uniformity']['min'] <= spread['uniformity']['p5'] <= spread['uniformity']['nominal']
+
+    def test_cli(self, tmp_path, capsys):
+        output = tmp_path / "robust.csv"
+        assert main(["robust", "--base", "square 4 4 --energy 150", "--scenarios", "12", "--systematic", "0.1",
+                     "--random", "0.05", "--spot_size", "5", "--mu", "2", "--seed", "3", "--output", str(output)]) is None
+        assert "flatness_x" in capsys.readouterr().out
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 12 and rows[0]['shift_x'] == '0.0'
+
+        output = tmp_path / "robust.json"
+        main(["robust", "--base", "circle 4", "--scenarios", "3", "--mu", "1", "--output", str(output)])
+        report = json.loads(output.read_text())
+        assert len(report['scenarios']) == 3 and 'uniformity' in report['spread']
+
+    def test_base_must_build_a_plan(self, tmp_path):
+        assert main(["robust", "--base", "validate x", "--output", str(tmp_path / "robust.csv")]) == 1
+        assert not (tmp_path / "robust.csv").exists()
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+
+from dicomplan.main import main
+from dicomplan.spots import rim_mask
+from dicomplan.stats import nearest_indices, nearest_neighbour_distances, plan_statistics
+
+
+def _square(n=5, spacing=0.5):
+    axis = np.arange(n) * spacing
+    x, y = np.meshgrid(axis, axis, indexing='ij')
+    return np.column_stack((x.ravel(), y.ravel())).ravel()
+
+
+# ---------------------------------------------------------------------------
+# nearest_neighbour_distances / rim_mask
+# ---------------------------------------------------------------------------
+
+class TestNearestNeighbour:
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matches_brute_force(self, seed):
+        rng = np.random.default_rng(seed)
+        # dense cluster plus sparse outliers, so some neighbours lie many cells away
+        xy = np.concatenate((rng.normal(0, 0.05, (200, 2)), rng.uniform(-30, 30, (20, 2))))
+        d = np.hypot(xy[:, None, 0] - xy[None, :, 0], xy[:, None, 1] - xy[None, :, 1])
+        np.fill_diagonal(d, np.inf)
+        np.testing.assert_allclose(nearest_neighbour_distances(xy), d.min(axis=1))
+
+    def test_lattice_and_degenerate_inputs(self):
+        assert np.allclose(nearest_neighbour_distances(_square().reshape(-1, 2)), 0.5)
+        assert nearest_neighbour_distances(np.zeros((1, 2))).tolist() == [np.inf]
+        assert nearest_neighbour_distances(np.array([[1.0, 1.0], [1.0, 1.0], [4.0, 5.0]])).tolist() == [0.0, 0.0, 5.0]
+        line = np.column_stack((np.arange(10.0) ** 2, np.zeros(10)))
+        assert nearest_neighbour_distances(line).tolist() == [1, 1, 3, 5, 7, 9, 11, 13, 15, 17]
+
+
+class TestNearestIndices:
+    @pytest.mark.parametrize("seed", [0, 1])
+    def test_matches_brute_force(self, seed):
+        rng = np.random.default_rng(seed)
+        points, targets = rng.uniform(-5, 50, (3000, 2)), rng.uniform(0, 40, (500, 2))
+        targets = np.repeat(targets, 2, axis=0)  # equally near targets resolve to the first
+        d2 = ((points[:, None, :] - targets[None, :, :])**2).sum(axis=2)
+        np.testing.assert_array_equal(nearest_indices(points, targets), np.argmin(d2, axis=1))
+
+    def test_lattice_and_empty(self):
+        xy = _square().reshape(-1, 2)
+        np.testing.assert_array_equal(nearest_indices(xy + 0.1, xy), np.arange(len(xy)))
+        assert len(nearest_indices(np.empty((0, 2)), xy)) == 0
+        with pytest.raises(ValueError):
+            nearest_indices(xy, np.empty((0, 2)))
+
+
+class TestRimMask:
+    def test_square(self):
+        mask = rim_mask(_square()).reshape(5, 5)
+        assert mask.sum() == 16
+        assert not mask[1:4, 1:4].any()
+
+    def test_unordered_spots(self):
+        coords = _square().reshape(-1, 2)
+        order = np.random.default_rng(0).permutation(len(coords))
+        np.testing.assert_array_equal(rim_mask(coords[order].ravel()), rim_mask(_square())[order])
+
+
+# ---------------------------------------------------------------------------
+# plan_statistics / CLI integration
+# ---------------------------------------------------------------------------
+
+class TestPlanStatistics:
+    def test_layers(self):
+        layers = [(200.0, _square(), np.linspace(1.0, 2.0, 25)), (150.0, _square(3, 1.0), np.full(9, 3.0))]
+        stats = plan_statistics(layers)
+        assert stats['spots'] == 34
+        assert stats['total_mu'] == pytest.approx(37.5 + 27.0)
+        assert stats['mu_per_spot']['min'] == 1.0 and stats['mu_per_spot']['max'] == 3.0
+        assert sum(stats['mu_per_spot']['histogram']['counts']) == 34
+        first, second = stats['layer_stats']
+        assert first['bbox'] == pytest.approx([0.0, 0.0, 20.0, 20.0])
+        assert (first['rim_spots'], first['interior_spots']) == (16, 9)
+        assert (second['rim_spots'], second['interior_spots']) == (8, 1)
+        assert first['spacing_median'] == 5.0 and second['spacing_median'] == 10.0
+        assert stats['density']['max'] == 4.0  # 2 x 2 spots per cm2 at 5 mm spacing
+
+    def test_no_spots(self):
+        with pytest.raises(ValueError):
+            plan_statistics([])
+
+
+class TestCLIIntegrationStats:
+    def test_stats_json(self, tmp_path):
+        path = tmp_path / "stats.json"
+        main(["--stats", str(path), "-o", str(tmp_path / "plan.dcm"), "square", "4", "4", "--spacing", "0.4",
+              "--energy", "200", "150", "--boost_rim", "2"])
+        stats = json.loads(path.read_text())
+        assert stats['layers'] == 2
+        assert stats['spacing']['min'] == stats['spacing']['max'] == 4.0
+        assert stats['rim_spots'] == 2 * 40
+        # rim spots carry twice the MU of interior spots
+        assert stats['mu_per_spot']['max'] == pytest.approx(2 * stats['mu_per_spot']['min'])
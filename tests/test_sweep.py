@@ -0,0 +1,124 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from dicomplan.config_parser import parse_arguments, get_model_from_args
+from dicomplan.dose import dose_grid, field_metrics
+from dicomplan.main import main
+from dicomplan.sweep import apply_point, parse_parameters, parse_values, plan_filename, sweep_points
+
+
+def _base(*args):
+    return get_model_from_args(parse_arguments(list(args)))
+
+
+# ---------------------------------------------------------------------------
+# sweep parameters
+# ---------------------------------------------------------------------------
+
+class TestSweepParameters:
+    def test_parse_range_is_inclusive(self):
+        assert parse_values("70:230:40") == [70.0, 110.0, 150.0, 190.0, 230.0]
+        assert parse_values("0.3:0.5:0.1") == [0.3, 0.4, 0.5]
+
+    def test_parse_list(self):
+        assert parse_values("1,1.5, 2") == [1.0, 1.5, 2.0]
+
+    def test_bad_range(self):
+        with pytest.raises(ValueError):
+            parse_values("1:2")
+
+    def test_integer_attribute(self):
+        parameters = parse_parameters(["repaint_count=1:3:1"], _base("circle", "6"))
+        assert parameters == {"repaint_count": [1, 2, 3]}
+
+    def test_unknown_attribute(self):
+        with pytest.raises(ValueError):
+            parse_parameters(["spot_shape=1,2"], _base("circle", "6"))
+
+    @pytest.mark.parametrize("spec,args", [
+        ("spot_energy=100,150", ["square", "4", "4", "--energy", "180", "120"]),
+        ("spot_spacing=0.3,0.4", ["square", "4", "4", "--spacing_sigma", "1.0"]),
+        ("field_size=3,4", ["compose", "square(6) - circle(2)"]),
+    ])
+    def test_ignored_parameter(self, spec, args):
+        with pytest.raises(ValueError, match="no effect"):
+            parse_parameters([spec], _base(*args))
+
+    def test_points_are_lazy_and_ordered(self):
+        points = sweep_points({"spot_energy": [70.0, 100.0], "spot_spacing": [0.3, 0.5]})
+        assert next(points) == (0, {"spot_energy": 70.0, "spot_spacing": 0.3})
+        assert next(points) == (1, {"spot_energy": 70.0, "spot_spacing": 0.5})
+
+    def test_filename(self):
+        assert plan_filename({"spot_energy": 70.0, "spot_spacing": 0.3}) == "spot_energy-70_spot_spacing-0.3.dcm"
+
+    def test_field_size(self):
+        square = apply_point(_base("square", "10", "10", "--xoffset", "1"), {"field_size": 4.0})
+        assert square.spot_xymin == [-1.0, -2.0]
+        assert square.spot_xymax == [3.0, 2.0]
+        assert apply_point(_base("circle", "6"), {"field_size": 4.0}).spot_diameter == 4.0
+
+
+# ---------------------------------------------------------------------------
+# field_metrics
+# ---------------------------------------------------------------------------
+
+class TestFieldMetrics:
+    def test_square_field(self):
+        g = np.arange(-5.0, 5.01, 0.5)
+        X, Y = np.meshgrid(g, g, indexing="ij")
+        coords = np.column_stack((X.ravel(), Y.ravel())).ravel()
+        metrics = field_metrics(*dose_grid(coords, np.ones(len(coords) // 2), [1.0, 1.0]))
+        assert metrics["field_size_x"] == pytest.approx(10.5, abs=0.05)
+        assert metrics["field_size_y"] == pytest.approx(10.5, abs=0.05)
+        assert metrics["flatness_x"] < 1.0
+        assert 0.95 < metrics["uniformity"] <= 1.0
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLISweep:
+    def test_ignored_parameter_is_an_error(self, tmp_path):
+        out = tmp_path / "sweep"
+        assert main(["sweep", str(out), "--base", "square 4 4 --energy 180 120", "--vary", "spot_energy=100,150"]) == 1
+        assert not out.exists()
+
+    def test_base_must_build_a_plan(self, tmp_path):
+        out = tmp_path / "sweep"
+        assert main(["sweep", str(out), "--base", "validate x", "--vary", "spot_mu=1,2"]) == 1
+        assert not out.exists()
+
+    def test_csv_summary(self, tmp_path):
+        out = tmp_path / "sweep"
+        assert main(["sweep", str(out), "--base", "circle 4", "--vary", "spot_energy=100,150",
+                     "--vary", "field_size=3,4", "--metrics"]) is None
+        with open(out / "summary.csv") as f:
+            rows = list(csv.DictReader(f))
+        assert [row["file"] for row in rows] == [
+            "spot_energy-100_field_size-3.dcm", "spot_energy-100_field_size-4.dcm",
+            "spot_energy-150_field_size-3.dcm", "spot_energy-150_field_size-4.dcm"]
+        assert all((out / row["file"]).exists() for row in rows)
+        assert int(rows[1]["spots"]) > int(rows[0]["spots"])
+        assert float(rows[0]["total_mu"]) == pytest.approx(10.0 * int(rows[0]["spots"]))
+        assert float(rows[0]["field_size_x"]) > 0
+
+    def test_parallel_json_summary(self, tmp_path):
+        out = tmp_path / "sweep"
+        summary = tmp_path / "summary.json"
+        assert main(["sweep", str(out), "--base", "square 3 3", "--vary", "spot_spacing=0.3:0.6:0.1",
+                     "-j", "2", "--summary", str(summary)]) is None
+        rows = json.loads(summary.read_text())
+        assert [row["index"] for row in rows] == [0, 1, 2, 3]
+        assert [row["spot_spacing"] for row in rows] == [0.3, 0.4, 0.5, 0.6]
+
+    def test_failed_plan_is_reported(self, tmp_path):
+        out = tmp_path / "sweep"
+        assert main(["sweep", str(out), "--base", "-tm tr4 circle 4", "--vary", "spot_mu=0.5,10"]) == 1
+        with open(out / "summary.csv") as f:
+            rows = list(csv.DictReader(f))
+        assert [row["written"] for row in rows] == ["False", "True"]
@@ -0,0 +1,134 @@
+import numpy as np
+import pydicom
+import pytest
+
+from dicomplan.config_parser import parse_arguments
+from dicomplan.machine import load_machine
+from dicomplan.main import main
+from dicomplan.reader import beam_arrays
+from dicomplan.validate import has_errors, validate_dataset
+
+
+def _write_plan(tmp_path, *args):
+    output = tmp_path / "plan.dcm"
+    assert main(["-o", str(output), *args]) is None
+    return output
+
+
+def _checks(issues, severity='error'):
+    return {issue.check for issue in issues if issue.severity == severity}
+
+
+# ---------------------------------------------------------------------------
+# reader
+# ---------------------------------------------------------------------------
+
+class TestBeamArrays:
+    def test_spot_arrays_from_file(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "2", "2", "--spacing", "0.5", "--mu-per-spot", "5"))
+        beam, = beam_arrays(ds)
+        assert beam.nspots.tolist() == [25, 25]
+        assert beam.xy.shape == (50, 2)
+        assert beam.weight_sums.tolist() == pytest.approx([125.0, 0.0])
+        assert beam.cumulative_weight.tolist() == pytest.approx([0.0, 125.0])
+        assert beam.energy.tolist() == [120.0, 120.0]
+
+    def test_deferred_read(self, tmp_path):
+        output = _write_plan(tmp_path, "circle", "3")
+        ds = pydicom.dcmread(output, defer_size=64)
+        beam, = beam_arrays(ds)
+        assert beam.xy.shape[0] == 2 * beam.nspots[0]
+
+
+# ---------------------------------------------------------------------------
+# validate_dataset
+# ---------------------------------------------------------------------------
+
+class TestValidateDataset:
+    def test_generated_plan_is_valid(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        assert validate_dataset(ds) == []
+
+    def test_cumulative_weight_mismatch(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        cp = ds.IonBeamSequence[0].IonControlPointSequence[1]
+        cp.CumulativeMetersetWeight = cp.CumulativeMetersetWeight + 5.0
+        issues = validate_dataset(ds)
+        assert has_errors(issues)
+        assert _checks(issues) == {'meterset'}
+
+    def test_energy_out_of_range(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        ds.IonBeamSequence[0].IonControlPointSequence[0].NominalBeamEnergy = 300.0
+        assert 'energy' in _checks(validate_dataset(ds))
+
+    def test_spot_below_min_mu(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        cp = ds.IonBeamSequence[0].IonControlPointSequence[0]
+        weights = np.array(cp.ScanSpotMetersetWeights, dtype=np.float32)
+        weights[0] = 0.2
+        cp.ScanSpotMetersetWeights = weights.tolist()
+        issues = validate_dataset(ds, load_machine("tr4"))
+        assert 'MU' in _checks(issues)
+
+    def test_spot_count_mismatch(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        ds.IonBeamSequence[0].IonControlPointSequence[0].NumberOfScanSpotPositions = 3
+        assert 'spot count' in _checks(validate_dataset(ds))
+
+    def test_duplicates_are_warnings(self, tmp_path):
+        ds = pydicom.dcmread(_write_plan(tmp_path, "square", "4", "4"))
+        cp = ds.IonBeamSequence[0].IonControlPointSequence[0]
+        positions = np.array(cp.ScanSpotPositionMap, dtype=np.float32)
+        positions[2:4] = positions[0:2]
+        cp.ScanSpotPositionMap = positions.tolist()
+        issues = validate_dataset(ds)
+        assert not has_errors(issues)
+        assert _checks(issues, 'warning') == {'duplicates'}
+
+
+# ---------------------------------------------------------------------------
+# CLI integration
+# ---------------------------------------------------------------------------
+
+class TestCLIValidate:
+    def test_validate_subcommand_parsed(self):
+        args = parse_arguments(["validate", "a.dcm", "b.dcm", "--machine", "tr4"])
+        assert args.pattern_type == "validate"
+        assert args.files == ["a.dcm", "b.dcm"]
+
+    def test_validate_ok(self, tmp_path, capsys):
+        output = _write_plan(tmp_path, "circle", "4")
+        assert main(["validate", str(output)]) == 0
+        assert "OK" in capsys.readouterr().out
+
+    def test_validate_broken_plan(self, tmp_path, capsys):
+        output = _write_plan(tmp_path, "circle", "4")
+        ds = pydicom.dcmread(output)
+        ds.IonBeamSequence[0].FinalCumulativeMetersetWeight = 1.0
+        ds.save_as(output)
+        assert main(["validate", str(output)]) == 1
+        assert "ERROR" in capsys.readouterr().out
+
+    def test_paths_printed_as_given(self, tmp_path, monkeypatch, capsys):
+        # OK and issue lines both print the path as given on the command line
+        monkeypatch.chdir(tmp_path)
+        _write_plan(tmp_path, "circle", "4")
+        broken = tmp_path / "broken.dcm"
+        ds = pydicom.dcmread(tmp_path / "plan.dcm")
+        ds.IonBeamSequence[0].FinalCumulativeMetersetWeight = 1.0
+        ds.save_as(broken)
+        main(["validate", "./plan.dcm", "./broken.dcm"])
+        lines = capsys.readouterr().out.splitlines()
+        assert "./plan.dcm: OK" in lines
+        assert lines[-1].startswith("./broken.dcm: ")
+
+    def test_invalid_plan_not_written(self, tmp_path):
+        output = tmp_path / "big.dcm"
+        assert main(["-o", str(output), "square", "32", "4"]) == 1
+        assert not output.exists()
+
+    def test_force_writes_invalid_plan(self, tmp_path):
+        output = tmp_path / "big.dcm"
+        assert main(["--force", "-o", str(output), "square", "32", "4"]) is None
+        assert output.exists()
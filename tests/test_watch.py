@@ -0,0 +1,93 @@
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from dicomplan.config_parser import parse_arguments
+from dicomplan.watch import PlanWatcher, read_manifest
+
+
+def _touch_later(path):
+    """Advance the modification time, so the change is seen even on coarse file system clocks."""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    Image.new("L", (20, 20), 60).save(tmp_path / "field.png")
+    path = tmp_path / "plans.txt"
+    path.write_text(f"# commissioning plans\n"
+                    f"-o {tmp_path / 'image.dcm'} image 4 4 {tmp_path / 'field.png'}\n"
+                    f"\n"
+                    f"dicomplan -o {tmp_path / 'circle.dcm'} circle 4\n")
+    return path
+
+
+# ---------------------------------------------------------------------------
+# read_manifest
+# ---------------------------------------------------------------------------
+
+class TestReadManifest:
+    def test_entries_and_dependencies(self, manifest, tmp_path):
+        entries = read_manifest(str(manifest))
+        assert len(entries) == 2
+        assert entries[0].dependencies == [str(tmp_path / "field.png")]
+        assert entries[1].dependencies == []
+        assert entries[1].args.pattern_type == "circle"
+
+    def test_invalid_lines_are_skipped(self, tmp_path):
+        path = tmp_path / "plans.txt"
+        path.write_text("-o a.dcm nonsense\nvalidate a.dcm\n-o b.dcm circle 4\n")
+        assert [e.args.output for e in read_manifest(str(path))] == ["b.dcm"]
+
+    def test_watch_subcommand_parsed(self):
+        args = parse_arguments(["watch", "plans.txt", "--poll", "--debounce", "0.1"])
+        assert args.pattern_type == "watch"
+        assert args.poll is True
+        assert args.debounce == 0.1
+
+
+# ---------------------------------------------------------------------------
+# PlanWatcher
+# ---------------------------------------------------------------------------
+
+class TestPlanWatcher:
+    def test_first_update_builds_all(self, manifest, tmp_path):
+        watcher = PlanWatcher(str(manifest), use_inotify=False)
+        built = watcher.update()
+        assert sorted(built) == sorted([str(tmp_path / "image.dcm"), str(tmp_path / "circle.dcm")])
+        assert watcher.update() == []
+
+    def test_image_change_rebuilds_affected_plan_only(self, manifest, tmp_path):
+        watcher = PlanWatcher(str(manifest), use_inotify=False)
+        watcher.update()
+        Image.new("L", (20, 20), 120).save(tmp_path / "field.png")
+        _touch_later(tmp_path / "field.png")
+        assert watcher.update() == [str(tmp_path / "image.dcm")]
+
+    def test_new_manifest_line_is_built(self, manifest, tmp_path):
+        watcher = PlanWatcher(str(manifest), use_inotify=False)
+        watcher.update()
+        with open(manifest, "a") as f:
+            f.write(f"-o {tmp_path / 'square.dcm'} square 3 3\n")
+        _touch_later(manifest)
+        assert watcher.update() == [str(tmp_path / "square.dcm")]
+
+    def test_run_with_inotify(self, manifest, tmp_path):
+        watcher = PlanWatcher(str(manifest), poll_interval=0.05, debounce=0.05)
+
+        def add_plan():
+            with open(manifest, "a") as f:
+                f.write(f"-o {tmp_path / 'square.dcm'} square 3 3\n")
+            _touch_later(manifest)
+
+        timer = threading.Timer(0.5, add_plan)
+        timer.start()
+        try:
+            watcher.run(max_updates=1)
+        finally:
+            timer.cancel()
+            watcher.close()
+        assert (tmp_path / "square.dcm").exists()